@@ -1,79 +1,123 @@
 import sys
+import signal
+import threading
 import logging
 import click
-from dataclasses import dataclass
 
 # import __version__
-import dca
-import dips
-from users import Account
-import data
 import database
+import stats
+import notifications
+import metrics
+import paper
+import sharding
+from bot import Bot
 
 
 log_format = '%(asctime)s - %(levelname)-8s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=log_format, datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger()
 
-@dataclass
-class Bot():
-    accounts: list[Account]
-
-    def _get_all_symbols(self) -> set[str]:
-        symbols = []
-        tmp = database.get_symbols_stats()
-        if tmp:
-            symbols = tmp.keys()
-
-        return set(symbols)
-
-    def run(self, dry_run: bool):
-        for account in self.accounts:
-            if dry_run:
-                logger.info('Running in simmulation mode. Balances will not be affected')
-            logger.info(f'Checking information for user with id {account.user_id}')
-
-            if account.dca_config:
-                logger.info(f'Checking recurrent purchases for the DCA strategy')
-                summary = account.get_summary(dry_run)
-                if summary:
-                    account.telegram_bot.send_msg(summary)
-                    database.update_last_contact(account.user_id)
-                
-                dca.buy(account, dry_run)
-            else:
-                logger.info(f'No DCA config found for user id {account.user_id}')
-            
-            if account.dips_config:
-                logger.info(f'Checking price drops for the dip buying strategy')
-                all_symbols = database.get_symbols()
-                symbols_stats = database.get_symbols_stats() # TODO Calculate again if older than x days
-                if not symbols_stats or not all(symbol in symbols_stats for symbol in all_symbols):
-                    logger.info(f'Getting information for symbols {", ".join(all_symbols)}')
-                    std_devs = data.get_std_dev(account.exchange, all_symbols)
-                    database.load_symbol_stats(std_devs)
-                    symbols_stats = database.get_symbols_stats()
-                
-                dips.buy_dips(account, symbols_stats, dry_run)
-            else:
-                logger.info(f'No dips config found for user id {account.user_id}')
-
 
 @click.command()
 @click.option('-v', '--verbose', is_flag=True, help="Print verbose messages while excecuting")
 @click.option('--dry-run', is_flag=True, help="Run in simulation mode (Don't affect balances)")
-def main(verbose, dry_run):
+@click.option('-w', '--workers', default=1, show_default=True, type=click.IntRange(min=1), 
+                help="Number of accounts to process concurrently")
+@click.option('--ticker-ttl', default=60, show_default=True, type=click.FloatRange(min=0), 
+                help="Seconds for which tickers fetched in a cycle are reused before requesting them again")
+@click.option('-u', '--user-id', 'user_ids', multiple=True, type=int, 
+                help="Only process the account of this user id. Can be repeated")
+@click.option('--stats-ttl', default=stats.STATS_TTL, show_default=True, type=click.FloatRange(min=0), 
+                help="Hours after which the volatility stats of a symbol are updated")
+@click.option('-d', '--daemon', is_flag=True, help="Keep running and start a new cycle every --frequency minutes")
+@click.option('-f', '--frequency', default=10, show_default=True, type=click.FloatRange(min=0, min_open=True), 
+                help="Minutes between the start of consecutive cycles in daemon mode")
+@click.option('--stream', 'streaming', is_flag=True, 
+                help="Buy dips as soon as the exchange pushes a ticker, instead of polling in cycles")
+@click.option('--replay', 'replay_file', type=click.Path(exists=True), 
+                help="Buy dips from the tickers recorded in a file, in simulation mode")
+@click.option('--speed', default=0, show_default=True, type=click.FloatRange(min=0), 
+                help="Replay speed relative to the recorded times (0 replays as fast as possible)")
+@click.option('--record', 'record_file', type=click.Path(), 
+                help="Append the tickers received with --stream to a file that can be replayed")
+@click.option('--metrics-dir', type=click.Path(file_okay=False), 
+                help="Write Prometheus and JSON metrics to this directory at the end of each cycle")
+@click.option('--profile', type=click.Choice(['cprofile', 'pyinstrument']), 
+                help="Profile the run and save the result to --metrics-dir (or the current directory)")
+@click.option('--shard', 'shard_spec', 
+                help="Only process the users with user_id % N == i, given as i/N, or the shards of N whose leases "
+                        "this worker holds, given as auto/N. Orders are claimed in the database before being placed")
+@click.option('--lease-ttl', default=sharding.LEASE_TTL, show_default=True, type=click.FloatRange(min=1), 
+                help="Seconds after which the shards of a worker that stopped renewing them are taken by others")
+@click.option('--paper-fee', default=paper.FEE_RATE, show_default=True, type=click.FloatRange(0, 1), 
+                help="Fee rate charged to the simulated orders of dry runs and dummy configs")
+@click.option('--paper-slippage', default=paper.SLIPPAGE, show_default=True, type=click.FloatRange(min=0), 
+                help="Fraction added to the price of simulated market orders")
+@click.option('--paper-balance', default=paper.INITIAL_BALANCE, show_default=True, type=click.FloatRange(min=0), 
+                help="Initial paper balance of each quote currency for simulated orders")
+def main(verbose, dry_run, workers, ticker_ttl, user_ids, stats_ttl, daemon, frequency, 
+            streaming, replay_file, speed, record_file, metrics_dir, profile, shard_spec, lease_ttl, 
+            paper_fee, paper_slippage, paper_balance):
     # logger.info(f'BTCLab version {__version__}')
     if verbose:
         logger.setLevel(logging.DEBUG)
+    paper.FEE_RATE, paper.SLIPPAGE, paper.INITIAL_BALANCE = paper_fee, paper_slippage, paper_balance
+
+    shard = None
+    if shard_spec:
+        try:
+            index, shards = sharding.parse_shard(shard_spec)
+        except ValueError as error:
+            raise click.BadParameter(str(error), param_hint='--shard')
+        shard = sharding.Shard(shards, index, lease_ttl)
 
     database.create_db()
-    accounts = database.get_users()
-    if len(accounts) == 0:
+    notifications.start()
+    bot = Bot([], workers, ticker_ttl, stats_ttl, user_ids or None, metrics_dir=metrics_dir, shard=shard)
+    try:
+        with metrics.profile(profile, metrics_dir or '.'):
+            if streaming or replay_file:
+                _run_stream(bot, dry_run, replay_file, speed, record_file)
+            else:
+                _run(bot, dry_run, daemon, frequency)
+    finally:
+        if shard is not None:
+            shard.release()
+        notifications.stop()
+        database.close_connections()
+
+
+def _run_stream(bot, dry_run, replay_file, speed, record_file):
+    if replay_file and not dry_run:
+        logger.info('Replaying tickers in simulation mode')
+        dry_run = True
+
+    bot.reload_accounts()
+    try:
+        bot.run_stream(dry_run, replay_file, speed, record_file)
+    except KeyboardInterrupt:
+        logger.info('Ticker feed stopped')
+
+
+def _run(bot, dry_run, daemon, frequency):
+    if daemon:
+        stop = threading.Event()
+        def request_stop(signum, frame):
+            logger.info(f'Received signal {signal.Signals(signum).name}. Stopping after the current cycle')
+            stop.set()
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        logger.info(f'Running in daemon mode every {frequency:g} minutes')
+        bot.run_forever(dry_run, frequency, stop)
+        return
+
+    bot.reload_accounts()
+    if len(bot.accounts) == 0:
         logger.info('No user accounts found. Create a user account and try again')
         sys.exit()
 
-    bot = Bot(accounts)
     bot.run(dry_run)
 
 
@@ -0,0 +1,219 @@
+import os
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import click
+import numpy as np
+import pandas as pd
+
+# Relative when installed as the btclab package (btclab-backtest), flat when run as a script
+try:
+    from .pricestore import PriceStore, STORE_DIR
+except ImportError:
+    from pricestore import PriceStore, STORE_DIR
+
+
+DAYS_IN_A_YEAR = 365.25
+
+
+@dataclass
+class Thresholds():
+    """
+    Limits for atypical returns based on the interquartile range (IQR), as
+    calculated in the notebooks: lower/upper outliers are 1.5 IQR below Q1/above Q3
+    and extreme outliers are 3 IQR away
+    """
+    std: float
+    lower: float
+    upper: float
+    extreme_lower: float
+    extreme_upper: float
+
+    @classmethod
+    def from_returns(cls, returns: np.ndarray) -> 'Thresholds':
+        q1, q3 = np.nanpercentile(returns, [25, 75])
+        iqr = q3 - q1
+        return cls(std=float(np.nanstd(returns, ddof=1)),
+                    lower=q1 - 1.5 * iqr,
+                    upper=q3 + 1.5 * iqr,
+                    extreme_lower=q1 - 3 * iqr,
+                    extreme_upper=q3 + 3 * iqr)
+
+
+@dataclass
+class BacktestResult():
+    strategy: str
+    invested: np.ndarray        # Quote currency spent in each purchase
+    units: np.ndarray           # Units of the asset acquired in each purchase
+    total_invested: float
+    total_units: float
+    final_value: float          # Value of total_units at the final price
+    total_return: float         # Percentage
+    cagr: float
+
+    def summary(self) -> dict:
+        return {
+            'strategy': self.strategy,
+            'purchases': int(np.count_nonzero(self.invested)),
+            'total_invested': self.total_invested,
+            'total_units': self.total_units,
+            'final_value': self.final_value,
+            'total_return': self.total_return,
+            'cagr': self.cagr,
+        }
+
+
+def fixed(returns: np.ndarray, usdt: float, **kwargs) -> np.ndarray:
+    """
+    Invests the same amount in every purchase (DCA_simple)
+    """
+    return np.full(returns.shape, usdt, dtype=float)
+
+
+def outlier_scaled(returns: np.ndarray, usdt: float, thresholds: Thresholds, variation: float = 1,
+                    **kwargs) -> np.ndarray:
+    """
+    Invests usdt * (1 + variation) after an atypical drop, usdt * (1 - variation) after
+    an atypical rise and usdt otherwise (DCA_variable)
+    """
+    return np.select([returns < thresholds.lower, returns > thresholds.upper],
+                        [usdt * (1 + variation), usdt * (1 - variation)], usdt)
+
+
+def drop_proportional(returns: np.ndarray, usdt: float, **kwargs) -> np.ndarray:
+    """
+    Invests 2 * usdt * (1 + |return|) after a drop and usdt otherwise (DCA_variable_caida)
+    """
+    return np.where(returns < 0, 2 * usdt * (1 + np.abs(returns)), usdt)
+
+
+def sd_scaled(returns: np.ndarray, usdt: float, thresholds: Thresholds, **kwargs) -> np.ndarray:
+    """
+    Increases the amount invested by the size of the outlier limit crossed by a drop,
+    and skips the purchase after an atypical rise (DCA_variable_atipicos). Unlike the
+    notebook, drops beyond the extreme limit get the extreme increase
+    """
+    return np.select([returns < thresholds.extreme_lower, returns < thresholds.lower, returns > thresholds.upper],
+                        [usdt * (1 + abs(thresholds.extreme_lower)), usdt * (1 + abs(thresholds.lower)), 0],
+                        usdt)
+
+
+STRATEGIES: dict[str, Callable] = {
+    'fixed': fixed,
+    'outlier_scaled': outlier_scaled,
+    'drop_proportional': drop_proportional,
+    'sd_scaled': sd_scaled,
+}
+
+
+def purchase_mask(dates: np.ndarray, weekday: Optional[int] = None, day: Optional[int] = None) -> np.ndarray:
+    """
+    Returns a boolean array that is True on the dates when a purchase is made: every
+    weekday (0 is Monday), every day of the month or every date if none is given
+    """
+    days = dates.astype('datetime64[D]')
+    mask = np.ones(days.shape, dtype=bool)
+    if weekday is not None:
+        # 1970-01-01 was a Thursday
+        mask &= (days.astype(np.int64) + 3) % 7 == weekday
+    if day is not None:
+        mask &= (days - days.astype('datetime64[M]')).astype(np.int64) + 1 == day
+    return mask
+
+
+def pct_change(prices: np.ndarray) -> np.ndarray:
+    returns = np.full(prices.shape, np.nan)
+    returns[1:] = prices[1:] / prices[:-1] - 1
+    return returns
+
+
+def cagr(total_return: float, start: np.datetime64, end: np.datetime64) -> float:
+    """
+    Compound annual growth rate of a total return (final / initial value) between two dates
+    """
+    years = (end - start).astype('timedelta64[D]').astype(np.int64) / DAYS_IN_A_YEAR
+    if years <= 0 or total_return <= 0:
+        return np.nan
+    return total_return ** (1 / years) - 1
+
+
+def run(dates: np.ndarray, prices: np.ndarray, usdt: float, strategy: str = 'fixed',
+        weekday: Optional[int] = None, day: Optional[int] = None, thresholds: Optional[Thresholds] = None,
+        final_price: Optional[float] = None, **params) -> BacktestResult:
+    """
+    Backtests a sizing rule over a daily price history. Purchases are made on the dates
+    selected by weekday/day and sized with the return since the previous purchase.
+    Outlier thresholds default to those of the daily returns of the whole history.
+    When no date is selected, nothing is invested and the returns are NaN
+    """
+    valid = ~np.isnan(prices)
+    dates, prices = dates[valid], prices[valid]
+    if thresholds is None:
+        thresholds = Thresholds.from_returns(pct_change(prices))
+
+    mask = purchase_mask(dates, weekday, day)
+    buy_dates, buy_prices = dates[mask], prices[mask]
+    if len(buy_prices) == 0:
+        return BacktestResult(strategy=strategy, invested=np.zeros(0), units=np.zeros(0), total_invested=0.0,
+                                total_units=0.0, final_value=0.0, total_return=np.nan, cagr=np.nan)
+    invested = STRATEGIES[strategy](pct_change(buy_prices), usdt, thresholds=thresholds, **params)
+    units = invested / buy_prices
+
+    total_invested = float(invested.sum())
+    total_units = float(units.sum())
+    final_price = buy_prices[-1] if final_price is None else final_price
+    final_value = total_units * final_price
+    ratio = final_value / total_invested if total_invested else np.nan
+
+    return BacktestResult(strategy=strategy,
+                            invested=invested,
+                            units=units,
+                            total_invested=total_invested,
+                            total_units=total_units,
+                            final_value=final_value,
+                            total_return=(ratio - 1) * 100,
+                            cagr=cagr(ratio, buy_dates[0], buy_dates[-1]))
+
+
+def load_prices(path: str, symbol: str, start: Optional[str] = None, end: Optional[str] = None) -> tuple:
+    """
+    Returns the dates and prices of a symbol from a price store directory or from a CSV 
+    with a date index and a column per symbol
+    """
+    if os.path.isdir(path):
+        dates, prices = PriceStore(path).load(symbol, start, end)
+        valid = ~np.isnan(prices)
+        return dates[valid], np.asarray(prices[valid])
+
+    df = pd.read_csv(path, index_col=0, parse_dates=True, usecols=lambda col: col in ('Unnamed: 0', symbol))
+    series = df[symbol].loc[start:end].dropna()
+    return series.index.values.astype('datetime64[D]'), series.to_numpy(dtype=float)
+
+
+@click.command()
+@click.option('--prices', 'path', default=STORE_DIR, show_default=True, type=click.Path(exists=True),
+                help="Price store directory, or CSV with daily prices and one column per symbol")
+@click.option('-s', '--symbol', default='BTC/USDT', show_default=True)
+@click.option('--start', help="First date of the backtest (YYYY-MM-DD)")
+@click.option('--end', help="Last date of the backtest (YYYY-MM-DD)")
+@click.option('--usdt', default=50.0, show_default=True, help="Base amount invested in each purchase")
+@click.option('--weekday', type=click.IntRange(0, 6), help="Buy every weekday (0 is Monday)")
+@click.option('--day', type=click.IntRange(1, 31), help="Buy every day of the month")
+@click.option('--variation', default=1.0, show_default=True, help="Variation factor of outlier_scaled")
+@click.option('--strategy', 'strategies', multiple=True, type=click.Choice(list(STRATEGIES)),
+                help="Sizing rule to backtest. Can be repeated (all by default)")
+def main(path, symbol, start, end, usdt, weekday, day, variation, strategies):
+    """Backtests DCA sizing rules over a price history"""
+    dates, prices = load_prices(path, symbol, start, end)
+    if len(prices) == 0:
+        raise click.ClickException(f'No prices found for {symbol}')
+    if not purchase_mask(dates, weekday, day).any():
+        raise click.ClickException(f'No purchase dates between {dates[0]} and {dates[-1]}')
+
+    results = [run(dates, prices, usdt, strategy, weekday, day, variation=variation).summary()
+                for strategy in strategies or STRATEGIES]
+    click.echo(pd.DataFrame(results).set_index('strategy').round(4).to_string())
+
+
+if __name__ == '__main__':
+    main()
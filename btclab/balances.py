@@ -0,0 +1,52 @@
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import retries
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BalanceSnapshot():
+    """
+    Free balances of an account during a bot cycle. They are requested with a single
+    fetch_balance call the first time they are needed and debited locally after each
+    order, so orders that would fail for insufficient funds can be skipped without
+    calling the exchange
+    """
+    exchange: object
+    free: Optional[dict] = None
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    @retries.with_backoff('fetch_balance')
+    def _fetch(self) -> dict:
+        logger.debug(f'Fetching balances from {self.exchange.id}')
+        balance = self.exchange.fetch_balance()
+        return {currency: values['free'] for currency, values in balance.items()
+                if isinstance(values, dict) and values.get('free') is not None}
+
+    def get_free(self, currency: str) -> float:
+        with self._lock:
+            if self.free is None:
+                self.free = self._fetch()
+            return self.free.get(currency, 0)
+
+    def has_funds(self, currency: str, cost: float) -> bool:
+        return self.get_free(currency) >= cost
+
+    def debit(self, currency: str, amount: float):
+        with self._lock:
+            if self.free is not None:
+                self.free[currency] = self.free.get(currency, 0) - amount
+
+    def invalidate(self):
+        """
+        Discards the balances, so they are fetched again the next time they are needed
+        """
+        with self._lock:
+            self.free = None
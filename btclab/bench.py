@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import tempfile
+import subprocess
+
+import click
+
+import database
+import exchanges
+import metrics
+import retries
+from bot import Bot
+from common import now_ms
+from fakeexchange import FakeExchange
+
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = 'benchmarks'
+USERS = (10, 100, 1000, 10000)
+# Metrics compared against a baseline, and whether they are timings (compared with
+# the tolerance) or counts (any increase is a regression)
+COMPARED = {'seconds': True, 'db_seconds': True, 'db_queries': False, 'api_calls': False}
+STARTUP_TARGET = 0.2        # Seconds to import the bot and run a cycle with nothing to do
+HEAVY_MODULES = ('ccxt', 'pandas', 'numpy', 'requests')
+# Runs the command line of the bot in a new interpreter and prints the seconds it took,
+# not counting the start of the interpreter, and the modules it loaded
+STARTUP_SCRIPT = """
+import sys, json, time, runpy
+start = time.perf_counter()
+try:
+    runpy.run_path('__main__.py', run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))
+"""
+
+
+def seed_db(users: int, configs: int, dummy_ratio: float = 0.5, seed: int = 0):
+    """
+    Inserts users with configs DCA and configs dip configurations each, on symbols of
+    the fake exchange
+    """
+    rng = random.Random(seed)
+    symbols = FakeExchange.get_symbols()
+    user_rows, dca_rows, dip_rows = [], [], []
+    for user_id in range(1, users + 1):
+        user_rows.append((user_id, f'User{user_id}', 'Bench', f'user{user_id}@example.com', now_ms(), FakeExchange.id,
+                            f'key{user_id}', f'secret{user_id}', 'bench-token', f'chat{user_id}'))
+        for symbol in rng.sample(symbols, configs):
+            dca_rows.append((user_id, symbol, rng.choice([10, 20, 50]), rng.choice([1, 7, 14, 30]),
+                                int(rng.random() < dummy_ratio)))
+        for symbol in rng.sample(symbols, configs):
+            units = rng.choice(['SD', '%'])
+            dip_rows.append((user_id, symbol, rng.choice([10, 20, 50]), 1.5 if units == 'SD' else 5, units,
+                                rng.choice([2, 3, 5]), int(rng.random() < dummy_ratio)))
+
+    conn = database.create_connection()
+    try:
+        conn.executemany("""INSERT INTO user (user_id, first_name, last_name, email, created_on, exchange_id,
+                                            api_key, api_secret, telegram_bot_token, telegram_chat_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", user_rows)
+        conn.executemany("""INSERT INTO dca_config (user_id, symbol, order_cost, frequency, is_dummy)
+                            VALUES (?, ?, ?, ?, ?)""", dca_rows)
+        conn.executemany("""INSERT INTO dip_config (user_id, symbol, order_cost, min_drop_value, min_drop_units,
+                                                    min_additional_drop_pct, is_dummy)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""", dip_rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _summarize_cycle(summary: dict) -> dict:
+    timers, counters = summary['timers'], summary['counters']
+    db_timers = timers.get('db_query_seconds', []) + timers.get('db_commit_seconds', [])
+    return {
+        'db_seconds': sum(timer['sum'] for timer in db_timers),
+        'db_queries': sum(timer['count'] for timer in timers.get('db_query_seconds', [])),
+        'api_calls': sum(counter['value'] for counter in counters.get('exchange_requests_total', [])),
+        'api_weight': sum(counter['value'] for counter in counters.get('exchange_weight_total', [])),
+        'api_errors': sum(counter['value'] for counter in counters.get('exchange_errors_total', [])),
+    }
+
+
+def run_benchmark(users: int, configs: int = 1, workers: int = 1, cycles: int = 2, dry_run: bool = False,
+                    seed: int = 0) -> list[dict]:
+    """
+    Runs cycles full bot cycles for users synthetic users in a temporary database, and
+    returns the duration, database time and API calls of loading the accounts and of
+    each cycle. The first cycle finds every symbol due and downloads the candles for
+    the volatility stats, the next ones run only the checks that are due again
+    """
+    with tempfile.TemporaryDirectory(prefix='btclab-bench-') as directory:
+        previous_db = os.environ.get('BTCLAB_DB')
+        os.environ['BTCLAB_DB'] = os.path.join(directory, 'bench.db')
+        database.close_connections()
+        try:
+            database.create_db()
+            seed_db(users, configs, seed=seed)
+            metrics.reset()
+            retries.reset()
+
+            bot = Bot([], workers)
+            start = time.perf_counter()
+            bot.reload_accounts()
+            results = [{'users': users, 'stage': 'load', 'seconds': time.perf_counter() - start,
+                        **_summarize_cycle(metrics.collect_cycle())}]
+            for cycle in range(1, cycles + 1):
+                elapsed = bot.run(dry_run)
+                results.append({'users': users, 'stage': f'cycle{cycle}', 'seconds': elapsed,
+                                **_summarize_cycle(metrics.collect_cycle())})
+            return results
+        finally:
+            database.close_connections()
+            if previous_db is None:
+                os.environ.pop('BTCLAB_DB', None)
+            else:
+                os.environ['BTCLAB_DB'] = previous_db
+
+
+def measure_startup(runs: int = 5) -> dict:
+    """
+    Runs the bot runs times in a new interpreter against an empty database, a cycle
+    that only finds there is nothing to do, and returns the fastest run and the heavy
+    modules it loaded, which should only be imported when an exchange is contacted
+    or the stats are rebuilt
+    """
+    best = None
+    with tempfile.TemporaryDirectory(prefix='btclab-startup-') as directory:
+        env = {**os.environ, 'BTCLAB_DB': os.path.join(directory, 'startup.db')}
+        for _ in range(runs):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        env=env, capture_output=True, text=True, check=True)
+            wall_seconds = time.perf_counter() - start
+            run = json.loads(process.stdout.splitlines()[-1])
+            if best is None or run['seconds'] < best['seconds']:
+                heavy = sorted({module.split('.')[0] for module in run['modules']}.intersection(HEAVY_MODULES))
+                best = {'seconds': run['seconds'], 'wall_seconds': wall_seconds, 'heavy_modules': heavy}
+    return best
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """
+    Returns a description of each metric of results that is worse than in baseline
+    for the same number of users and stage
+    """
+    baseline = {(row['users'], row['stage']): row for row in baseline}
+    regressions = []
+    for row in results:
+        base = baseline.get((row['users'], row['stage']))
+        if base is None:
+            continue
+        for name, is_timing in COMPARED.items():
+            limit = base[name] * (1 + tolerance) if is_timing else base[name]
+            if row[name] > limit and row[name] - base[name] > 1e-3:
+                regressions.append(f'{row["users"]} users, {row["stage"]}: {name} {base[name]:.4g} -> {row[name]:.4g}')
+    return regressions
+
+
+def format_results(results: list[dict]) -> str:
+    header = f'{"users":>7} {"stage":>7} {"seconds":>9} {"users/s":>9} {"db_s":>8} {"queries":>8} {"api":>7} {"weight":>8} {"errors":>7}'
+    lines = [header]
+    for row in results:
+        rate = row['users'] / row['seconds'] if row['seconds'] else float('nan')
+        lines.append(f'{row["users"]:>7} {row["stage"]:>7} {row["seconds"]:>9.3f} {rate:>9.0f} {row["db_seconds"]:>8.3f} '
+                        f'{row["db_queries"]:>8} {row["api_calls"]:>7g} {row["api_weight"]:>8g} {row["api_errors"]:>7g}')
+    return '\n'.join(lines)
+
+
+@click.command()
+@click.option('-n', '--users', 'user_counts', multiple=True, type=click.IntRange(min=1),
+                help=f"Number of synthetic users. Can be repeated (default {', '.join(map(str, USERS))})")
+@click.option('-m', '--configs', default=1, show_default=True, type=click.IntRange(min=1),
+                help="DCA and dip configs per user")
+@click.option('-w', '--workers', default=1, show_default=True, type=click.IntRange(min=1))
+@click.option('-c', '--cycles', default=2, show_default=True, type=click.IntRange(min=1))
+@click.option('--latency', default=0.0, show_default=True, type=click.FloatRange(min=0),
+                help="Milliseconds per request to the fake exchange")
+@click.option('--failure-rate', default=0.0, show_default=True, type=click.FloatRange(0, 1),
+                help="Probability of a request to the fake exchange failing with a network error")
+@click.option('--dry-run', is_flag=True, help="Run the cycles in simulation mode")
+@click.option('-o', '--output', 'output_dir', default=RESULTS_DIR, show_default=True, type=click.Path(file_okay=False),
+                help="Directory where results are saved")
+@click.option('-b', '--baseline', type=click.Path(exists=True, dir_okay=False),
+                help="Results file to compare with. Exits with status 1 if there are regressions")
+@click.option('--tolerance', default=0.25, show_default=True, type=click.FloatRange(min=0),
+                help="Relative increase in timings accepted before reporting a regression")
+@click.option('--startup', is_flag=True, 
+                help=f"Only measure the start of the bot with nothing to do. Exits with status 1 if it takes more "
+                        f"than {STARTUP_TARGET * 1000:.0f} ms or loads {', '.join(HEAVY_MODULES)}")
+def main(user_counts, configs, workers, cycles, latency, failure_rate, dry_run, output_dir, baseline, tolerance, startup):
+    """Benchmarks bot cycles with synthetic users against a simulated exchange"""
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)-8s - %(message)s')
+    if startup:
+        result = measure_startup()
+        click.echo(f'Startup: {result["seconds"] * 1000:.0f} ms ({result["wall_seconds"] * 1000:.0f} ms with the '
+                    f'interpreter). Heavy modules loaded: {", ".join(result["heavy_modules"]) or "none"}')
+        if result['seconds'] > STARTUP_TARGET or result['heavy_modules']:
+            click.echo(f'REGRESSION startup over {STARTUP_TARGET * 1000:.0f} ms or loading heavy modules')
+            sys.exit(1)
+        return
+
+    FakeExchange.latency = latency / 1000
+    FakeExchange.failure_rate = failure_rate
+    exchanges.register_exchange(FakeExchange.id, FakeExchange)
+
+    results = []
+    for users in user_counts or USERS:
+        click.echo(f'Running {cycles} cycle(s) with {users} users...', err=True)
+        results.extend(run_benchmark(users, configs, workers, cycles, dry_run))
+    click.echo(format_results(results))
+
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.join(output_dir, f'bench-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    params = {'configs': configs, 'workers': workers, 'cycles': cycles, 'latency_ms': latency,
+                'failure_rate': failure_rate, 'dry_run': dry_run}
+    with open(output, 'w') as f:
+        json.dump({'params': params, 'python': platform.python_version(), 'platform': platform.platform(),
+                    'results': results}, f, indent=1)
+    click.echo(f'Results saved to {output}', err=True)
+
+    if baseline:
+        with open(baseline) as f:
+            base = json.load(f)
+        if base['params'] != params:
+            click.echo(f'Warning: baseline parameters differ: {base["params"]}', err=True)
+        regressions = compare(results, base['results'], tolerance)
+        for regression in regressions:
+            click.echo(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        click.echo('No regressions found', err=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+import time
+import functools
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Optional
+
+import dca
+import dips
+from users import Account
+from market import MarketSnapshot
+import database
+import stats
+from common import Strategy
+from scheduler import Scheduler
+from sharding import Shard
+import exchanges
+import retries
+import metrics
+from retries import RetryLater
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Bot():
+    accounts: list[Account]
+    workers: int = 1
+    ticker_ttl: float = 60
+    stats_ttl: float = stats.STATS_TTL
+    user_ids: Optional[tuple[int]] = None
+    signatures: dict[int, int] = field(default_factory=dict)
+    scheduler: Scheduler = field(default_factory=Scheduler)
+    scheduled_users: set[int] = field(default_factory=set)
+    metrics_dir: Optional[str] = None
+    shard: Optional[Shard] = None
+
+    def _get_all_symbols(self) -> set[str]:
+        symbols = []
+        tmp = database.get_symbols_stats()
+        if tmp:
+            symbols = tmp.keys()
+
+        return set(symbols)
+
+    def reload_accounts(self) -> bool:
+        """
+        Reloads from the database only the accounts of users that were added or whose
+        data or configs changed since the last reload, and drops the ones that are no 
+        longer active or, when users are sharded, no longer in the shards of this 
+        worker. The other accounts, and their exchange clients, are kept.
+        Returns True if any account changed
+        """
+        signatures = database.get_users_signatures()
+        if self.user_ids:
+            signatures = {user_id: sign for user_id, sign in signatures.items() if user_id in self.user_ids}
+        if self.shard is not None:
+            self.shard.acquire()
+            signatures = {user_id: sign for user_id, sign in signatures.items() if self.shard.owns(user_id)}
+
+        changed = [user_id for user_id, sign in signatures.items() if self.signatures.get(user_id) != sign]
+        removed = set(self.signatures).difference(signatures)
+        if not changed and not removed:
+            return False
+
+        for user_id in removed.union(changed):
+            self.scheduler.remove_user(user_id)
+            self.scheduled_users.discard(user_id)
+
+        accounts = {account.user_id: account for account in self.accounts if account.user_id in signatures}
+        if changed:
+            for account in database.get_users(changed):
+                account.shard = self.shard
+                accounts[account.user_id] = account
+        self.accounts = list(accounts.values())
+        self.signatures = signatures
+        logger.info(f'Accounts reloaded: {len(changed)} added or changed, {len(removed)} removed')
+        return True
+
+    def run_forever(self, dry_run: bool, frequency: float, stop: threading.Event):
+        """
+        Runs a cycle every frequency minutes until stop is set. Cycles are scheduled
+        from a fixed start time, so the time a cycle takes does not delay the next ones
+        """
+        interval = frequency * 60
+        next_run = time.monotonic()
+        while not stop.is_set():
+            try:
+                self.reload_accounts()
+                if self.accounts:
+                    self.run(dry_run)
+                else:
+                    logger.info('No user accounts found. Waiting for a user account to be created')
+            except Exception:
+                logger.exception('Error while running cycle')
+
+            next_run += interval
+            now = time.monotonic()
+            if next_run <= now:
+                skipped = int((now - next_run) // interval) + 1
+                logger.warning(f'Cycle took longer than {frequency} minutes. Skipping {skipped} cycle(s)')
+                next_run += skipped * interval
+            stop.wait(next_run - now)
+        logger.info('Daemon stopped')
+
+    def _get_symbols_stats(self, exchange_id: str, accounts: list[Account]) -> dict:
+        """
+        Updates the stats of the dip symbols of accounts of an exchange with the candles
+        of that exchange, and returns the stats of all symbols
+        """
+        symbols = {symbol for account in accounts for symbol in account.dips_config}
+        return stats.refresh_symbols_stats(exchanges.get_public_client(exchange_id), symbols, self.stats_ttl)
+
+    def _get_market_snapshots(self, due: dict) -> dict[str, MarketSnapshot]:
+        """
+        Returns a market snapshot for each exchange with symbols due, loaded with
+        their tickers. Exchanges with nothing due are not contacted
+        """
+        markets = {}
+        for account in self.accounts:
+            for symbols in due.get(account.user_id, {}).values():
+                if not symbols:
+                    continue
+                if account.exchange_id not in markets:
+                    public_client = exchanges.get_public_client(account.exchange_id)
+                    markets[account.exchange_id] = MarketSnapshot(public_client, self.ticker_ttl)
+                markets[account.exchange_id].add_symbols(symbols)
+
+        for exchange_id, market in markets.items():
+            try:
+                market.refresh()
+            except Exception:
+                logger.exception(f'Unable to get tickers for exchange {exchange_id}')
+        return markets
+
+    def process_account(self, account: Account, symbols_stats: dict, dry_run: bool, 
+                        market: Optional[MarketSnapshot] = None, due: Optional[dict] = None):
+        """
+        Runs the DCA and dips strategies for a single account. Steps for the
+        same account always run in order, in the calling thread. If due is given,
+        only its symbols are checked for each strategy, and strategies with no
+        symbols due are skipped
+        """
+        logger.info(f'Checking information for user with id {account.user_id}')
+        account.start_cycle()
+
+        if account.dca_config:
+            logger.info(f'Checking recurrent purchases for the DCA strategy')
+            try:
+                summary = account.get_summary(dry_run, market)
+            except RetryLater as error:
+                logger.warning(f'Unable to prepare the summary for user {account.user_id}. {error}')
+                summary = None
+            if summary:
+                account.telegram_bot.send_msg(summary)
+                account.record_contact()
+            
+            symbols = None if due is None else due.get(Strategy.DCA, set())
+            if symbols is None or symbols:
+                with metrics.timer('strategy_seconds', strategy=Strategy.DCA.value):
+                    dca.buy(account, dry_run, market, symbols)
+        else:
+            logger.info(f'No DCA config found for user id {account.user_id}')
+        
+        if account.dips_config:
+            logger.info(f'Checking price drops for the dip buying strategy')
+            symbols = None if due is None else due.get(Strategy.BUY_THE_DIPS, set())
+            if symbols is None or symbols:
+                with metrics.timer('strategy_seconds', strategy=Strategy.BUY_THE_DIPS.value):
+                    dips.buy_dips(account, symbols_stats, dry_run, market, symbols)
+        else:
+            logger.info(f'No dips config found for user id {account.user_id}')
+
+    def _safe_process_account(self, account: Account, symbols_stats: dict, dry_run: bool, 
+                                market: MarketSnapshot, due: dict, now: float) -> bool:
+        """
+        Processes the due symbols of an account and schedules them again. Errors are
+        logged, so a failure in one account does not prevent the others from being processed
+        """
+        start = time.perf_counter()
+        try:
+            self.process_account(account, symbols_stats, dry_run, market, due)
+        except Exception:
+            logger.exception(f'Error while processing account of user with id {account.user_id}')
+            metrics.inc('account_errors_total')
+            return False
+        finally:
+            self.scheduler.reschedule(account, due, dry_run, now)
+            metrics.observe('account_seconds', time.perf_counter() - start, user_id=account.user_id)
+        return True
+
+    def run_stream(self, dry_run: bool, replay_file: Optional[str] = None, speed: float = 0,
+                    record_file: Optional[str] = None):
+        """
+        Buys dips as the tickers of a feed arrive instead of polling in cycles: the
+        tickers pushed by each exchange in use or, if replay_file is given, the ones
+        recorded in it
+        """
+        import asyncio
+        import stream
+        from stream import DipStream
+
+        accounts = [account for account in self.accounts if account.dips_config]
+        if not accounts:
+            logger.info('No dips config found. Nothing to stream')
+            return
+
+        if replay_file:
+            dip_stream = DipStream(accounts, database.get_symbols_stats(), dry_run)
+            asyncio.run(dip_stream.run(stream.replay(replay_file, speed)))
+            return
+
+        runs = []
+        for exchange_id in sorted({account.exchange_id for account in accounts}):
+            exchange_accounts = [account for account in accounts if account.exchange_id == exchange_id]
+            refresh_stats = functools.partial(self._get_symbols_stats, exchange_id, exchange_accounts)
+            dip_stream = DipStream(exchange_accounts, refresh_stats(), dry_run)
+            feed = stream.watch_tickers(exchange_id, dip_stream.symbols)
+            if record_file:
+                feed = stream.record(feed, record_file)
+            logger.info(f'Streaming tickers of {len(dip_stream.symbols)} symbol(s) from {exchange_id}')
+            runs.append(dip_stream.run(feed, refresh_stats))
+
+        async def run_all():
+            await asyncio.gather(*runs)
+        asyncio.run(run_all())
+
+    def run(self, dry_run: bool) -> float:
+        """
+        Runs a cycle for all accounts and returns its wall-clock duration in seconds
+        """
+        start = time.perf_counter()
+        if dry_run:
+            logger.info('Running in simmulation mode. Balances will not be affected')
+
+        now = time.time()
+        unscheduled = [account for account in self.accounts if account.user_id not in self.scheduled_users]
+        self.scheduler.schedule_accounts(unscheduled, dry_run, now)
+        self.scheduled_users.update(account.user_id for account in unscheduled)
+        due = self.scheduler.pop_due(now)
+        due_count = sum(len(symbols) for strategies in due.values() for symbols in strategies.values())
+        logger.info(f'Symbols due in this cycle: {due_count} of {due_count + len(self.scheduler)} scheduled')
+
+        symbols_stats = {}
+        dips_accounts = [account for account in self.accounts 
+                            if due.get(account.user_id, {}).get(Strategy.BUY_THE_DIPS)]
+        if dips_accounts:
+            with metrics.timer('stage_seconds', stage='stats'):
+                for exchange_id in sorted({account.exchange_id for account in dips_accounts}):
+                    exchange_accounts = [account for account in dips_accounts if account.exchange_id == exchange_id]
+                    symbols_stats.update(self._get_symbols_stats(exchange_id, exchange_accounts))
+        with metrics.timer('stage_seconds', stage='tickers'):
+            markets = self._get_market_snapshots(due)
+
+        args = [(account, symbols_stats, dry_run, markets.get(account.exchange_id), due.get(account.user_id, {}), now)
+                for account in self.accounts]
+        # Check results, contact dates and dummy orders of the whole cycle are written
+        # in a single transaction at the end. Real orders are written as soon as placed
+        with database.unit_of_work() as unit:
+            if self.workers <= 1:
+                results = [self._safe_process_account(*account_args) for account_args in args]
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='account',
+                                        initializer=database.join_unit_of_work, initargs=(unit, )) as executor:
+                    futures = [executor.submit(self._safe_process_account, *account_args) for account_args in args]
+                    results = [future.result() for future in as_completed(futures)]
+
+        elapsed = time.perf_counter() - start
+        failed = results.count(False)
+        logger.info(f'Cycle completed for {len(self.accounts)} account(s) in {elapsed:.2f} seconds '
+                    f'using {max(self.workers, 1)} worker(s). Accounts with errors: {failed}')
+        retry_stats = retries.get_stats()
+        if any(retry_stats.values()):
+            logger.info('Retries: ' + ', '.join(f'{name}={value}' for name, value in sorted(retry_stats.items())))
+
+        metrics.observe('cycle_seconds', elapsed)
+        if self.metrics_dir:
+            metrics.export(self.metrics_dir, {'seconds': elapsed, 'accounts': len(self.accounts), 
+                                                'due': due_count, 'errors': failed, 'workers': self.workers})
+        return elapsed
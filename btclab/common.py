@@ -1,6 +1,33 @@
+import time
 from enum import Enum
+from datetime import datetime, timezone
+from typing import Optional, Union
 
 
 class Strategy(Enum):
     BUY_THE_DIPS = 'dip'
-    DCA = 'dca'
\ No newline at end of file
+    DCA = 'dca'
+
+
+# Dates are stored and compared as integer milliseconds since the epoch (UTC)
+MS_IN_A_MINUTE = 60_000
+MS_IN_AN_HOUR = 3_600_000
+MS_IN_A_DAY = 86_400_000
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def to_ms(value: Union[datetime, str, None]) -> Optional[int]:
+    """
+    Returns the epoch milliseconds of a datetime or an ISO 8601 string, like the
+    ones of the orders returned by ccxt. Naive dates are in UTC
+    """
+    if value is None or (isinstance(value, str) and value.strip() == ''):
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return round(value.timestamp() * 1000)
@@ -1,17 +1,19 @@
 import logging
 from datetime import datetime
-from typing import List, Optional
-from retry import retry
-from ccxt.base.exchange import Exchange
-from ccxt.base.errors import InsufficientFunds, BadSymbol, NetworkError
+from typing import TYPE_CHECKING, List, Optional
 
 from common import Strategy
-from order import Order
+from balances import BalanceSnapshot
+import paper
+import retries
+
+if TYPE_CHECKING:
+    from ccxt.base.exchange import Exchange
 
 logger = logging.getLogger(__name__)
 
 
-@retry(NetworkError, delay=15, jitter=5, logger=logger)
+@retries.with_backoff('load_markets')
 def get_non_supported_symbols(exchange, symbols: List) -> set:
     """
     From a list of symbols, returns a sublist of those not supported in a given exchange
@@ -20,56 +22,53 @@ def get_non_supported_symbols(exchange, symbols: List) -> set:
     return set(symbols).difference(set(exchange.symbols))
 
 
-@retry(NetworkError, delay=15, jitter=5, logger=logger)
-def place_buy_order(exchange: Exchange, user_id: int, symbol: str, price: float, order_cost: float, order_type: str,
+def place_buy_order(exchange: 'Exchange', user_id: int, symbol: str, price: float, order_cost: float, order_type: str,
         strategy: Strategy, is_dummy: bool = False, dry_run: bool = False):
     """ 
-    Returns a dictionary with the information of the order placed
+    Returns a dictionary with the information of the order placed. Dummy orders are
+    filled by the paper trading engine without contacting the exchange, except to get
+    the price when it is not given
     """
 
     if is_dummy or dry_run:
-        params = {
-            'symbol': symbol.replace('/', ''), 
-            'side': 'buy', 
-            'type': 'market', 
-            'quoteOrderQty': order_cost
-        }
-        
         if price is None:
-            price = exchange.fetch_ticker(symbol)['last']
-        order = exchange.private_post_order_test(params) # TODO Check if necessary
-        
-        if order is not None:
-            order = Order.get_dummy_order(user_id, symbol, order_type, 'buy', price, order_cost, strategy)
-        return order
+            price = get_last_price(exchange, symbol)
+        return paper.fill_buy_order(user_id, symbol, price, order_cost, order_type, strategy)
+
+    order = _create_buy_order(exchange, symbol, price, order_cost, order_type)
+    order['is_dummy'] = False
+    order['user_id'] = user_id
+
+    return order
+
 
+@retries.with_backoff('fetch_ticker')
+def get_last_price(exchange: 'Exchange', symbol: str) -> float:
+    return exchange.fetch_ticker(symbol)['last']
+
+
+@retries.with_backoff('create_order')
+def _create_buy_order(exchange: 'Exchange', symbol: str, price: float, order_cost: float, order_type: str) -> dict:
     if order_type == 'market':
         if exchange.has['createMarketOrder']:
             exchange.options['createMarketBuyOrderRequiresPrice'] = False
             params = {'quoteOrderQty': order_cost}
-            order = exchange.create_market_buy_order(symbol, order_cost, params)
+            return exchange.create_market_buy_order(symbol, order_cost, params)
         else:
             exchange.options['createMarketBuyOrderRequiresPrice'] = True
             amount = order_cost / price
-            order = exchange.create_market_buy_order(symbol, amount, price)
-    else:
-        amount = order_cost / price
-        order = exchange.create_limit_buy_order(symbol, amount, price)
-
-    order['is_dummy'] = is_dummy or dry_run
-    order['user_id'] = user_id
-
-    return order
+            return exchange.create_market_buy_order(symbol, amount, price)
+    amount = order_cost / price
+    return exchange.create_limit_buy_order(symbol, amount, price)
     
 
-@retry(NetworkError, delay=15, jitter=5, logger=logger)
-def check_funds(exchange, symbol, order_cost):
+def check_funds(balances: BalanceSnapshot, symbol, order_cost):
     """
     Checks if available balance of quote currency in symbol is enough to cover oder cost
     Returns zero if true or available balance otherwise
     """
     quote_ccy = symbol.split('/')[1]
-    balance = exchange.fetch_balance()[quote_ccy]['free']
+    balance = balances.get_free(quote_ccy)
     
     if balance < order_cost:
         return balance
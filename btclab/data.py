@@ -1,32 +1,71 @@
+import time
 import logging
-import pandas as pd
-from retry import retry
-from ccxt import NetworkError, RequestTimeout
+from typing import TYPE_CHECKING
+
+import database
+import retries
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 logger = logging.getLogger(__name__)
 
+TIMEFRAME = '1d'
+HISTORY_LIMIT = 1000 # Number of candles used to calculate stats
 
-@retry((NetworkError, RequestTimeout), delay=15, jitter=5, logger=logger)
-def get_close_prices(exchange, symbols: list[str]) -> pd.DataFrame:
-    """"Returns a Pandas DataFrame with the daily close price of each symbol
+
+@retries.with_backoff('fetch_ohlcv')
+def update_candles(exchange, symbols: list[str], timeframe: str = TIMEFRAME, limit: int = HISTORY_LIMIT) -> int:
+    """
+    Downloads into the local candle store the candles of each symbol that are newer 
+    than the last one stored. Returns the number of requests made to the exchange
     """
-    df = None
-    if exchange.has['fetchOHLCV']:
-        for symbol in symbols:
-            data = exchange.fetch_ohlcv(symbol, '1d', limit=1000)
-            idx = [x[0] for x in data]
-            close_price = [x[3] for x in data]
-            new_df = pd.DataFrame(close_price, index=idx, columns=[symbol])
-            df = pd.concat([df, new_df], axis=1)
-    
-    df.index = pd.to_datetime(df.index, unit='ms')
-    return df
+    if not exchange.has['fetchOHLCV']:
+        logger.warning(f'{exchange.name} exchange does not support fetchOHLCV method')
+        return 0
+
+    last_timestamps = database.get_last_candle_timestamps(exchange.id, timeframe)
+    calls = 0
+    for symbol in symbols:
+        # The last candle stored is requested again, as it may have been incomplete
+        since = last_timestamps.get(symbol)
+        while True:
+            candles = exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+            calls += 1
+            database.save_candles(exchange.id, symbol, timeframe, candles)
+            if since is None or len(candles) < limit:
+                break
+            since = candles[-1][0]
+
+    return calls
+
+
+def get_close_prices(exchange, symbols: list[str], timeframe: str = TIMEFRAME, 
+                    limit: int = HISTORY_LIMIT) -> 'pd.DataFrame':
+    """"Returns a Pandas DataFrame with the close price of each symbol in the last 
+    limit periods of timeframe, after updating the local candle store
+    """
+    import numpy as np
+    import pandas as pd
+
+    update_candles(exchange, symbols, timeframe, limit)
+
+    since = int(time.time() * 1000) - limit * exchange.parse_timeframe(timeframe) * 1000
+    rows = database.get_close_prices(exchange.id, symbols, timeframe, since)
+    columns = {symbol: i for i, symbol in enumerate(symbols)}
+    timestamps = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    index, positions = np.unique(timestamps, return_inverse=True)
+
+    prices = np.full((len(index), len(symbols)), np.nan)
+    prices[positions, [columns[row[0]] for row in rows]] = [row[2] for row in rows]
+
+    return pd.DataFrame(prices, index=pd.to_datetime(index, unit='ms'), columns=list(symbols))
 
 
 def get_std_dev(exchange, symbols: list[str], ) -> dict:
     """Returns a dictionary with the standard deviations of each symbol
     """
-    close_prices = get_close_prices(exchange, symbols)
+    close_prices = get_close_prices(exchange, list(symbols))
     rets = close_prices.pct_change()
-    return rets.std().to_dict()
\ No newline at end of file
+    return rets.std().to_dict()
@@ -1,13 +1,19 @@
 import os
+import sys
+import json
+import time
+import atexit
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from sqlite3.dbapi2 import Cursor
-from dateutil import parser
 from sqlite3 import Error, Connection
-from typing import List, Optional
+from typing import Iterable, List, Optional
 
-from common import Strategy
+import metrics
+from common import MS_IN_A_DAY, MS_IN_AN_HOUR, Strategy, now_ms, to_ms
 from order import Order
 from telegram import TelegramBot
 from users import Account
@@ -15,69 +21,627 @@ from users import Account
 
 logger = logging.getLogger(__name__)
 
+# Pragmas applied to every new connection. WAL lets readers and a writer work
+# concurrently and, together with synchronous=NORMAL, avoids an fsync per commit
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA busy_timeout = 5000',
+)
+
+# Number of compiled statements kept by each connection, keyed by their SQL text
+STATEMENT_CACHE_SIZE = 256
+
+# Writes buffered by a unit of work before it is flushed without waiting for its end
+MAX_PENDING_WRITES = 5000
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+class InstrumentedCursor(Cursor):
+    """
+    A cursor that records the number and duration of the queries it runs, labeled
+    with the name of the function of this module that runs them
+    """
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe('db_query_seconds', time.perf_counter() - start, query=sys._getframe(1).f_code.co_name)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe('db_query_seconds', time.perf_counter() - start, query=sys._getframe(1).f_code.co_name)
+
+
+class PersistentConnection(Connection):
+    """
+    A connection that is reused by every function of this module running in the 
+    same thread. Calling close() only discards uncommitted changes, as closing a 
+    regular connection would, but keeps the connection open for the next caller
+    """
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        with metrics.timer('db_commit_seconds'):
+            super().commit()
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        self.disposed = True
+        super().close()
+
+
+def get_db_file() -> str:
+    """
+    Returns the path of the database, which can be changed with the BTCLAB_DB
+    environment variable
+    """
+    return os.environ.get('BTCLAB_DB') or os.path.dirname(os.path.realpath(__file__)) + '/database.db'
+
+
 def create_connection() -> Connection:
     """
-    Returns a connection to the SQLite database specified by db_file
+    Returns the connection to the SQLite database of the current thread, opening
+    it the first time it is requested
     """
-    db_file = os.path.dirname(os.path.realpath(__file__)) + '/database.db'
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid() and not getattr(conn, 'disposed', False):
+        return conn
+
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        conn = sqlite3.connect(get_db_file(), factory=PersistentConnection, 
+                                cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
     except Error:
         logger.exception('Error while trying to connect to the database')
+        return conn
 
+    _local.conn = conn
+    _local.pid = os.getpid()
+    with _connections_lock:
+        _connections.append(conn)
     return conn
 
 
-def create_table(conn: Connection, sql_statement: str):
+def close_connections():
+    """
+    Closes the connections opened by all threads of the current process
+    """
+    with _connections_lock:
+        while _connections:
+            conn = _connections.pop()
+            try:
+                conn.dispose()
+            except Error:
+                logger.exception('Error while closing a database connection')
+    _local.conn = None
+
+
+atexit.register(close_connections)
+
+
+class UnitOfWork():
+    """
+    Write-behind buffer for the writes made while checking accounts: dummy orders,
+    last check results and last contact dates. They are flushed together in a single
+    transaction when the unit ends, or earlier if too many are pending. Real orders
+    flush the unit as soon as they are saved, so they are in the database before
+    anyone is told about them. Pending orders are visible to get_latest_order.
+    A unit can be shared by several threads, each writing with its own connection
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.orders: list[dict] = []
+        self.latest_orders: dict[tuple, dict] = {}
+        self.checks: dict[tuple, tuple] = {}
+        self.contacts: dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self.orders) + len(self.checks) + len(self.contacts)
+
+    def add_order(self, values: dict):
+        with self._lock:
+            self.orders.append(values)
+            self.latest_orders[(values['user_id'], values['symbol'], values['strategy'], values['is_dummy'])] = values
+            self._flush_if_full()
+
+    def add_check(self, table: str, user_id: int, symbol: str, result: str, checked_on: str):
+        with self._lock:
+            self.checks[(table, user_id, symbol)] = (checked_on, result, user_id, symbol)
+            self._flush_if_full()
+
+    def add_contact(self, user_id: int, contacted_on: str):
+        with self._lock:
+            self.contacts[user_id] = (contacted_on, user_id)
+            self._flush_if_full()
+
+    def get_latest_order(self, user_id: int, symbol: str, is_dummy: bool, strategy: Optional[Strategy]) -> Optional[dict]:
+        with self._lock:
+            if strategy is not None:
+                return self.latest_orders.get((user_id, symbol, strategy.value, int(is_dummy)))
+            pending = [values for values in self.orders 
+                        if (values['user_id'], values['symbol'], values['is_dummy']) == (user_id, symbol, int(is_dummy))]
+            return pending[-1] if pending else None
+
+    def get_latest_order_dates(self, strategy: Strategy) -> dict[tuple, int]:
+        with self._lock:
+            return {(user_id, symbol, bool(is_dummy)): values['timestamp'] 
+                    for (user_id, symbol, strategy_value, is_dummy), values in self.latest_orders.items()
+                    if strategy_value == strategy.value}
+
+    def _flush_if_full(self):
+        if len(self) >= MAX_PENDING_WRITES:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if len(self) == 0:
+                return
+            _write_pending(self.orders, self.checks, self.contacts)
+            self.orders = []
+            self.latest_orders = {}
+            self.checks = {}
+            self.contacts = {}
+
+
+def get_unit_of_work() -> Optional[UnitOfWork]:
+    return getattr(_local, 'unit_of_work', None)
+
+
+def join_unit_of_work(unit: Optional[UnitOfWork]):
+    """
+    Makes the writes of the current thread go to unit, for example in the worker
+    threads of a pool. The owner of the unit is still the one that flushes it
+    """
+    _local.unit_of_work = unit
+
+
+@contextmanager
+def unit_of_work():
     """
-    Creates a table from a DDL sql statement 
+    Buffers the writes of the current thread in a unit of work flushed when the
+    context exits, even on errors. Nested contexts join the outer unit
     """
+    unit = get_unit_of_work()
+    if unit is not None:
+        yield unit
+        return
+
+    unit = UnitOfWork()
+    _local.unit_of_work = unit
     try:
-        c = conn.cursor()
-        c.execute(sql_statement)
-    except Error as e:
-        logger.error(e)
+        yield unit
+    finally:
+        _local.unit_of_work = None
+        unit.flush()
+
+
+# Schema of a new database, the same that results from applying all the migrations
+# to the first version of the database. Every new migration has to be reflected here
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS user (
+        user_id integer PRIMARY KEY,
+        first_name text NOT NULL,
+        last_name text NOT NULL,
+        email text NOT NULL UNIQUE,
+        is_active integer DEFAULT 1,
+        created_on integer NOT NULL,
+        last_contact integer,
+        exchange_id text NOT NULL,
+        api_key text NOT NULL UNIQUE,
+        api_secret text NOT NULL UNIQUE,
+        telegram_bot_token text NOT NULL,
+        telegram_chat_id text UNIQUE,
+        notify_to_telegram integer DEFAULT 1,
+        notify_to_email integer DEFAULT 0
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS dca_config (
+        user_id integer NOT NULL,
+        symbol text NOT NULL,
+        order_cost real NOT NULL,
+        frequency integer NOT NULL,
+        is_active integer DEFAULT 1,
+        is_dummy integer DEFAULT 0,
+        last_check_date integer,
+        last_check_result text,
+        UNIQUE (user_id, symbol),
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS dip_config (
+        user_id integer NOT NULL,
+        symbol text NOT NULL,
+        order_cost real NOT NULL,
+        min_drop_value real NOT NULL,
+        min_drop_units text NOT NULL,
+        min_additional_drop_pct real NOT NULL,
+        additional_drop_cost_increase real DEFAULT 0,
+        is_active integer DEFAULT 1,
+        is_dummy integer DEFAULT 0,
+        last_check_date integer,
+        last_check_result text,
+        UNIQUE (user_id, symbol),
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS exchange_order (
+        order_id text NOT NULL,
+        timestamp integer NOT NULL,
+        symbol text NOT NULL,
+        type text NOT NULL,
+        side text NOT NULL,
+        price real,
+        amount real, 
+        cost real,
+        strategy text NOT NULL,
+        is_dummy integer NOT NULL,
+        user_id integer NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    )""",
+    """
+    CREATE INDEX IF NOT EXISTS idx_exchange_order_lookup 
+        ON exchange_order (user_id, symbol, strategy, is_dummy)""",
+    """
+    CREATE INDEX IF NOT EXISTS idx_exchange_order_timestamp 
+        ON exchange_order (timestamp)""",
+    """
+    CREATE TABLE IF NOT EXISTS latest_order (
+        user_id integer NOT NULL,
+        symbol text NOT NULL,
+        strategy text NOT NULL,
+        is_dummy integer NOT NULL,
+        order_rowid integer NOT NULL,
+        order_id text NOT NULL,
+        timestamp integer NOT NULL,
+        type text NOT NULL,
+        side text NOT NULL,
+        price real,
+        amount real,
+        cost real,
+        PRIMARY KEY (user_id, symbol, strategy, is_dummy),
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS symbol (
+        symbol text NOT NULL,
+        std_dev real NOT NULL,
+        updated_on integer NOT NULL,
+        comments text
+    )""",
+    """
+    CREATE INDEX IF NOT EXISTS idx_symbol_updated_on 
+        ON symbol (updated_on)""",
+    """
+    CREATE TABLE IF NOT EXISTS candle (
+        exchange_id text NOT NULL,
+        symbol text NOT NULL,
+        timeframe text NOT NULL,
+        timestamp integer NOT NULL,
+        open real,
+        high real,
+        low real,
+        close real,
+        volume real,
+        PRIMARY KEY (exchange_id, symbol, timeframe, timestamp)
+    ) WITHOUT ROWID""",
+    """
+    CREATE TABLE IF NOT EXISTS candle_sync (
+        exchange_id text NOT NULL,
+        symbol text NOT NULL,
+        timeframe text NOT NULL,
+        last_timestamp integer NOT NULL,
+        PRIMARY KEY (exchange_id, symbol, timeframe)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS symbol_moments (
+        exchange_id text NOT NULL,
+        symbol text NOT NULL,
+        timeframe text NOT NULL,
+        window integer NOT NULL,
+        count integer NOT NULL,
+        mean real NOT NULL,
+        m2 real NOT NULL,
+        last_timestamp integer,
+        PRIMARY KEY (exchange_id, symbol, timeframe, window)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS notification (
+        notification_id integer PRIMARY KEY,
+        bot_token text NOT NULL,
+        chat_id text NOT NULL,
+        text text NOT NULL,
+        status text NOT NULL DEFAULT 'pending',
+        attempts integer NOT NULL DEFAULT 0,
+        next_attempt real NOT NULL DEFAULT 0,
+        created_on integer NOT NULL,
+        owner text,
+        lease_until real NOT NULL DEFAULT 0
+    )""",
+    """
+    CREATE INDEX IF NOT EXISTS idx_notification_pending 
+        ON notification (next_attempt) 
+        WHERE status = 'pending'""",
+    """
+    CREATE TABLE IF NOT EXISTS paper_balance (
+        user_id integer NOT NULL,
+        currency text NOT NULL,
+        free real NOT NULL,
+        updated_on integer NOT NULL,
+        PRIMARY KEY (user_id, currency),
+        FOREIGN KEY (user_id) REFERENCES user (user_id)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS shard_lease (
+        shards integer NOT NULL,
+        shard integer NOT NULL,
+        owner text,
+        fence integer NOT NULL DEFAULT 0,
+        expires_at integer NOT NULL DEFAULT 0,
+        PRIMARY KEY (shards, shard)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS shard_worker (
+        owner text PRIMARY KEY,
+        shards integer NOT NULL,
+        expires_at integer NOT NULL
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS order_claim (
+        user_id integer NOT NULL,
+        symbol text NOT NULL,
+        strategy text NOT NULL,
+        owner text NOT NULL,
+        fence integer,
+        claimed_on integer NOT NULL,
+        PRIMARY KEY (user_id, symbol, strategy, claimed_on)
+    ) WITHOUT ROWID""",
+)
 
 
 def create_db():
     """
-    Creates the database
-    """
-    user_table = """
-            CREATE TABLE IF NOT EXISTS user (
-                user_id integer PRIMARY KEY,
-                first_name text NOT NULL,
-                last_name text NOT NULL,
-                email text NOT NULL UNIQUE,
-                is_active integer DEFAULT 1,
-                created_on text NOT NULL,
-                last_contact text,
-                exchange_id text NOT NULL,
-                api_key text NOT NULL UNIQUE,
-                api_secret text NOT NULL UNIQUE,
-                telegram_bot_token text NOT NULL,
-                telegram_chat_id text UNIQUE,
-                notify_to_telegram integer DEFAULT 1,
-                notify_to_email integer DEFAULT 0
-            );"""
-    
-    dca_config_table = """
-        CREATE TABLE IF NOT EXISTS dca_config (
+    Creates the database with the current schema if it does not exist, or applies
+    the migrations it is missing otherwise
+    """
+    conn = create_connection()
+    if conn is None:
+        logger.error('Error! cannot create the database connection.')
+        return
+
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user'").fetchone():
+            migrate_db(conn)
+            return
+        # Other workers starting at the same time wait for the lock and find the tables created
+        conn.execute('BEGIN IMMEDIATE')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        if conn.execute('PRAGMA user_version').fetchone()[0] == 0:
+            conn.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+        conn.commit()
+    except Error:
+        logger.exception('Error while creating the database')
+        raise
+    finally:
+        conn.close()
+
+
+def _add_latest_order(conn: Connection):
+    """
+    Indexes exchange_order by the columns used to look up orders and adds the
+    latest_order table, which keeps the last order of every user, symbol, strategy
+    and is_dummy flag so it can be read with a primary key lookup
+    """
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exchange_order_lookup 
+            ON exchange_order (user_id, symbol, strategy, is_dummy)""")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS latest_order (
+            user_id integer NOT NULL,
+            symbol text NOT NULL,
+            strategy text NOT NULL,
+            is_dummy integer NOT NULL,
+            order_rowid integer NOT NULL,
+            order_id text NOT NULL,
+            datetime text NOT NULL,
+            type text NOT NULL,
+            side text NOT NULL,
+            price real,
+            amount real,
+            cost real,
+            PRIMARY KEY (user_id, symbol, strategy, is_dummy),
+            FOREIGN KEY(user_id) REFERENCES user(user_id)
+        )""")
+
+    conn.execute("""
+        INSERT OR REPLACE INTO latest_order (user_id, symbol, strategy, is_dummy, order_rowid, order_id, 
+                                            datetime, type, side, price, amount, cost)
+        SELECT user_id, symbol, strategy, is_dummy, rowid, order_id, datetime, type, side, price, amount, cost
+        FROM exchange_order
+        WHERE rowid IN (SELECT MAX(rowid) FROM exchange_order GROUP BY user_id, symbol, strategy, is_dummy)""")
+
+
+def _add_candle_store(conn: Connection):
+    """
+    Adds the tables of the local candle store. candle_sync keeps the timestamp 
+    of the newest candle stored for every exchange, symbol and timeframe
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS candle (
+            exchange_id text NOT NULL,
+            symbol text NOT NULL,
+            timeframe text NOT NULL,
+            timestamp integer NOT NULL,
+            open real,
+            high real,
+            low real,
+            close real,
+            volume real,
+            PRIMARY KEY (exchange_id, symbol, timeframe, timestamp)
+        ) WITHOUT ROWID""")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS candle_sync (
+            exchange_id text NOT NULL,
+            symbol text NOT NULL,
+            timeframe text NOT NULL,
+            last_timestamp integer NOT NULL,
+            PRIMARY KEY (exchange_id, symbol, timeframe)
+        )""")
+
+
+def _add_symbol_moments(conn: Connection):
+    """
+    Adds the symbol_moments table, with the running count, mean and sum of squared
+    differences (M2) of the returns of each symbol over a window of candles. The
+    window ends at the candle in last_timestamp
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS symbol_moments (
+            exchange_id text NOT NULL,
+            symbol text NOT NULL,
+            timeframe text NOT NULL,
+            window integer NOT NULL,
+            count integer NOT NULL,
+            mean real NOT NULL,
+            m2 real NOT NULL,
+            last_timestamp integer,
+            PRIMARY KEY (exchange_id, symbol, timeframe, window)
+        )""")
+
+
+def _add_notification_outbox(conn: Connection):
+    """
+    Adds the notification table, an outbox of the messages waiting to be sent to 
+    Telegram. Messages are deleted once sent and kept with status 'failed' when
+    they could not be delivered
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notification (
+            notification_id integer PRIMARY KEY,
+            bot_token text NOT NULL,
+            chat_id text NOT NULL,
+            text text NOT NULL,
+            status text NOT NULL DEFAULT 'pending',
+            attempts integer NOT NULL DEFAULT 0,
+            next_attempt real NOT NULL DEFAULT 0,
+            created_on text NOT NULL DEFAULT (datetime('now'))
+        )""")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notification_pending 
+        ON notification (next_attempt) 
+        WHERE status = 'pending'""")
+
+
+def _add_paper_balance(conn: Connection):
+    """
+    Adds the paper_balance table, with the simulated balances of each user used to
+    fill the orders of dummy configs and dry runs
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS paper_balance (
+            user_id integer NOT NULL,
+            currency text NOT NULL,
+            free real NOT NULL,
+            updated_on text NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (user_id, currency),
+            FOREIGN KEY (user_id) REFERENCES user (user_id)
+        )""")
+
+
+def _epoch_ms(column: str, default: Optional[str] = None) -> str:
+    """
+    Returns an SQL expression converting a date stored as text in column, in any
+    format understood by SQLite, to epoch milliseconds. Empty or unparseable dates
+    become the SQL expression default, or NULL if it is not given
+    """
+    expression = f"""CASE WHEN typeof({column}) IN ('integer', 'real') THEN {column}
+                ELSE CAST(round((julianday({column}) - 2440587.5) * 86400000) AS integer) END"""
+    return expression if default is None else f'COALESCE({expression}, {default})'
+
+
+def _warn_invalid_dates(conn: Connection, table: str, column: str):
+    invalid = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {_epoch_ms(column)} IS NULL').fetchone()[0]
+    if invalid:
+        logger.warning(f'{invalid} row(s) of {table} have an empty or invalid {column}. It is set to the epoch')
+
+
+def _rebuild_table(conn: Connection, table: str, definition: str, conversions: dict[str, str]):
+    """
+    Recreates table with a new column definition, copying its rows and rowids. Each
+    new column takes the value of the SQL expression in conversions or, if it is not
+    there, of the old column with the same name. Indexes have to be created again
+    """
+    conn.execute(f'CREATE TABLE {table}_new ({definition})')
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table}_new)')]
+    values = ', '.join(conversions.get(column, column) for column in columns)
+    conn.execute(f'INSERT INTO {table}_new (rowid, {", ".join(columns)}) SELECT rowid, {values} FROM {table}')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
+def _use_epoch_timestamps(conn: Connection):
+    """
+    Stores dates as integer milliseconds since the epoch instead of text, which mixed
+    the format of datetime('now') with the ISO 8601 strings of ccxt. The datetime
+    column of the orders is renamed to timestamp, as in ccxt, and the columns used
+    in time ranges are indexed. Required dates that cannot be converted, like the
+    empty datetime of some old orders, are set to the epoch, so those orders count
+    as the oldest ones
+    """
+    for table, column in (('user', 'created_on'), ('exchange_order', 'datetime'), ('latest_order', 'datetime'),
+                            ('symbol', 'updated_on'), ('paper_balance', 'updated_on')):
+        _warn_invalid_dates(conn, table, column)
+
+    _rebuild_table(conn, 'user', """
+            user_id integer PRIMARY KEY,
+            first_name text NOT NULL,
+            last_name text NOT NULL,
+            email text NOT NULL UNIQUE,
+            is_active integer DEFAULT 1,
+            created_on integer NOT NULL,
+            last_contact integer,
+            exchange_id text NOT NULL,
+            api_key text NOT NULL UNIQUE,
+            api_secret text NOT NULL UNIQUE,
+            telegram_bot_token text NOT NULL,
+            telegram_chat_id text UNIQUE,
+            notify_to_telegram integer DEFAULT 1,
+            notify_to_email integer DEFAULT 0""",
+        {'created_on': _epoch_ms('created_on', '0'), 'last_contact': _epoch_ms('last_contact')})
+
+    _rebuild_table(conn, 'dca_config', """
             user_id integer NOT NULL,
             symbol text NOT NULL,
             order_cost real NOT NULL,
             frequency integer NOT NULL,
             is_active integer DEFAULT 1,
             is_dummy integer DEFAULT 0,
-            last_check_date text,
+            last_check_date integer,
             last_check_result text,
             UNIQUE (user_id, symbol),
-            FOREIGN KEY(user_id) REFERENCES user(user_id)
-        );"""
+            FOREIGN KEY(user_id) REFERENCES user(user_id)""",
+        {'last_check_date': _epoch_ms('last_check_date')})
 
-    dip_config_table = """
-        CREATE TABLE IF NOT EXISTS dip_config (
+    _rebuild_table(conn, 'dip_config', """
             user_id integer NOT NULL,
             symbol text NOT NULL,
             order_cost real NOT NULL,
@@ -87,16 +651,15 @@ def create_db():
             additional_drop_cost_increase real DEFAULT 0,
             is_active integer DEFAULT 1,
             is_dummy integer DEFAULT 0,
-            last_check_date text,
+            last_check_date integer,
             last_check_result text,
             UNIQUE (user_id, symbol),
-            FOREIGN KEY(user_id) REFERENCES user(user_id)
-        );"""
+            FOREIGN KEY(user_id) REFERENCES user(user_id)""",
+        {'last_check_date': _epoch_ms('last_check_date')})
 
-    order_table = """
-        CREATE TABLE IF NOT EXISTS exchange_order (
+    _rebuild_table(conn, 'exchange_order', """
             order_id text NOT NULL,
-            datetime text NOT NULL,
+            timestamp integer NOT NULL,
             symbol text NOT NULL,
             type text NOT NULL,
             side text NOT NULL,
@@ -106,37 +669,192 @@ def create_db():
             strategy text NOT NULL,
             is_dummy integer NOT NULL,
             user_id integer NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES user(user_id)
-        );"""
+            FOREIGN KEY(user_id) REFERENCES user(user_id)""",
+        {'timestamp': _epoch_ms('datetime', '0')})
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exchange_order_lookup 
+            ON exchange_order (user_id, symbol, strategy, is_dummy)""")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exchange_order_timestamp 
+            ON exchange_order (timestamp)""")
 
-    symbol = """
-        CREATE TABLE IF NOT EXISTS symbol (
+    _rebuild_table(conn, 'latest_order', """
+            user_id integer NOT NULL,
             symbol text NOT NULL,
-            std_dev real NOT NULL,
+            strategy text NOT NULL,
+            is_dummy integer NOT NULL,
+            order_rowid integer NOT NULL,
+            order_id text NOT NULL,
+            timestamp integer NOT NULL,
+            type text NOT NULL,
+            side text NOT NULL,
+            price real,
+            amount real,
+            cost real,
+            PRIMARY KEY (user_id, symbol, strategy, is_dummy),
+            FOREIGN KEY(user_id) REFERENCES user(user_id)""",
+        {'timestamp': _epoch_ms('datetime', '0')})
+
+    conn.execute(f"""UPDATE symbol SET updated_on = {_epoch_ms('updated_on', '0')}""")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_symbol_updated_on 
+            ON symbol (updated_on)""")
+
+    _rebuild_table(conn, 'paper_balance', """
+            user_id integer NOT NULL,
+            currency text NOT NULL,
+            free real NOT NULL,
             updated_on integer NOT NULL,
-            comments text
-        );"""
+            PRIMARY KEY (user_id, currency),
+            FOREIGN KEY (user_id) REFERENCES user (user_id)""",
+        {'updated_on': _epoch_ms('updated_on', '0')})
 
-    # create tables
-    conn = create_connection()
-    if conn is not None:
-        create_table(conn, user_table)
-        create_table(conn, dca_config_table)
-        create_table(conn, dip_config_table)
-        create_table(conn, order_table)
-        create_table(conn, symbol)
-        conn.close()
-    else:
-        logger.exception("Error! cannot create the database connection.")
+
+def _add_shard_leases(conn: Connection):
+    """
+    Adds the tables used to split users across workers. shard_lease assigns each of
+    the shards of users to a worker until expires_at, with a fence incremented every
+    time the shard changes hands. shard_worker keeps the workers alive, to share the
+    shards evenly. order_claim keeps at most one order per user, symbol, strategy and
+    time window
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shard_lease (
+            shards integer NOT NULL,
+            shard integer NOT NULL,
+            owner text,
+            fence integer NOT NULL DEFAULT 0,
+            expires_at integer NOT NULL DEFAULT 0,
+            PRIMARY KEY (shards, shard)
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shard_worker (
+            owner text PRIMARY KEY,
+            shards integer NOT NULL,
+            expires_at integer NOT NULL
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS order_claim (
+            user_id integer NOT NULL,
+            symbol text NOT NULL,
+            strategy text NOT NULL,
+            window integer NOT NULL,
+            owner text NOT NULL,
+            fence integer,
+            claimed_on integer NOT NULL,
+            PRIMARY KEY (user_id, symbol, strategy, window)
+        ) WITHOUT ROWID""")
+
+
+def _use_epoch_notification_dates(conn: Connection):
+    """
+    Stores the creation date of the notifications as epoch milliseconds, like the
+    other dates
+    """
+    _warn_invalid_dates(conn, 'notification', 'created_on')
+    _rebuild_table(conn, 'notification', """
+            notification_id integer PRIMARY KEY,
+            bot_token text NOT NULL,
+            chat_id text NOT NULL,
+            text text NOT NULL,
+            status text NOT NULL DEFAULT 'pending',
+            attempts integer NOT NULL DEFAULT 0,
+            next_attempt real NOT NULL DEFAULT 0,
+            created_on integer NOT NULL""",
+        {'created_on': _epoch_ms('created_on', '0')})
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notification_pending 
+        ON notification (next_attempt) 
+        WHERE status = 'pending'""")
 
 
-def get_users() -> List[Account]:
+def _add_notification_claims(conn: Connection):
     """
-    Return the list of active user accounts from the databse
+    Adds the worker that claimed each notification and until when, so workers
+    sharing the database do not send the same message twice
+    """
+    conn.execute('ALTER TABLE notification ADD COLUMN owner text')
+    conn.execute('ALTER TABLE notification ADD COLUMN lease_until real NOT NULL DEFAULT 0')
+
+
+def _anchor_order_claims(conn: Connection):
+    """
+    Keys the order claims by the time they were made instead of by a fixed time
+    window, as a new claim is now refused within an interval of the previous one
+    """
+    conn.execute("""
+        CREATE TABLE order_claim_new (
+            user_id integer NOT NULL,
+            symbol text NOT NULL,
+            strategy text NOT NULL,
+            owner text NOT NULL,
+            fence integer,
+            claimed_on integer NOT NULL,
+            PRIMARY KEY (user_id, symbol, strategy, claimed_on)
+        ) WITHOUT ROWID""")
+    conn.execute("""
+        INSERT OR IGNORE INTO order_claim_new (user_id, symbol, strategy, owner, fence, claimed_on)
+        SELECT user_id, symbol, strategy, owner, fence, claimed_on FROM order_claim""")
+    conn.execute('DROP TABLE order_claim')
+    conn.execute('ALTER TABLE order_claim_new RENAME TO order_claim')
+
+
+# Schema changes applied in order to existing databases. The position of the last
+# migration applied (starting at 1) is stored in the user_version pragma
+MIGRATIONS = [
+    _add_latest_order,
+    _add_candle_store,
+    _add_symbol_moments,
+    _add_notification_outbox,
+    _add_paper_balance,
+    _use_epoch_timestamps,
+    _add_shard_leases,
+    _use_epoch_notification_dates,
+    _add_notification_claims,
+    _anchor_order_claims,
+]
+
+
+def migrate_db(conn: Connection):
+    """
+    Applies the migrations that have not been applied yet to the database, each
+    one in its own transaction
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f'Migrating database to version {number}: {migration.__name__}')
+        try:
+            conn.execute('BEGIN')
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Error:
+            conn.rollback()
+            logger.exception(f'Failed to migrate the database to version {number}')
+            raise
+
+
+def _user_filter_clause(user_ids: Optional[Iterable[int]], column: str = 'user_id') -> tuple[str, tuple]:
+    """
+    Returns an SQL condition and its parameters to restrict a query to some user ids. 
+    The ids are sent as a single JSON parameter, so the statement is the same no matter
+    how many ids are given
+    """
+    if user_ids is None:
+        return '', ()
+    return f'AND {column} IN (SELECT value FROM json_each(?))', (json.dumps(sorted(set(user_ids))), )
+
+
+def get_users(user_ids: Optional[Iterable[int]] = None) -> List[Account]:
+    """
+    Return the list of active user accounts from the databse, optionally restricted
+    to the given user ids. Users and their DCA and dip configurations are read with
+    three queries regardless of the number of users
     """
     conn = create_connection()
     cur = conn.cursor()
-    sql = """SELECT
+    user_filter, params = _user_filter_clause(user_ids)
+    sql = f"""SELECT
                 user_id,
                 first_name,
                 last_name,
@@ -151,11 +869,11 @@ def get_users() -> List[Account]:
                 notify_to_email,
                 last_contact
             FROM user
-            WHERE is_active = 1
+            WHERE is_active = 1 {user_filter}
             """
     
     try:
-        cur.execute(sql)
+        cur.execute(sql, params)
         rows = cur.fetchall()
     except sqlite3.Error as error:
         logger.exception(f'Failed to retrieve latest order for users from database')
@@ -164,27 +882,27 @@ def get_users() -> List[Account]:
         cur.close()
         conn.close()
     
+    dca_configs = get_dca_configs(user_ids)
+    dip_configs = get_dip_configs(user_ids)
+
     accounts = []
     for row in rows:
         telegram_bot = TelegramBot(row[8], row[9])
-        dca_config = get_dca_config(row[0])
-        dips_config = get_dip_config(row[0])
-        last_contact = parser.parse(row[12]) if row[12] is not None else None
 
         user_account = Account(user_id=row[0],
                                 first_name=row[1], 
                                 last_name=row[2],
                                 email=row[3],
-                                created_on=parser.parse(row[4]),
-                                last_contact=last_contact,
+                                created_on=row[4],
+                                last_contact=row[12],
                                 exchange_id=row[5],
                                 api_key=row[6],
                                 api_secret=row[7], 
                                 telegram_bot=telegram_bot,
                                 notify_to_telegram=bool(row[10]),
                                 notify_to_email=bool(row[11]),
-                                dca_config=dca_config,
-                                dips_config=dips_config)
+                                dca_config=dca_configs.get(row[0], {}),
+                                dips_config=dip_configs.get(row[0], {}))
         
         accounts.append(user_account)
 
@@ -194,52 +912,67 @@ def get_users() -> List[Account]:
     return accounts
 
 
-def get_dca_config(user_id: int) -> dict:
+def get_users_signatures() -> dict[int, int]:
     """
-    Returns a dictionary with the active configuration params that user_id has set for recurrent buys (dca)
+    Returns a hash of the data and active configs of every active user, which changes
+    whenever any of them is edited. Columns updated by the bot itself (last contact 
+    and last check) are left out
     """
     conn = create_connection()
     cur = conn.cursor()
-    sql = """SELECT
-                symbol,
-                order_cost,
-                frequency,
-                is_dummy,
-                last_check_date,
-                last_check_result
-            FROM dca_config
-            WHERE user_id = ? AND is_active = 1
-            """
+    sqls = ["""SELECT user_id, first_name, last_name, email, created_on, exchange_id, api_key, api_secret,
+                    telegram_bot_token, telegram_chat_id, notify_to_telegram, notify_to_email
+                FROM user
+                WHERE is_active = 1""",
+            """SELECT user_id, 'dca', symbol, order_cost, frequency, is_dummy
+                FROM dca_config
+                WHERE is_active = 1
+                ORDER BY user_id, symbol""",
+            """SELECT user_id, 'dip', symbol, order_cost, min_drop_value, min_drop_units, min_additional_drop_pct, 
+                    additional_drop_cost_increase, is_dummy
+                FROM dip_config
+                WHERE is_active = 1
+                ORDER BY user_id, symbol"""]
+    
+    parts = {}
     try:
-        cur.execute(sql, (user_id, ))
-        rows = cur.fetchall()
+        for sql in sqls:
+            cur.execute(sql)
+            for row in cur.fetchall():
+                if sql is sqls[0]:
+                    parts[row[0]] = [row]
+                elif row[0] in parts:
+                    parts[row[0]].append(row)
     except sqlite3.Error as error:
-        logger.exception(f'Error while retrieving DCA params for user {user_id}')
+        logger.exception('Error while retrieving user signatures')
         raise error
     finally:
         cur.close()
         conn.close()
 
-    dca_config = {}
-    for row in rows:
-        dca_config[row[0]] = {
-            'order_cost': row[1], 
-            'frequency': row[2],
-            'is_dummy': row[3],
-            'last_check_date': row[4],
-            'last_check_result': row[5]
-        }
-    
-    return dca_config
+    return {user_id: hash(tuple(rows)) for user_id, rows in parts.items()}
 
 
-def get_dip_config(user_id: int) -> dict:
-    """
-    Returns a dictionary with the active configuration params that user_id has set for buying dips
-    """
-    conn = create_connection()
-    cur = conn.cursor()
-    sql = """SELECT
+DCA_CONFIG_COLUMNS = """
+                symbol,
+                order_cost,
+                frequency,
+                is_dummy,
+                last_check_date,
+                last_check_result"""
+
+
+def _dca_config_from_row(row: tuple) -> dict:
+    return {
+        'order_cost': row[1], 
+        'frequency': row[2],
+        'is_dummy': row[3],
+        'last_check_date': row[4],
+        'last_check_result': row[5]
+    }
+
+
+DIP_CONFIG_COLUMNS = """
                 symbol,
                 order_cost,
                 min_drop_value,
@@ -248,78 +981,173 @@ def get_dip_config(user_id: int) -> dict:
                 additional_drop_cost_increase,
                 is_dummy,
                 last_check_date,
-                last_check_result
-            FROM dip_config
-            WHERE user_id = ? AND is_active = 1
-            """
-    try:
-        cur.execute(sql, (user_id, ))
-        rows = cur.fetchall()
-    except sqlite3.Error as error:
-        logger.exception(f'Error while retrieving dip params for user {user_id}')
-        raise error
-    finally:
-        cur.close()
-        conn.close()
+                last_check_result"""
 
-    dip_config = {}
-    for row in rows:
-        dip_config[row[0]] = {
-            'order_cost': row[1], 
-            'min_drop_value': row[2],
-            'min_drop_units': row[3],
-            'min_additional_drop_pct': row[4],
-            'additional_drop_cost_increase': row[5],
-            'is_dummy': row[6],
-            'last_check_date': row[7],
-            'last_check_result': row[8]
-        }
-    
-    return dip_config
 
+def _dip_config_from_row(row: tuple) -> dict:
+    return {
+        'order_cost': row[1], 
+        'min_drop_value': row[2],
+        'min_drop_units': row[3],
+        'min_additional_drop_pct': row[4],
+        'additional_drop_cost_increase': row[5],
+        'is_dummy': row[6],
+        'last_check_date': row[7],
+        'last_check_result': row[8]
+    }
 
-def get_latest_order(user_id: int, symbol: str, is_dummy: bool, strategy: Strategy = None) -> Optional[Order]:
+
+def _get_configs(table: str, columns: str, user_ids: Optional[Iterable[int]]) -> list[tuple]:
     """
-    Returns the latest order of a user for a given symbol and strategy
+    Returns the active rows of a config table that belong to active users, each 
+    one prefixed by its user id
     """
     conn = create_connection()
     cur = conn.cursor()
-    strategy_clause = 'AND strategy = ?' if strategy else ''
+    user_filter, params = _user_filter_clause(user_ids, 'c.user_id')
     sql = f"""SELECT
-                order_id,
-                datetime,
-                symbol,
-                type,
-                side,
-                price,
-                amount,
-                cost,
-                strategy,
-                is_dummy
-            FROM exchange_order
-            WHERE user_id = ? AND symbol = ? AND is_dummy = ? {strategy_clause}
-            ORDER BY rowid DESC
-            LIMIT 1
+                c.user_id, {columns}
+            FROM {table} c 
+            JOIN user u ON u.user_id = c.user_id
+            WHERE c.is_active = 1 AND u.is_active = 1 {user_filter}
             """
-    
     try:
-        params = (user_id, symbol, int(is_dummy), strategy.value) if strategy else (user_id, symbol, int(is_dummy))
         cur.execute(sql, params)
-        row = cur.fetchone()
+        rows = cur.fetchall()
     except sqlite3.Error as error:
-        logger.exception(f'Failed to retrieve latest order of user {user_id}')
+        logger.exception(f'Error while retrieving rows from {table}')
         raise error
     finally:
         cur.close()
         conn.close()
 
-    if row is None:
-        return None
+    return rows
+
+
+def get_dca_configs(user_ids: Optional[Iterable[int]] = None) -> dict[int, dict]:
+    """
+    Returns a dictionary with the active DCA configuration of every active user 
+    (or only of user_ids), keyed by user id and then by symbol
+    """
+    configs = {}
+    for row in _get_configs('dca_config', DCA_CONFIG_COLUMNS, user_ids):
+        configs.setdefault(row[0], {})[row[1]] = _dca_config_from_row(row[1:])
+    return configs
+
+
+def get_dip_configs(user_ids: Optional[Iterable[int]] = None) -> dict[int, dict]:
+    """
+    Returns a dictionary with the active dip buying configuration of every active 
+    user (or only of user_ids), keyed by user id and then by symbol
+    """
+    configs = {}
+    for row in _get_configs('dip_config', DIP_CONFIG_COLUMNS, user_ids):
+        configs.setdefault(row[0], {})[row[1]] = _dip_config_from_row(row[1:])
+    return configs
+
+
+def get_dca_config(user_id: int) -> dict:
+    """
+    Returns a dictionary with the active configuration params that user_id has set for recurrent buys (dca)
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = f"""SELECT {DCA_CONFIG_COLUMNS}
+            FROM dca_config
+            WHERE user_id = ? AND is_active = 1
+            """
+    try:
+        cur.execute(sql, (user_id, ))
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while retrieving DCA params for user {user_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return {row[0]: _dca_config_from_row(row) for row in rows}
+
+
+def get_dip_config(user_id: int) -> dict:
+    """
+    Returns a dictionary with the active configuration params that user_id has set for buying dips
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = f"""SELECT {DIP_CONFIG_COLUMNS}
+            FROM dip_config
+            WHERE user_id = ? AND is_active = 1
+            """
+    try:
+        cur.execute(sql, (user_id, ))
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while retrieving dip params for user {user_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
 
-    order_date = None if row[1] is None or row[1].strip() == '' else parser.parse(row[1])
+    return {row[0]: _dip_config_from_row(row) for row in rows}
+
+
+def get_latest_order(user_id: int, symbol: str, is_dummy: bool, strategy: Strategy = None) -> Optional[Order]:
+    """
+    Returns the latest order of a user for a given symbol and strategy
+    """
+    unit = get_unit_of_work()
+    pending = unit.get_latest_order(user_id, symbol, is_dummy, strategy) if unit is not None else None
+    if pending is not None:
+        return Order(id=pending['order_id'],
+                        timestamp=pending['timestamp'],
+                        symbol=pending['symbol'],
+                        order_type=pending['type'],
+                        side=pending['side'],
+                        price=pending['price'],
+                        amount=pending['amount'],
+                        cost=pending['cost'],
+                        fee=None,
+                        strategy=pending['strategy'],
+                        user_id=user_id,
+                        is_dummy=bool(pending['is_dummy']))
+
+    conn = create_connection()
+    cur = conn.cursor()
+    strategy_clause = 'AND strategy = ?' if strategy else ''
+    sql = f"""SELECT
+                order_id,
+                timestamp,
+                symbol,
+                type,
+                side,
+                price,
+                amount,
+                cost,
+                strategy,
+                is_dummy
+            FROM latest_order
+            WHERE user_id = ? AND symbol = ? AND is_dummy = ? {strategy_clause}
+            ORDER BY order_rowid DESC
+            LIMIT 1
+            """
+    
+    try:
+        params = (user_id, symbol, int(is_dummy), strategy.value) if strategy else (user_id, symbol, int(is_dummy))
+        cur.execute(sql, params)
+        row = cur.fetchone()
+    except sqlite3.Error as error:
+        logger.exception(f'Failed to retrieve latest order of user {user_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    if row is None:
+        return None
 
     order = Order(id=row[0],
-                    datetime_=order_date,
+                    timestamp=row[1],
                     symbol=row[2],
                     order_type=row[3],
                     side=row[4],
@@ -327,24 +1155,65 @@ def get_latest_order(user_id: int, symbol: str, is_dummy: bool, strategy: Strate
                     amount=row[6],
                     cost=row[7],
                     fee=None,
-                    strategy=strategy.value,
+                    strategy=row[8],
                     user_id=user_id,
-                    is_dummy=bool(row[8]))
+                    is_dummy=bool(row[9]))
     return order
 
 
-def save_order(order: dict, strategy: Strategy):
+def get_latest_order_dates(strategy: Strategy, user_ids: Optional[Iterable[int]] = None) -> dict[tuple, int]:
+    """
+    Returns the timestamp in milliseconds of the latest order of a strategy for every user, symbol and 
+    is_dummy flag, keyed by (user_id, symbol, is_dummy)
+    """
+    user_ids = None if user_ids is None else set(user_ids)
     conn = create_connection()
-    sql = """
-            INSERT INTO exchange_order (order_id, datetime, symbol, type, side, price, 
-                                amount, cost, strategy, is_dummy, user_id) 
-            
-            VALUES (:order_id, :datetime, :symbol, :type, :side, :price, 
-                    :amount, :cost, :strategy, :is_dummy, :user_id) """
-    
+    cur = conn.cursor()
+    user_filter, params = _user_filter_clause(user_ids)
+    sql = f"""SELECT user_id, symbol, is_dummy, timestamp
+            FROM latest_order
+            WHERE strategy = ? {user_filter}"""
+    try:
+        cur.execute(sql, (strategy.value, ) + params)
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception(f'Failed to retrieve latest order dates for strategy {strategy.value}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    dates = {(row[0], row[1], bool(row[2])): row[3] for row in rows}
+    unit = get_unit_of_work()
+    if unit is not None:
+        dates.update({key: date for key, date in unit.get_latest_order_dates(strategy).items()
+                        if user_ids is None or key[0] in user_ids})
+    return dates
+
+
+SQL_INSERT_ORDER = """
+        INSERT INTO exchange_order (order_id, timestamp, symbol, type, side, price, 
+                            amount, cost, strategy, is_dummy, user_id) 
+        
+        VALUES (:order_id, :timestamp, :symbol, :type, :side, :price, 
+                :amount, :cost, :strategy, :is_dummy, :user_id) """
+
+SQL_INSERT_LATEST_ORDER = """
+        INSERT OR REPLACE INTO latest_order (user_id, symbol, strategy, is_dummy, order_rowid, order_id, 
+                                            timestamp, type, side, price, amount, cost)
+
+        VALUES (:user_id, :symbol, :strategy, :is_dummy, :order_rowid, :order_id, 
+                :timestamp, :type, :side, :price, :amount, :cost) """
+
+
+def save_order(order: dict, strategy: Strategy):
+    """
+    Saves an order. Inside a unit of work, dummy orders are buffered and real ones
+    are written right away together with the rest of the writes pending
+    """
     values = {
         'order_id': order['id'],
-        'datetime': order['datetime'],
+        'timestamp': order.get('timestamp') or to_ms(order.get('datetime')) or now_ms(),
         'symbol': order['symbol'],
         'type': order['type'],
         'side': order['side'],
@@ -355,19 +1224,51 @@ def save_order(order: dict, strategy: Strategy):
         'is_dummy': int(order['is_dummy']),
         'user_id': order['user_id']
     }
-    
+
+    unit = get_unit_of_work()
+    if unit is not None:
+        unit.add_order(values)
+        if not values['is_dummy']:
+            unit.flush()
+        return
+
+    _write_pending([values], {}, {})
+
+
+def _write_pending(orders: list[dict], checks: dict[tuple, tuple], contacts: dict[int, tuple]):
+    """
+    Writes orders, last check results keyed by (table, user_id, symbol) and last
+    contact dates keyed by user_id in a single transaction
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql_contact = """UPDATE user 
+            SET last_contact = ?
+            WHERE user_id = ? """
     try:
-        cur = conn.cursor()
-        cur.execute(sql, values)
+        for values in orders:
+            cur.execute(SQL_INSERT_ORDER, values)
+            cur.execute(SQL_INSERT_LATEST_ORDER, {**values, 'order_rowid': cur.lastrowid})
+        for table in sorted({table for table, _, _ in checks}):
+            sql_check = f"""UPDATE {table} 
+                    SET last_check_date = ?,
+                        last_check_result = ?
+                    WHERE user_id = ? AND symbol = ?"""
+            cur.executemany(sql_check, [params for key, params in checks.items() if key[0] == table])
+        if contacts:
+            cur.executemany(sql_contact, list(contacts.values()))
         conn.commit()
-        logger.info(f'Order to {order["side"]} {order["symbol"]} saved with id {order["id"]}')
     except sqlite3.Error as error:
-        logger.exception(f'Failed to save order with id {order["id"]}')
+        logger.exception(f'Failed to save {len(orders)} order(s), {len(checks)} check result(s) and '
+                            f'{len(contacts)} contact date(s)')
         raise error
     finally:
         cur.close()
         conn.close()
 
+    for values in orders:
+        logger.info(f'Order to {values["side"]} {values["symbol"]} saved with id {values["order_id"]}')
+
 
 def get_symbols() -> set[str]:
     conn = create_connection()
@@ -389,23 +1290,26 @@ def get_symbols() -> set[str]:
 
 
 def load_symbol_stats(stats: dict):
+    """
+    Saves the standard deviation of each symbol in stats
+    """
     conn = create_connection()
     cur = conn.cursor()
-    symbols = get_symbols()
 
     sql_update = """UPDATE symbol 
             SET std_dev = ?, 
-                updated_on = datetime('now')
+                updated_on = ?
             WHERE symbol = ? """
 
     sql_insert = """INSERT INTO symbol (symbol, std_dev, updated_on) 
-                VALUES (?, ?, datetime('now')) """
+                VALUES (?, ?, ?) """
 
     try:
-        for symbol in symbols:
-            update_result = cur.execute(sql_update, (symbol, stats[symbol]))
+        now = now_ms()
+        for symbol, std_dev in stats.items():
+            update_result = cur.execute(sql_update, (std_dev, now, symbol))
             if update_result.rowcount ==0:
-                update_result = cur.execute(sql_insert, (symbol, stats[symbol]))
+                update_result = cur.execute(sql_insert, (symbol, std_dev, now))
         conn.commit()
     except sqlite3.Error as error:
         logger.exception('Error while trying to load stats for symbols')
@@ -443,29 +1347,77 @@ def get_symbols_stats() -> dict:
     return symbols
 
 
-def update_last_contact(user_id: int):
+def get_stale_symbols(symbols: Iterable[str], max_age_hours: float) -> set[str]:
+    """
+    Returns the symbols without stats or whose stats are older than max_age_hours
+    """
     conn = create_connection()
     cur = conn.cursor()
+    sql = """SELECT symbol
+            FROM symbol
+            WHERE updated_on >= ?"""
+    try:
+        cur.execute(sql, (now_ms() - round(max_age_hours * MS_IN_AN_HOUR), ))
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception('Error while retrieving stale symbols')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return set(symbols).difference(row[0] for row in rows)
 
-    sql_update = """UPDATE user 
-            SET last_contact = datetime('now')
-            WHERE user_id = ? """
 
+def get_symbol_moments(exchange_id: str, symbol: str, timeframe: str, window: int) -> Optional[tuple]:
+    """
+    Returns the (count, mean, m2, last_timestamp) of the returns of a symbol
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """SELECT count, mean, m2, last_timestamp
+            FROM symbol_moments
+            WHERE exchange_id = ? AND symbol = ? AND timeframe = ? AND window = ?"""
     try:
-        cur.execute(sql_update, (user_id, ))
-        conn.commit()
+        cur.execute(sql, (exchange_id, symbol, timeframe, window))
+        row = cur.fetchone()
     except sqlite3.Error as error:
-        logger.exception(f'Error while trying to update last contact date for user {user_id}')
+        logger.exception(f'Error while retrieving moments for symbol {symbol}')
         raise error
     finally:
         cur.close()
         conn.close()
 
+    return row
 
-def update_last_check(user_id: int, symbol: str, strategy: Strategy, result: str):
+
+def save_symbol_moments(exchange_id: str, symbol: str, timeframe: str, window: int, 
+                        count: int, mean: float, m2: float, last_timestamp: Optional[int]):
     conn = create_connection()
     cur = conn.cursor()
-    
+    sql = """INSERT OR REPLACE INTO symbol_moments (exchange_id, symbol, timeframe, window, 
+                                                    count, mean, m2, last_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+    try:
+        cur.execute(sql, (exchange_id, symbol, timeframe, window, count, mean, m2, last_timestamp))
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while saving moments for symbol {symbol}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def update_last_contact(user_id: int):
+    unit = get_unit_of_work()
+    if unit is not None:
+        unit.add_contact(user_id, now_ms())
+        return
+    _write_pending([], {}, {user_id: (now_ms(), user_id)})
+
+
+def update_last_check(user_id: int, symbol: str, strategy: Strategy, result: str):
     if strategy == Strategy.DCA:
         table = 'dca_config'
     elif strategy == Strategy.BUY_THE_DIPS:
@@ -473,19 +1425,495 @@ def update_last_check(user_id: int, symbol: str, strategy: Strategy, result: str
     else:
         raise ValueError(f'Unkown strategy: {strategy.value}')
 
+    unit = get_unit_of_work()
+    if unit is not None:
+        unit.add_check(table, user_id, symbol, result, now_ms())
+        return
+    _write_pending([], {(table, user_id, symbol): (now_ms(), result, user_id, symbol)}, {})
 
-    sql_update = f"""UPDATE {table} 
-            SET last_check_date = datetime('now'),
-                last_check_result = ?
-            WHERE user_id = ? AND symbol = ?"""
 
+def enqueue_notification(bot_token: str, chat_id: str, text: str):
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """INSERT INTO notification (bot_token, chat_id, text, created_on)
+            VALUES (?, ?, ?, ?)"""
     try:
-        cur.execute(sql_update, (result, user_id, symbol))
+        cur.execute(sql, (bot_token, chat_id, text, now_ms()))
         conn.commit()
     except sqlite3.Error as error:
-        logger.exception(f'Error while trying to update last check result for user {user_id} and symbol {symbol}')
+        logger.exception(f'Error while queuing a notification for chat {chat_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def claim_pending_notifications(owner: str, now: float, lease_until: float, limit: int = 500) -> list[tuple]:
+    """
+    Claims for owner until lease_until the pending notifications that can be sent at
+    now (POSIX timestamps) and are not claimed by another worker, and returns their
+    id, bot token, chat id, text, attempts and age in seconds, oldest first
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """UPDATE notification
+            SET owner = ?, lease_until = ?
+            WHERE notification_id IN (
+                SELECT notification_id 
+                FROM notification
+                WHERE status = 'pending' AND next_attempt <= ? 
+                    AND (owner IS NULL OR owner = ? OR lease_until < ?)
+                ORDER BY notification_id
+                LIMIT ?)
+            RETURNING notification_id, bot_token, chat_id, text, attempts, (? - created_on) / 1000.0"""
+    try:
+        cur.execute(sql, (owner, lease_until, now, owner, now, limit, now_ms()))
+        rows = sorted(cur.fetchall())
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception('Error while claiming pending notifications')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return rows
+
+
+def release_notifications(owner: str):
+    """
+    Frees the notifications claimed by owner that were not sent, so other workers
+    can send them
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """UPDATE notification SET owner = NULL, lease_until = 0 WHERE owner = ?"""
+    try:
+        cur.execute(sql, (owner, ))
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception('Error while releasing notifications')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def count_pending_notifications() -> int:
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """SELECT COUNT(*) FROM notification WHERE status = 'pending'"""
+    try:
+        cur.execute(sql)
+        count = cur.fetchone()[0]
+    except sqlite3.Error as error:
+        logger.exception('Error while counting pending notifications')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return count
+
+
+def delete_notifications(notification_ids: Iterable[int]):
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """DELETE FROM notification 
+            WHERE notification_id IN (SELECT value FROM json_each(?))"""
+    try:
+        cur.execute(sql, (json.dumps(list(notification_ids)), ))
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception('Error while deleting sent notifications')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def defer_notifications(notification_ids: Iterable[int], next_attempt: float, max_attempts: int):
+    """
+    Schedules another attempt to send some notifications at next_attempt, by any
+    worker, or marks them as failed once they have been tried max_attempts times
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """UPDATE notification
+            SET attempts = attempts + 1,
+                next_attempt = ?,
+                owner = NULL,
+                lease_until = 0,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+            WHERE notification_id IN (SELECT value FROM json_each(?))"""
+    try:
+        cur.execute(sql, (next_attempt, max_attempts, json.dumps(list(notification_ids))))
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception('Error while deferring notifications')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_paper_balances(user_id: int) -> dict[str, float]:
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """SELECT currency, free FROM paper_balance WHERE user_id = ?"""
+    try:
+        cur.execute(sql, (user_id, ))
+        balances = dict(cur.fetchall())
+    except sqlite3.Error as error:
+        logger.exception(f'Error while retrieving paper balances for user {user_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return balances
+
+
+def apply_paper_fill(user_id: int, quote_ccy: str, cost: float, base_ccy: str, amount: float, 
+                        initial_balance: float) -> Optional[float]:
+    """
+    Debits cost from the paper balance of quote_ccy and credits amount to the one of
+    base_ccy in a single transaction. A user without a balance of quote_ccy starts
+    with initial_balance. Returns the remaining balance of quote_ccy, or None without
+    changing anything if it is not enough to cover cost
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql_init = """INSERT OR IGNORE INTO paper_balance (user_id, currency, free, updated_on)
+            VALUES (?, ?, ?, ?)"""
+    sql_debit = """UPDATE paper_balance 
+            SET free = free - ?, updated_on = ?
+            WHERE user_id = ? AND currency = ? AND free >= ?"""
+    sql_credit = """INSERT INTO paper_balance (user_id, currency, free, updated_on)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, currency) DO UPDATE 
+            SET free = free + excluded.free, updated_on = excluded.updated_on"""
+    sql_select = """SELECT free FROM paper_balance WHERE user_id = ? AND currency = ?"""
+    try:
+        now = now_ms()
+        cur.execute(sql_init, (user_id, quote_ccy, initial_balance, now))
+        cur.execute(sql_debit, (cost, now, user_id, quote_ccy, cost))
+        if cur.rowcount == 0:
+            conn.commit()
+            return None
+        cur.execute(sql_credit, (user_id, base_ccy, amount, now))
+        cur.execute(sql_select, (user_id, quote_ccy))
+        balance = cur.fetchone()[0]
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while updating paper balances for user {user_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return balance
+
+
+def acquire_shard_leases(owner: str, shards: int, ttl_ms: int) -> dict[int, int]:
+    """
+    Renews the leases of owner on the shards of users and balances the shards among
+    the workers alive: owner takes free or expired shards up to its fair share and
+    frees the ones above it. Returns the fence of each shard owned
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    now = now_ms()
+    expires_at = now + ttl_ms
+    sql_shards = """INSERT OR IGNORE INTO shard_lease (shards, shard) VALUES (?, ?)"""
+    sql_worker = """INSERT OR REPLACE INTO shard_worker (owner, shards, expires_at) 
+            VALUES (?, ?, ?)"""
+    sql_workers = """SELECT COUNT(*) FROM shard_worker 
+            WHERE shards = ? AND expires_at > ?"""
+    sql_renew = """UPDATE shard_lease SET expires_at = ?
+            WHERE shards = ? AND owner = ? AND expires_at > ?"""
+    sql_owned = """SELECT shard, fence FROM shard_lease 
+            WHERE shards = ? AND owner = ? AND expires_at > ?
+            ORDER BY shard"""
+    sql_free = """SELECT shard FROM shard_lease 
+            WHERE shards = ? AND (owner IS NULL OR expires_at <= ?)
+            ORDER BY shard"""
+    sql_take = """UPDATE shard_lease SET owner = ?, fence = fence + 1, expires_at = ?
+            WHERE shards = ? AND shard = ? AND (owner IS NULL OR expires_at <= ?)"""
+    sql_release = """UPDATE shard_lease SET owner = NULL, expires_at = 0
+            WHERE shards = ? AND shard = ? AND owner = ?"""
+    try:
+        cur.execute('BEGIN IMMEDIATE')
+        cur.executemany(sql_shards, [(shards, shard) for shard in range(shards)])
+        cur.execute(sql_worker, (owner, shards, expires_at))
+        cur.execute(sql_workers, (shards, now))
+        fair_share = -(-shards // cur.fetchone()[0])
+        cur.execute(sql_renew, (expires_at, shards, owner, now))
+        cur.execute(sql_owned, (shards, owner, now))
+        owned = [row[0] for row in cur.fetchall()]
+        if len(owned) > fair_share:
+            cur.executemany(sql_release, [(shards, shard, owner) for shard in owned[fair_share:]])
+        elif len(owned) < fair_share:
+            cur.execute(sql_free, (shards, now))
+            free = [row[0] for row in cur.fetchall()]
+            cur.executemany(sql_take, [(owner, expires_at, shards, shard, now) 
+                                        for shard in free[:fair_share - len(owned)]])
+        cur.execute(sql_owned, (shards, owner, now))
+        leases = dict(cur.fetchall())
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while acquiring shard leases for {owner}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return leases
+
+
+def renew_shard_leases(owner: str, shards: int, ttl_ms: int) -> dict[int, int]:
+    """
+    Extends the leases of owner that have not expired yet and returns the fence of
+    each shard still owned
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    now = now_ms()
+    sql_worker = """UPDATE shard_worker SET expires_at = ? WHERE owner = ?"""
+    sql_renew = """UPDATE shard_lease SET expires_at = ?
+            WHERE shards = ? AND owner = ? AND expires_at > ?"""
+    sql_owned = """SELECT shard, fence FROM shard_lease 
+            WHERE shards = ? AND owner = ? AND expires_at > ?"""
+    try:
+        cur.execute(sql_worker, (now + ttl_ms, owner))
+        cur.execute(sql_renew, (now + ttl_ms, shards, owner, now))
+        cur.execute(sql_owned, (shards, owner, now))
+        leases = dict(cur.fetchall())
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while renewing shard leases for {owner}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return leases
+
+
+def release_shard_leases(owner: str):
+    conn = create_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""UPDATE shard_lease SET owner = NULL, expires_at = 0 WHERE owner = ?""", (owner, ))
+        cur.execute("""DELETE FROM shard_worker WHERE owner = ?""", (owner, ))
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while releasing shard leases of {owner}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def claim_order(user_id: int, symbol: str, strategy: Strategy, interval: int, owner: str, 
+                shards: int, shard: int, fence: Optional[int]) -> Optional[int]:
+    """
+    Claims the only order a user can place for a symbol and strategy in interval 
+    milliseconds, refusing it if the previous claim is more recent than that. With a 
+    fence, the claim is only made if owner still holds the lease of the shard with
+    that fence. Returns the time of the claim, or None if it was not made
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """INSERT INTO order_claim (user_id, symbol, strategy, owner, fence, claimed_on)
+            SELECT ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM order_claim 
+                WHERE user_id = ? AND symbol = ? AND strategy = ? AND claimed_on > ?)
+            AND (? IS NULL OR EXISTS (
+                SELECT 1 FROM shard_lease 
+                WHERE shards = ? AND shard = ? AND owner = ? AND fence = ? AND expires_at > ?))
+            ON CONFLICT DO NOTHING"""
+    now = now_ms()
+    try:
+        cur.execute('BEGIN IMMEDIATE')
+        cur.execute(sql, (user_id, symbol, strategy.value, owner, fence, now, 
+                            user_id, symbol, strategy.value, now - interval,
+                            fence, shards, shard, owner, fence, now))
+        claimed = cur.rowcount == 1
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while claiming an order of {symbol} for user {user_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return now if claimed else None
+
+
+def release_order_claim(user_id: int, symbol: str, strategy: Strategy, claimed_on: int, owner: str):
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """DELETE FROM order_claim 
+            WHERE user_id = ? AND symbol = ? AND strategy = ? AND claimed_on = ? AND owner = ?"""
+    try:
+        cur.execute(sql, (user_id, symbol, strategy.value, claimed_on, owner))
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while releasing the order claim of {symbol} for user {user_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_latest_claim_dates(strategy: Strategy, user_ids: Optional[Iterable[int]] = None) -> dict[tuple, int]:
+    """
+    Returns the time in milliseconds of the latest order claim of a strategy for every
+    user and symbol, keyed by (user_id, symbol)
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    user_filter, params = _user_filter_clause(user_ids)
+    sql = f"""SELECT user_id, symbol, MAX(claimed_on)
+            FROM order_claim
+            WHERE strategy = ? {user_filter}
+            GROUP BY user_id, symbol"""
+    try:
+        cur.execute(sql, (strategy.value, ) + params)
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception(f'Failed to retrieve latest order claims for strategy {strategy.value}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return {(row[0], row[1]): row[2] for row in rows}
+
+
+def prune_order_claims(min_interval: int) -> int:
+    """
+    Deletes the order claims older than the longest interval between two orders: 
+    min_interval or the highest DCA frequency. Returns the number of claims deleted
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """DELETE FROM order_claim 
+            WHERE claimed_on < ? - MAX(?, COALESCE((SELECT MAX(frequency) FROM dca_config), 0) * ?)"""
+    try:
+        cur.execute(sql, (now_ms(), min_interval, MS_IN_A_DAY))
+        deleted = cur.rowcount
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception('Error while pruning order claims')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return deleted
+
+
+def get_last_candle_timestamps(exchange_id: str, timeframe: str) -> dict[str, int]:
+    """
+    Returns a dictionary with the timestamp of the newest candle stored for each 
+    symbol of an exchange and timeframe
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """SELECT symbol, last_timestamp
+            FROM candle_sync
+            WHERE exchange_id = ? AND timeframe = ?"""
+    try:
+        cur.execute(sql, (exchange_id, timeframe))
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while retrieving candle timestamps for exchange {exchange_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return dict(rows)
+
+
+def save_candles(exchange_id: str, symbol: str, timeframe: str, candles: list[list]):
+    """
+    Stores candles in the format returned by ccxt's fetch_ohlcv, replacing the ones
+    already stored with the same timestamp
+    """
+    if not candles:
+        return
+
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """INSERT OR REPLACE INTO candle (exchange_id, symbol, timeframe, timestamp, 
+                                            open, high, low, close, volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+    sql_sync = """INSERT OR REPLACE INTO candle_sync (exchange_id, symbol, timeframe, last_timestamp)
+            SELECT ?, ?, ?, MAX(timestamp) 
+            FROM candle 
+            WHERE exchange_id = ? AND symbol = ? AND timeframe = ?"""
+
+    key = (exchange_id, symbol, timeframe)
+    try:
+        cur.executemany(sql, (key + tuple(candle[:6]) for candle in candles))
+        cur.execute(sql_sync, key + key)
+        conn.commit()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while saving candles of {symbol} for exchange {exchange_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_close_prices(exchange_id: str, symbols: Iterable[str], timeframe: str, since: int) -> list[tuple]:
+    """
+    Returns (symbol, timestamp, close) rows of the stored candles of some symbols
+    that are newer than since (milliseconds)
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """SELECT symbol, timestamp, close
+            FROM candle
+            WHERE exchange_id = ? AND timeframe = ? AND timestamp >= ?
+                AND symbol IN (SELECT value FROM json_each(?))"""
+    try:
+        cur.execute(sql, (exchange_id, timeframe, since, json.dumps(sorted(symbols))))
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while retrieving close prices for exchange {exchange_id}')
+        raise error
+    finally:
+        cur.close()
+        conn.close()
+
+    return rows
+
+
+def get_symbol_closes(exchange_id: str, symbol: str, timeframe: str, start: int, end: int) -> list[tuple]:
+    """
+    Returns (timestamp, close) rows of the stored candles of a symbol between start and 
+    end (both inclusive, in milliseconds) sorted by timestamp
+    """
+    conn = create_connection()
+    cur = conn.cursor()
+    sql = """SELECT timestamp, close
+            FROM candle
+            WHERE exchange_id = ? AND symbol = ? AND timeframe = ? AND timestamp BETWEEN ? AND ?
+            ORDER BY timestamp"""
+    try:
+        cur.execute(sql, (exchange_id, symbol, timeframe, start, end))
+        rows = cur.fetchall()
+    except sqlite3.Error as error:
+        logger.exception(f'Error while retrieving close prices of {symbol} for exchange {exchange_id}')
         raise error
     finally:
         cur.close()
         conn.close()
 
+    return rows
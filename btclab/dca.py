@@ -1,12 +1,13 @@
 import logging
 from datetime import datetime, timedelta
-from dateutil import parser 
-from ccxt.base.errors import InsufficientFunds, AuthenticationError
+from typing import Iterable, Optional
 
-from common import Strategy
+from common import MS_IN_A_MINUTE, Strategy, now_ms
 import database
 from users import Account
 import crypto
+from market import MarketSnapshot
+from retries import RetryLater
 
 
 logger = logging.getLogger(__name__)
@@ -55,8 +56,16 @@ def get_dca_summary(user_account: Account, dry_run: bool) -> str:
     return msg
 
 
-def buy(user_account: Account, dry_run: bool):
+def buy(user_account: Account, dry_run: bool, market: Optional[MarketSnapshot] = None, 
+        symbols: Optional[Iterable[str]] = None):
+    """
+    Places the periodic orders that are due, checking only the given symbols if any
+    """
+    from ccxt.base.errors import InsufficientFunds, AuthenticationError
+
     for symbol, config in user_account.dca_config.items():
+        if symbols is not None and symbol not in symbols:
+            continue
         cost = config['order_cost']
         user_id = user_account.user_id
         is_dummy = config['is_dummy'] or dry_run
@@ -69,40 +78,58 @@ def buy(user_account: Account, dry_run: bool):
             continue
 
         if config['last_check_result'] == 'Insufficient funds':
-            last_check = parser.parse(config['last_check_date'])
-            time_since_last_check = datetime.utcnow() - last_check
-            minutes = time_since_last_check.total_seconds() / 60
+            minutes = (now_ms() - config['last_check_date']) / MS_IN_A_MINUTE
             if minutes < 90:
                 logger.info(f'Waiting {90 - minutes} minutes to check again for dips in {symbol} after insufficient funds')
                 continue
 
+        quote_ccy = symbol.split('/')[1]
         try:
-            order = crypto.place_buy_order(exchange=user_account.exchange, 
-                                            symbol=symbol, 
-                                            price=None, 
-                                            order_cost=cost, 
-                                            order_type='market', 
-                                            strategy=Strategy.DCA,
-                                            is_dummy=config['is_dummy'],
-                                            dry_run=dry_run,
-                                            user_id=user_id)
+            if not is_dummy:
+                balance = crypto.check_funds(user_account.balances, symbol, cost)
+                if balance:
+                    user_account.record_check(symbol, Strategy.DCA, 'Insufficient funds')
+                    msg = crypto.get_insufficient_funds_msg(symbol, cost, balance, 90)
+                    logger.info(msg)
+                    user_account.telegram_bot.send_msg(msg)
+                    continue
+
+            price = market.get_price(symbol) if market else None
+            with user_account.claim_order(symbol, Strategy.DCA, is_dummy) as claimed:
+                if not claimed:
+                    continue
+                order = crypto.place_buy_order(exchange=user_account.exchange, 
+                                                symbol=symbol, 
+                                                price=price, 
+                                                order_cost=cost, 
+                                                order_type='market', 
+                                                strategy=Strategy.DCA,
+                                                is_dummy=config['is_dummy'],
+                                                dry_run=dry_run,
+                                                user_id=user_id)
         except InsufficientFunds:
-            database.update_last_check(user_account.user_id, symbol, Strategy.DCA, 'Insufficient funds')
-            quote_ccy = symbol.split('/')[1]
+            user_account.record_check(symbol, Strategy.DCA, 'Insufficient funds')
+            user_account.balances.invalidate()
             base_ccy = symbol.split('/')[0]
             msg = f'Insufficient funds to buy {cost:.1f} {quote_ccy} of {base_ccy}. Trying again in 24 hours'
             logger.info(msg)
             user_account.telegram_bot.send_msg(msg)
             continue
         except AuthenticationError:
-            database.update_last_check(user_account.user_id, symbol, Strategy.DCA, 'Authentication error')
+            user_account.record_check(symbol, Strategy.DCA, 'Authentication error')
             logger.error('Authentication error')
             continue
+        except RetryLater as error:
+            logger.warning(f'Unable to buy {symbol} for user {user_id}. {error}')
+            user_account.defer(symbol, Strategy.DCA, error.retry_at)
+            continue
         if order:
+            if not is_dummy:
+                user_account.balances.debit(quote_ccy, order['cost'] or cost)
+            database.save_order(order, Strategy.DCA)
             msg = get_dca_buy_msg(order)
             logger.info(msg)
             user_account.telegram_bot.send_msg(msg)
-            database.save_order(order, Strategy.DCA)
-            database.update_last_check(user_account.user_id, symbol, Strategy.DCA, 'Order placed')
+            user_account.record_check(symbol, Strategy.DCA, 'Order placed')
         else:
-            database.update_last_check(user_account.user_id, symbol, Strategy.DCA, 'No action')
+            user_account.record_check(symbol, Strategy.DCA, 'No action')
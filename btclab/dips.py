@@ -1,46 +1,56 @@
 import logging
-from typing import Optional
-from ccxt import Exchange
-from ccxt.base.errors import InsufficientFunds, NetworkError, AuthenticationError
+from typing import Iterable, Optional
 from dataclasses import dataclass
-from datetime import datetime
-from dateutil import parser
-from retry import retry
 
 import database
 import crypto
-from common import Strategy
+from common import MS_IN_A_MINUTE, Strategy, now_ms
 from users import Account
 from order import Order
+from market import MarketSnapshot
+from retries import RetryLater
 
 
 logger = logging.getLogger(__name__)
 
 
-def buy_drop(user_account: Account, symbol: str, dip_config: dict, symbols_stats: dict, dry_run: bool):
+def get_min_drop(symbol: str, dip_config: dict, symbols_stats: dict) -> float:
     """
-    Places a new buy order if at current price the change in the last 24h represents a drop
-    that surpasses the min_drop limit and the symbol has not been bought in the last 24 hours
+    Returns the change in the last 24h (a negative percentage) below which a price
+    drop is bought
     """
-    
     if dip_config['min_drop_units'] == 'SD':
-        min_drop = dip_config['min_drop_value'] * symbols_stats[symbol]['std_dev'] * -100
-    else:
-        min_drop = dip_config['min_drop_value'] * -1
+        return dip_config['min_drop_value'] * symbols_stats[symbol]['std_dev'] * -100
+    return dip_config['min_drop_value'] * -1
+
+
+def buy_drop(user_account: Account, symbol: str, dip_config: dict, symbols_stats: dict, dry_run: bool, 
+                market: Optional[MarketSnapshot] = None, ticker: Optional[dict] = None):
+    """
+    Places a new buy order if at current price the change in the last 24h represents a drop
+    that surpasses the min_drop limit and the symbol has not been bought in the last 24 hours.
+    The ticker is requested unless it is given, as when it comes from a ticker feed.
+    The order is saved before the user is notified, and returned
+    """
+    from ccxt.base.errors import InsufficientFunds, AuthenticationError
+
+    min_drop = get_min_drop(symbol, dip_config, symbols_stats)
     
     if dip_config['last_check_result'] == 'Insufficient funds':
-        last_check = parser.parse(dip_config['last_check_date'])
-        time_since_last_check = datetime.utcnow() - last_check
-        minutes = time_since_last_check.total_seconds() / 60
+        minutes = (now_ms() - dip_config['last_check_date']) / MS_IN_A_MINUTE
         if minutes < 60:
             logger.info('Insufficient funds to buy dip last time. Waiting 1 hour to try again')
             return
 
-    try:
-        ticker = user_account.exchange.fetch_ticker(symbol)
-    except AuthenticationError:
-        logger.error('Authentication error')
-        return
+    if ticker is None:
+        try:
+            if market:
+                ticker = market.get_ticker(symbol)
+            else:
+                ticker = user_account.exchange.fetch_ticker(symbol)
+        except AuthenticationError:
+            logger.error('Authentication error')
+            return
 
     asset = symbol.split('/')[0]
     quote_ccy = symbol.split('/')[1]
@@ -56,32 +66,47 @@ def buy_drop(user_account: Account, symbol: str, dip_config: dict, symbols_stats
 
     if ticker['percentage'] < min_drop:
          if chg_from_last_dip < -dip_config['min_additional_drop_pct'] or (last_dip is None and last_dca is not None):
-        
+            if not is_dummy:
+                balance = crypto.check_funds(user_account.balances, symbol, cost)
+                if balance:
+                    user_account.record_check(symbol, Strategy.BUY_THE_DIPS, 'Insufficient funds')
+                    msg = crypto.get_insufficient_funds_msg(symbol, cost, balance, 60)
+                    logger.info(msg)
+                    user_account.telegram_bot.send_msg(msg)
+                    return None
+
             try:
-                order = crypto.place_buy_order(exchange=user_account.exchange, 
-                                                user_id=user_account.user_id,
-                                                symbol=symbol, 
-                                                price=price,
-                                                order_cost=cost,
-                                                order_type='market', 
-                                                strategy=Strategy.BUY_THE_DIPS,
-                                                is_dummy=is_dummy,
-                                                dry_run=dry_run)
+                with user_account.claim_order(symbol, Strategy.BUY_THE_DIPS, is_dummy) as claimed:
+                    if not claimed:
+                        return None
+                    order = crypto.place_buy_order(exchange=user_account.exchange, 
+                                                    user_id=user_account.user_id,
+                                                    symbol=symbol, 
+                                                    price=price,
+                                                    order_cost=cost,
+                                                    order_type='market', 
+                                                    strategy=Strategy.BUY_THE_DIPS,
+                                                    is_dummy=is_dummy,
+                                                    dry_run=dry_run)
             except InsufficientFunds:
-                database.update_last_check(user_account.user_id, symbol, Strategy.BUY_THE_DIPS, 'Insufficient funds')
+                user_account.record_check(symbol, Strategy.BUY_THE_DIPS, 'Insufficient funds')
+                user_account.balances.invalidate()
                 logger.info('Insufficient funds')
                 msg = f'Insufficient funds to buy {cost:.1f} {quote_ccy} of {base_ccy}. Trying again in 1 hour'
                 user_account.telegram_bot.send_msg(msg)
                 return None
     else:
-        database.update_last_check(user_account.user_id, symbol, Strategy.BUY_THE_DIPS, 'No action')
+        user_account.record_check(symbol, Strategy.BUY_THE_DIPS, 'No action')
         msg = f'{symbol}: Last 24h change is {ticker["percentage"]:+.2f}%, min drop of {min_drop:.2f}% not met'
         logger.info(msg)
         return
 
     
     if order:
-        database.update_last_check(user_account.user_id, symbol, Strategy.BUY_THE_DIPS, 'Order placed')
+        database.save_order(order, Strategy.BUY_THE_DIPS)
+        if not is_dummy:
+            user_account.balances.debit(quote_ccy, order['cost'] or cost)
+        user_account.record_check(symbol, Strategy.BUY_THE_DIPS, 'Order placed')
         msg = (f'Buying {order["cost"]:,.2f} {quote_ccy} of {asset} @ {price:,.6g}. '
                 f'Drop in last 24h is {ticker["percentage"]:+.2f}%')
         if is_dummy:
@@ -91,19 +116,23 @@ def buy_drop(user_account: Account, symbol: str, dip_config: dict, symbols_stats
             user_account.telegram_bot.send_msg(msg)
     else:
         msg = f'{symbol}: {dip_config["min_additional_drop_pct"]}% of min additional drop from previous order not met'
-        database.update_last_check(user_account.user_id, symbol, Strategy.BUY_THE_DIPS, 'No action')
+        user_account.record_check(symbol, Strategy.BUY_THE_DIPS, 'No action')
     
     logger.info(msg)
     return order
     
 
-@retry(NetworkError, delay=15, jitter=5, logger=logger)
-def buy_dips(user_account: Account, symbols_stats: dict, dry_run: bool):
+def buy_dips(user_account: Account, symbols_stats: dict, dry_run: bool, market: Optional[MarketSnapshot] = None, 
+                symbols: Optional[Iterable[str]] = None):
     """
-    Place orders for buying dips
+    Place orders for buying dips, checking only the given symbols if any
     """
     for symbol, dip_config in user_account.dips_config.items():
-        order = buy_drop(user_account, symbol, dip_config, symbols_stats, dry_run)
-        
-        if order is not None:
-            database.save_order(order, Strategy.BUY_THE_DIPS)
+        if symbols is not None and symbol not in symbols:
+            continue
+        try:
+            buy_drop(user_account, symbol, dip_config, symbols_stats, dry_run, market)
+        except RetryLater as error:
+            logger.warning(f'Unable to check dips of {symbol} for user {user_account.user_id}. {error}')
+            user_account.defer(symbol, Strategy.BUY_THE_DIPS, error.retry_at)
+            continue
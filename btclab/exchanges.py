@@ -0,0 +1,219 @@
+import os
+import gzip
+import time
+import pickle
+import logging
+import threading
+from typing import Optional
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MARKETS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+MARKETS_TTL = 24 # Hours
+MARKETS_RETRY = 300 # Seconds until a failed refresh of expired markets is retried
+
+_lock = threading.RLock()
+_classes = {}
+_clients = {}
+_public_clients = {}
+_sessions = {}
+_limiters = {}
+_markets_locks = {}
+_markets_expire_on = {}
+
+
+class RateLimiter():
+    """
+    Rate limiter shared by all clients of an exchange, so requests made by different
+    accounts from the same IP are spaced as if they were made by a single client.
+    Each request reserves rate_limit * cost milliseconds and waits for its turn
+    """
+    def __init__(self, rate_limit: float):
+        self.rate_limit = rate_limit
+        self._next_request = 0.0
+        self._lock = threading.Lock()
+
+    def throttle(self, cost: Optional[float] = None):
+        cost = 1 if cost is None else cost
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_request)
+            self._next_request = start + self.rate_limit * cost / 1000
+        if start > now:
+            time.sleep(start - now)
+
+
+def register_exchange(exchange_id: str, exchange_class: type):
+    """
+    Registers a ccxt-compatible class for an exchange id, which takes precedence over
+    the classes of the ccxt library
+    """
+    _classes[exchange_id.lower()] = exchange_class
+
+
+def _get_class(exchange_id: str) -> type:
+    if exchange_id in _classes:
+        return _classes[exchange_id]
+    # ccxt takes longer to import than a cycle with nothing due takes to run
+    import ccxt
+    if exchange_id not in ccxt.exchanges:
+        raise ValueError(f'Unknown exchange: {exchange_id}')
+    return getattr(ccxt, exchange_id)
+
+
+def _get_markets_file(exchange_id: str) -> str:
+    return os.path.join(MARKETS_CACHE_DIR, f'{exchange_id}-markets.pickle.gz')
+
+
+def read_markets_cache(exchange_id: str, ttl: float = MARKETS_TTL) -> Optional[tuple]:
+    """
+    Returns the markets and currencies of an exchange saved on disk, or None if they
+    are missing, unreadable or older than ttl hours
+    """
+    file_name = _get_markets_file(exchange_id)
+    try:
+        if time.time() - os.path.getmtime(file_name) > ttl * 3600:
+            return None
+        with gzip.open(file_name, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning(f'Could not read the cached markets of {exchange_id}', exc_info=True)
+        return None
+
+
+def write_markets_cache(exchange_id: str, client):
+    """
+    Saves the markets and currencies loaded by a client, replacing the file atomically
+    so other processes never read it half written
+    """
+    file_name = _get_markets_file(exchange_id)
+    tmp_file = f'{file_name}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(MARKETS_CACHE_DIR, exist_ok=True)
+        with gzip.open(tmp_file, 'wb', compresslevel=1) as f:
+            pickle.dump((list(client.markets.values()), client.currencies), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, file_name)
+    except OSError:
+        logger.warning(f'Could not cache the markets of {exchange_id}', exc_info=True)
+
+
+def _load_markets_from_cache(exchange_id: str, client) -> bool:
+    cached = read_markets_cache(exchange_id)
+    if cached is None:
+        return False
+    markets, currencies = cached
+    client.set_markets(markets, currencies)
+    try:
+        loaded_on = os.path.getmtime(_get_markets_file(exchange_id))
+    except OSError:
+        loaded_on = time.time()
+    _markets_expire_on[exchange_id] = loaded_on + MARKETS_TTL * 3600
+    logger.debug(f'Loaded {len(client.markets)} markets of {exchange_id} from cache')
+    return True
+
+
+def _load_markets(exchange_id: str, client, reload: bool = False, params: dict = {}) -> dict:
+    """
+    Replaces load_markets of the clients of the registry. Markets are loaded once per
+    exchange by its public client and shared by all the other clients. They are read
+    from the disk cache while it is fresh, and downloaded and cached otherwise. Once
+    they are older than MARKETS_TTL hours, they are read again from the cache if
+    another process refreshed it or downloaded again, keeping the old ones if the
+    exchange cannot be reached
+    """
+    public_client = get_public_client(exchange_id)
+    with _markets_locks[exchange_id]:
+        expired = time.time() > _markets_expire_on.get(exchange_id, 0)
+        if reload or not public_client.markets or \
+                (expired and not _load_markets_from_cache(exchange_id, public_client)):
+            from ccxt.base.errors import NetworkError
+
+            try:
+                type(public_client).load_markets(public_client, True, params)
+            except NetworkError:
+                if reload or not public_client.markets:
+                    raise
+                logger.warning(f'Could not refresh the markets of {exchange_id}, using the ones loaded before',
+                                exc_info=True)
+                _markets_expire_on[exchange_id] = time.time() + MARKETS_RETRY
+            else:
+                _markets_expire_on[exchange_id] = time.time() + MARKETS_TTL * 3600
+                write_markets_cache(exchange_id, public_client)
+    if client is not public_client and client.markets is not public_client.markets:
+        client.set_markets_from_exchange(public_client)
+    return client.markets
+
+
+def _instrument(exchange_id: str, client):
+    """
+    Wraps fetch2, through which ccxt sends every request to the exchange, to record
+    the number, duration, weight and errors of the requests of each endpoint
+    """
+    fetch2 = client.fetch2
+
+    def instrumented_fetch2(path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+        metrics.inc('exchange_requests_total', exchange=exchange_id, endpoint=path)
+        metrics.inc('exchange_weight_total', config.get('cost', 1), exchange=exchange_id)
+        start = time.perf_counter()
+        try:
+            return fetch2(path, api, method, params, headers, body, config)
+        except Exception as error:
+            metrics.inc('exchange_errors_total', exchange=exchange_id, error=type(error).__name__)
+            raise
+        finally:
+            metrics.observe('exchange_request_seconds', time.perf_counter() - start, exchange=exchange_id)
+
+    client.fetch2 = instrumented_fetch2
+
+
+def _create_client(exchange_id: str, config: dict):
+    from requests import Session
+
+    exchange_class = _get_class(exchange_id)
+    if exchange_id not in _sessions:
+        _sessions[exchange_id] = Session()
+        _markets_locks[exchange_id] = threading.Lock()
+    client = exchange_class({**config, 'enableRateLimit': True, 'session': _sessions[exchange_id]})
+    if exchange_id not in _limiters:
+        _limiters[exchange_id] = RateLimiter(client.rateLimit)
+    client.throttle = _limiters[exchange_id].throttle
+    client.load_markets = lambda reload=False, params={}: _load_markets(exchange_id, client, reload, params)
+    if hasattr(client, 'fetch2'):
+        _instrument(exchange_id, client)
+    public_client = _public_clients.get(exchange_id)
+    if public_client is not None and public_client.markets:
+        client.set_markets_from_exchange(public_client)
+    return client
+
+
+def get_public_client(exchange_id: str):
+    """
+    Returns the unauthenticated client of an exchange, used for public market data.
+    The first time, it gets the markets of the disk cache if they are fresh
+    """
+    exchange_id = exchange_id.lower()
+    with _lock:
+        if exchange_id not in _public_clients:
+            client = _create_client(exchange_id, {})
+            _load_markets_from_cache(exchange_id, client)
+            _public_clients[exchange_id] = client
+        return _public_clients[exchange_id]
+
+
+def get_client(exchange_id: str, api_key: str, api_secret: str):
+    """
+    Returns the client of an exchange for some credentials, creating it the first time.
+    Clients of the same exchange share their HTTP session, rate limiter and markets
+    """
+    exchange_id = exchange_id.lower()
+    key = (exchange_id, api_key, api_secret)
+    with _lock:
+        if key not in _clients:
+            get_public_client(exchange_id)
+            _clients[key] = _create_client(exchange_id, {'apiKey': api_key, 'secret': api_secret})
+        return _clients[key]
@@ -0,0 +1,156 @@
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from ccxt.base.errors import RequestTimeout, InsufficientFunds
+
+
+class FakeExchange():
+    """
+    In-process stand-in for a ccxt exchange, with the subset of its API used by the
+    bot. Every method goes through fetch2, like ccxt, which waits latency seconds
+    and fails with a RequestTimeout at failure_rate. Prices follow a random walk, so
+    some 24h changes are deep enough to trigger dip purchases. Parameters are class
+    attributes, so they apply to the clients created by the exchanges module
+    """
+    id = 'fake'
+    name = 'Fake'
+    rateLimit = 0
+    latency = 0.0               # Seconds per request
+    failure_rate = 0.0          # Probability of a request failing with a network error
+    balance = 1_000_000.0       # Free balance of each quote currency
+    symbols_count = 50
+    seed = 0
+
+    def __init__(self, config: Optional[dict] = None):
+        config = config or {}
+        self.apiKey = config.get('apiKey')
+        self.secret = config.get('secret')
+        self.enableRateLimit = config.get('enableRateLimit', True)
+        self.has = {'fetchTickers': True, 'fetchOHLCV': True, 'createMarketOrder': True, 'watchTickers': False}
+        self.options = {}
+        self.markets = None
+        self.symbols = None
+        self.currencies = {}
+        self._random = random.Random(f'{self.seed}-{self.apiKey}')
+        self._lock = threading.Lock()
+
+    def throttle(self, cost: Optional[float] = None):
+        pass
+
+    def fetch2(self, path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+        if self.enableRateLimit:
+            self.throttle(config.get('cost', 1))
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            raise RequestTimeout(f'{self.id} {method} {path} timed out')
+        return {}
+
+    @staticmethod
+    def parse_timeframe(timeframe: str) -> int:
+        units = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+        return int(timeframe[:-1]) * units[timeframe[-1]]
+
+    @classmethod
+    def get_symbols(cls) -> list[str]:
+        return [f'COIN{i}/USDT' for i in range(cls.symbols_count)]
+
+    def set_markets(self, markets, currencies=None):
+        if isinstance(markets, list):
+            markets = {market['symbol']: market for market in markets}
+        self.markets = markets
+        self.symbols = sorted(markets)
+        self.currencies = currencies or {}
+        return markets
+
+    def set_markets_from_exchange(self, exchange):
+        self.markets = exchange.markets
+        self.symbols = exchange.symbols
+        self.currencies = exchange.currencies
+
+    def load_markets(self, reload: bool = False, params: dict = {}) -> dict:
+        if self.markets and not reload:
+            return self.markets
+        self.fetch2('exchangeInfo', config={'cost': 10})
+        markets = [{'id': symbol.replace('/', ''), 'symbol': symbol, 'base': symbol.split('/')[0],
+                    'quote': symbol.split('/')[1], 'active': True} for symbol in self.get_symbols()]
+        return self.set_markets(markets)
+
+    def _price(self, symbol: str, timestamp: float) -> float:
+        """
+        Deterministic random walk of hourly prices, starting at 100 on 2020-01-01
+        """
+        hours = int((timestamp - 1577836800) // 3600)
+        state = random.Random(f'{symbol}-{hours // 24}')
+        return 100 * (1 + state.gauss(0, 0.05)) * (1 + 0.01 * ((hours % 24) - 12) / 12)
+
+    def _ticker(self, symbol: str, now: float) -> dict:
+        last = self._price(symbol, now)
+        open_ = self._price(symbol, now - 86400)
+        return {'symbol': symbol, 'timestamp': int(now * 1000), 'last': last, 'open': open_,
+                'percentage': (last / open_ - 1) * 100}
+
+    def fetch_ticker(self, symbol: str, params: dict = {}) -> dict:
+        self.fetch2('ticker/24hr', config={'cost': 1})
+        return self._ticker(symbol, time.time())
+
+    def fetch_tickers(self, symbols: Optional[list[str]] = None, params: dict = {}) -> dict:
+        self.fetch2('ticker/24hr', config={'cost': 40 if symbols is None else min(len(symbols), 40)})
+        now = time.time()
+        return {symbol: self._ticker(symbol, now) for symbol in symbols or self.get_symbols()}
+
+    def fetch_balance(self, params: dict = {}) -> dict:
+        self.fetch2('account', 'private', config={'cost': 10})
+        balance = {'info': {}, 'free': {'USDT': self.balance}, 'used': {'USDT': 0}, 'total': {'USDT': self.balance}}
+        balance['USDT'] = {'free': self.balance, 'used': 0, 'total': self.balance}
+        return balance
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = '1m', since: Optional[int] = None,
+                    limit: Optional[int] = None, params: dict = {}) -> list[list]:
+        self.fetch2('klines', config={'cost': 1})
+        step = self.parse_timeframe(timeframe) * 1000
+        limit = limit or 500
+        now = int(time.time() * 1000)
+        end = now - now % step
+        start = end - (limit - 1) * step if since is None else since - since % step
+        candles = []
+        for timestamp in range(start, min(end, start + (limit - 1) * step) + 1, step):
+            close = self._price(symbol, timestamp / 1000)
+            candles.append([timestamp, close, close * 1.01, close * 0.99, close, 1.0])
+        return candles
+
+    def private_post_order_test(self, params: dict = {}) -> dict:
+        self.fetch2('order/test', 'private', 'POST', params, config={'cost': 1})
+        return {}
+
+    def _order(self, symbol: str, order_type: str, amount: float, price: Optional[float], cost: float) -> dict:
+        self.fetch2('order', 'private', 'POST', config={'cost': 1})
+        if cost > self.balance:
+            raise InsufficientFunds(f'{self.id} Account has insufficient balance for requested action')
+        now = datetime.now(timezone.utc)
+        return {
+            'id': f'{self.apiKey}-{now.timestamp():.6f}-{self._random.randrange(10 ** 6)}',
+            'datetime': now.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'timestamp': int(now.timestamp() * 1000),
+            'symbol': symbol,
+            'type': order_type,
+            'side': 'buy',
+            'price': price,
+            'amount': amount,
+            'cost': cost,
+        }
+
+    def create_market_buy_order(self, symbol: str, amount: float, params: Optional[dict] = None) -> dict:
+        price = self._price(symbol, time.time())
+        if params and 'quoteOrderQty' in params:
+            cost = params['quoteOrderQty']
+            return self._order(symbol, 'market', cost / price, price, cost)
+        return self._order(symbol, 'market', amount, price, amount * price)
+
+    def create_limit_buy_order(self, symbol: str, amount: float, price: float, params: dict = {}) -> dict:
+        return self._order(symbol, 'limit', amount, price, amount * price)
@@ -0,0 +1,99 @@
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import retries
+from retries import RetryLater
+
+
+logger = logging.getLogger(__name__)
+
+MISSING_SYMBOL_RETRY = 3600     # Seconds before checking again a symbol the exchange has no ticker for
+
+
+@dataclass
+class MarketSnapshot():
+    """
+    Tickers of an exchange shared by all accounts during a bot cycle. Tickers are
+    requested in bulk with a single fetch_tickers call and served from memory
+    until they are older than ttl seconds. Symbols that are not in the markets of
+    the exchange are left out of the request, so they do not make it fail for all
+    accounts, and are kept in missing until the next refresh
+    """
+    exchange: object
+    ttl: float = 60
+    symbols: set = field(default_factory=set)
+    tickers: dict = field(default_factory=dict)
+    missing: set = field(default_factory=set)
+    fetched_at: Optional[float] = None
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def is_fresh(self) -> bool:
+        return self.fetched_at is not None and time.monotonic() - self.fetched_at < self.ttl
+
+    def add_symbols(self, symbols: Iterable[str]):
+        self.symbols.update(symbols)
+
+    @retries.with_backoff('load_markets')
+    def _get_listed(self, symbols: set[str]) -> set[str]:
+        self.exchange.load_markets()
+        return {symbol for symbol in symbols if symbol in self.exchange.markets}
+
+    @retries.with_backoff('fetch_tickers')
+    def _fetch(self, symbols: set[str]) -> dict:
+        if self.exchange.has['fetchTickers']:
+            return self.exchange.fetch_tickers(sorted(symbols))
+
+        logger.warning(f'{self.exchange.name} exchange does not support fetchTickers method')
+        return {symbol: self.exchange.fetch_ticker(symbol) for symbol in symbols}
+
+    def refresh(self, symbols: Optional[Iterable[str]] = None):
+        """
+        Replaces the tickers in the snapshot with the latest ones for all known symbols
+        """
+        with self._lock:
+            if symbols is not None:
+                self.symbols.update(symbols)
+            self._refresh()
+
+    def _refresh(self):
+        listed = self._get_listed(self.symbols)
+        logger.debug(f'Fetching tickers for {len(listed)} symbol(s) from {self.exchange.id}')
+        self.tickers = self._fetch(listed) if listed else {}
+        missing = self.symbols.difference(self.tickers)
+        if missing.difference(self.missing):
+            logger.warning(f'No tickers in {self.exchange.id} for {", ".join(sorted(missing))}. '
+                            f'They may be misspelled or delisted')
+        self.missing = missing
+        self.fetched_at = time.monotonic()
+
+    def get_tickers(self, symbols: Iterable[str]) -> dict:
+        """
+        Returns a dictionary of tickers for the given symbols, refreshing the
+        snapshot only if it is stale or if some symbol has not been requested yet.
+        Symbols without a ticker are left out
+        """
+        symbols = set(symbols)
+        with self._lock:
+            if not self.is_fresh() or not symbols.issubset(self.tickers.keys() | self.missing):
+                self.symbols.update(symbols)
+                self._refresh()
+            return {symbol: self.tickers[symbol] for symbol in symbols if symbol in self.tickers}
+
+    def get_ticker(self, symbol: str) -> dict:
+        """
+        Returns the ticker of a symbol. Raises RetryLater if the exchange has none, so
+        only the accounts using the symbol skip it for a while
+        """
+        ticker = self.get_tickers([symbol]).get(symbol)
+        if ticker is None:
+            raise RetryLater('fetch_tickers', time.time() + MISSING_SYMBOL_RETRY, 
+                                f'No ticker for {symbol} in {self.exchange.id}')
+        return ticker
+
+    def get_price(self, symbol: str) -> float:
+        return self.get_ticker(symbol)['last']
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'btclab_'
+PROMETHEUS_FILE = 'btclab.prom'
+JSON_FILE = 'metrics.json'
+
+# Metrics with a value per account are only written to the JSON summary, to keep
+# the number of Prometheus series independent of the number of users
+PER_ACCOUNT_METRICS = {'account_seconds'}
+
+_lock = threading.Lock()
+# Counters map (name, labels) to a value and timers to [count, sum, max], both since
+# the process started (_total) and since the last export (_cycle)
+_total_counters = {}
+_total_timers = {}
+_cycle_counters = {}
+_cycle_timers = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _total_counters[key] = _total_counters.get(key, 0) + value
+        _cycle_counters[key] = _cycle_counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        for timers in (_total_timers, _cycle_timers):
+            timer = timers.get(key)
+            if timer is None:
+                timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def reset():
+    with _lock:
+        for metrics in (_total_counters, _total_timers, _cycle_counters, _cycle_timers):
+            metrics.clear()
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    values = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, values)) + '}'
+
+
+def to_prometheus(counters: dict, timers: dict, gauges: Optional[dict] = None) -> str:
+    """
+    Returns the metrics in the Prometheus text exposition format. Timers are exported
+    as summaries (_count and _sum) plus a separate _max gauge with the maximum
+    """
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {PREFIX}{name} counter')
+        lines.extend(f'{PREFIX}{name}{_format_labels(labels)} {value:g}'
+                        for (metric, labels), value in sorted(counters.items()) if metric == name)
+    for name in sorted({name for name, _ in timers} - PER_ACCOUNT_METRICS):
+        samples = [(labels, value) for (metric, labels), value in sorted(timers.items()) if metric == name]
+        lines.append(f'# TYPE {PREFIX}{name} summary')
+        for labels, (count, total, _) in samples:
+            lines.append(f'{PREFIX}{name}_count{_format_labels(labels)} {count}')
+            lines.append(f'{PREFIX}{name}_sum{_format_labels(labels)} {total:.6f}')
+        # Summaries only allow _count and _sum samples, so the maximum is a family of its own
+        lines.append(f'# TYPE {PREFIX}{name}_max gauge')
+        lines.extend(f'{PREFIX}{name}_max{_format_labels(labels)} {maximum:.6f}' for labels, (_, _, maximum) in samples)
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f'# TYPE {PREFIX}{name} gauge')
+        lines.append(f'{PREFIX}{name} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def _summarize(counters: dict, timers: dict) -> dict:
+    summary = {'counters': {}, 'timers': {}}
+    for (name, labels), value in sorted(counters.items()):
+        summary['counters'].setdefault(name, []).append({**dict(labels), 'value': value})
+    for (name, labels), (count, total, maximum) in sorted(timers.items()):
+        summary['timers'].setdefault(name, []).append({**dict(labels), 'count': count, 'sum': total,
+                                                        'mean': total / count, 'max': maximum})
+    for name in PER_ACCOUNT_METRICS.intersection(summary['timers']):
+        summary['timers'][name].sort(key=lambda item: item['sum'], reverse=True)
+    return summary
+
+
+def _write_atomic(path: str, text: str):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+
+def collect_cycle() -> dict:
+    """
+    Returns a summary of the metrics since the last export or collection, and starts
+    counting a new cycle
+    """
+    with _lock:
+        cycle_counters, cycle_timers = dict(_cycle_counters), {k: list(v) for k, v in _cycle_timers.items()}
+        _cycle_counters.clear()
+        _cycle_timers.clear()
+    return _summarize(cycle_counters, cycle_timers)
+
+
+def export(directory: str, cycle: Optional[dict] = None):
+    """
+    Writes the metrics since the process started as a Prometheus text file (for the
+    textfile collector of node_exporter) and a JSON summary of the metrics since the
+    last export, and starts counting a new cycle
+    """
+    import retries
+
+    with _lock:
+        total_counters, total_timers = dict(_total_counters), {k: list(v) for k, v in _total_timers.items()}
+    summary = collect_cycle()
+
+    retry_stats = retries.get_stats()
+    gauges = {'retry_backoffs': retry_stats['backoffs'], 'retry_open_circuits': retry_stats['open_circuits']}
+    gauges.update({f'cycle_{name}': value for name, value in (cycle or {}).items()
+                    if isinstance(value, (int, float))})
+
+    os.makedirs(directory, exist_ok=True)
+    _write_atomic(os.path.join(directory, PROMETHEUS_FILE), to_prometheus(total_counters, total_timers, gauges))
+    summary = {'cycle': cycle or {}, 'retries': retry_stats, **summary}
+    _write_atomic(os.path.join(directory, JSON_FILE), json.dumps(summary, indent=1, default=str))
+    logger.debug(f'Metrics written to {directory}')
+
+
+@contextmanager
+def profile(kind: Optional[str], directory: str = '.'):
+    """
+    Profiles the code run inside the context with cProfile or pyinstrument and saves
+    the result in directory. Does nothing if kind is None
+    """
+    if kind is None:
+        yield
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.join(directory, f'profile-{time.strftime("%Y%m%d-%H%M%S")}')
+    if kind == 'cprofile':
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(name + '.prof')
+            logger.info(f'Profile saved to {name}.prof')
+    elif kind == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(name + '.html', 'w') as f:
+                f.write(profiler.output_html())
+            logger.info(f'Profile saved to {name}.html')
+    else:
+        raise ValueError(f'Unknown profiler: {kind}')
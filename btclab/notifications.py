@@ -0,0 +1,223 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from typing import Optional
+
+import database
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = 'https://api.telegram.org/bot{}/sendMessage'
+MAX_MESSAGE_LENGTH = 4096
+CHAT_INTERVAL = 1.0         # Seconds between two messages to the same chat
+GLOBAL_INTERVAL = 1 / 30    # Seconds between two messages of the same bot
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 10            # Seconds, doubled after each failed attempt
+POLL_INTERVAL = 5           # Seconds between checks of the outbox when idle
+REQUEST_TIMEOUT = 10
+CLAIM_TTL = 300            # Seconds a worker keeps the messages it claimed before others can send them
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def merge_messages(ids: list[int], texts: list[str], max_length: int = MAX_MESSAGE_LENGTH) -> list[tuple]:
+    """
+    Joins consecutive messages into as few texts of at most max_length characters
+    as possible, and returns each text with the ids of the messages it completes.
+    Longer messages are split
+    """
+    merged = []
+    current, current_ids = '', []
+    for notification_id, text in zip(ids, texts):
+        parts = [text[i:i + max_length] for i in range(0, max(len(text), 1), max_length)]
+        for part in parts:
+            if current and len(current) + 2 + len(part) <= max_length:
+                current += '\n\n' + part
+            else:
+                if current:
+                    merged.append((current, current_ids))
+                current, current_ids = part, []
+        current_ids.append(notification_id)
+    if current:
+        merged.append((current, current_ids))
+    return merged
+
+
+class NotificationWorker(threading.Thread):
+    """
+    Sends the messages of the notification outbox in the background. Pending
+    messages for the same chat are merged into a single request, and requests are
+    spaced to respect the rate limits of Telegram. Failed messages are tried again
+    later with exponential backoff. Messages are claimed before being sent, so when
+    several workers share the outbox each message is sent by only one of them
+    """
+    def __init__(self):
+        super().__init__(name='notifications', daemon=True)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.session = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._next_send_by_chat = {}
+        self._next_send_by_bot = {}
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stops the worker once the messages that can be sent now are sent, waiting
+        at most timeout seconds. Messages left are sent by the next worker started
+        """
+        self._stopping.set()
+        self._wake.set()
+        self.join(timeout)
+        if self.is_alive():
+            logger.warning('Notification worker did not finish before the timeout')
+
+    def run(self):
+        while True:
+            try:
+                next_send = self.send_pending()
+            except Exception:
+                logger.exception('Error while sending notifications')
+                next_send = time.monotonic() + POLL_INTERVAL
+
+            if self._stopping.is_set() and next_send is None:
+                break
+            wait = POLL_INTERVAL if next_send is None else max(next_send - time.monotonic(), 0)
+            self._wake.wait(min(wait, POLL_INTERVAL))
+            self._wake.clear()
+        try:
+            database.release_notifications(self.owner)
+        except Exception:
+            logger.exception('Error while releasing notifications')
+        if self.session is not None:
+            self.session.close()
+
+    def send_pending(self) -> Optional[float]:
+        """
+        Sends the pending messages of the chats that are not rate limited. Returns
+        the monotonic time when the next chat can be sent to, or None if there are
+        no messages that can be sent now
+        """
+        chats = {}
+        now = time.time()
+        claimed = database.claim_pending_notifications(self.owner, now, now + CLAIM_TTL)
+        for notification_id, bot_token, chat_id, text, attempts, age in claimed:
+            chat = chats.setdefault((bot_token, chat_id), ([], [], [], []))
+            chat[0].append(notification_id)
+            chat[1].append(text)
+            chat[2].append(attempts)
+            chat[3].append(age)
+
+        next_send = None
+        for (bot_token, chat_id), (ids, texts, attempts, ages) in chats.items():
+            now = time.monotonic()
+            ready_at = max(self._next_send_by_chat.get((bot_token, chat_id), 0),
+                            self._next_send_by_bot.get(bot_token, 0))
+            if ready_at > now:
+                next_send = ready_at if next_send is None else min(next_send, ready_at)
+                continue
+            if self._send_chat(bot_token, chat_id, ids, texts, max(attempts)):
+                for age in ages:
+                    metrics.observe('notification_delay_seconds', age + time.monotonic() - now)
+            next_send = now if next_send is None else min(next_send, now)
+        return next_send
+
+    def _send_chat(self, bot_token: str, chat_id: str, ids: list[int], texts: list[str], attempts: int) -> bool:
+        pending = list(ids)
+        for text, sent_ids in merge_messages(ids, texts):
+            ready_at = max(self._next_send_by_chat.get((bot_token, chat_id), 0),
+                            self._next_send_by_bot.get(bot_token, 0))
+            time.sleep(max(ready_at - time.monotonic(), 0))
+            self._next_send_by_bot[bot_token] = time.monotonic() + GLOBAL_INTERVAL
+            self._next_send_by_chat[(bot_token, chat_id)] = time.monotonic() + CHAT_INTERVAL
+            retry_after = self._post(bot_token, chat_id, text)
+            if retry_after is not None:
+                if retry_after < 0:
+                    # The message cannot be delivered, so it is not tried again
+                    database.defer_notifications(pending, time.time(), 0)
+                else:
+                    delay = max(retry_after, RETRY_DELAY * 2 ** attempts)
+                    database.defer_notifications(pending, time.time() + delay, MAX_ATTEMPTS)
+                return False
+            if sent_ids:
+                database.delete_notifications(sent_ids)
+                pending = pending[len(sent_ids):]
+            logger.debug(f'Sent {len(sent_ids)} notification(s) to chat {chat_id}')
+        return True
+
+    def _post(self, bot_token: str, chat_id: str, text: str) -> Optional[float]:
+        """
+        Sends a message. Returns None if it was sent, the seconds to wait before trying
+        again, or -1 if the request was rejected and should not be tried again
+        """
+        import requests
+
+        if self.session is None:
+            self.session = requests.Session()
+        try:
+            with metrics.timer('notification_send_seconds'):
+                response = self.session.post(TELEGRAM_API_URL.format(bot_token),
+                                                data={'chat_id': chat_id, 'text': text},
+                                                timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as error:
+            logger.warning(f'Unable to send a notification to chat {chat_id}: {error}')
+            metrics.inc('notification_errors_total', status='network')
+            return 0
+
+        metrics.inc('notification_requests_total', status=response.status_code)
+
+        if response.status_code == 200:
+            return None
+
+        try:
+            description = response.json()
+        except ValueError:
+            description = {}
+        logger.warning(f'Telegram rejected a notification to chat {chat_id}: '
+                        f'{description.get("description", response.status_code)}')
+        if response.status_code == 429:
+            return description.get('parameters', {}).get('retry_after', RETRY_DELAY)
+        if response.status_code >= 500:
+            return 0
+        # For example, when using someone else's bot: "Bad Request: chat not found"
+        return -1
+
+
+def enqueue(bot_token: str, chat_id: str, text: str):
+    """
+    Saves a message in the outbox and wakes the worker up, without waiting for it
+    to be sent
+    """
+    database.enqueue_notification(bot_token, chat_id, text)
+    if _worker is not None:
+        _worker.wake()
+
+
+def start():
+    """
+    Starts the background worker that sends the messages of the outbox
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = NotificationWorker()
+            _worker.start()
+
+
+def stop(timeout: Optional[float] = 60):
+    """
+    Stops the background worker after sending the messages that can be sent now
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop(timeout)
+            _worker = None
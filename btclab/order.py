@@ -1,14 +1,14 @@
 from dataclasses import dataclass
 from datetime import datetime
 
-from common import Strategy
+from common import Strategy, to_ms
 
 
 
 @dataclass
 class Order():
     id: str                     # '12345-67890:09876/54321'
-    datetime_: datetime              # ISO8601 datetime string with milliseconds
+    timestamp: int              # 1502962946216, milliseconds since the epoch
     symbol: str                 # 'ETH/BTC', symbol
     order_type: str             # 'market', 'limit'
     side: str                   # 'buy', 'sell'
@@ -30,6 +30,7 @@ class Order():
         order = {
                 'id': int(right_now.timestamp()),
                 'datetime': right_now.isoformat(),
+                'timestamp': to_ms(right_now),
                 'symbol': symbol,
                 'type': order_type,
                 'side': side,
@@ -0,0 +1,75 @@
+import uuid
+import logging
+from datetime import datetime
+from typing import Iterable
+
+import database
+from common import Strategy, now_ms
+
+
+logger = logging.getLogger(__name__)
+
+FEE_RATE = 0.001                # Fraction of the amount bought charged as fee, in the base currency
+SLIPPAGE = 0.0005               # Fraction added to the price of market orders
+INITIAL_BALANCE = 10_000.0      # Paper balance of each quote currency of a new user
+
+
+def get_fill_price(price: float, order_type: str) -> float:
+    """
+    Returns the price at which an order is simulated to fill. Market orders pay the
+    slippage on top of the last price, limit orders fill at their price
+    """
+    if order_type == 'market':
+        return price * (1 + SLIPPAGE)
+    return price
+
+
+def fill_buy_order(user_id: int, symbol: str, price: float, order_cost: float, order_type: str,
+                    strategy: Strategy) -> dict:
+    """
+    Simulates a buy order of order_cost units of the quote currency at price, without
+    contacting the exchange, and updates the paper balances of the user. Returns a
+    dictionary like the ones of the orders placed in the exchange. Raises
+    InsufficientFunds if the paper balance of the quote currency is not enough
+    """
+    base_ccy, quote_ccy = symbol.split('/')
+    fill_price = get_fill_price(price, order_type)
+    amount = order_cost / fill_price
+    fee = amount * FEE_RATE
+
+    balance = database.apply_paper_fill(user_id, quote_ccy, order_cost, base_ccy, amount - fee, INITIAL_BALANCE)
+    if balance is None:
+        from ccxt.base.errors import InsufficientFunds
+        raise InsufficientFunds(f'Paper balance of {quote_ccy} is not enough to buy {order_cost:,.2f} {quote_ccy} '
+                                f'of {base_ccy}')
+    logger.debug(f'Paper order of user {user_id}: {amount:.8g} {base_ccy} @ {fill_price:,.6g}. '
+                    f'{quote_ccy} balance is {balance:,.2f}')
+
+    return {
+        'id': f'paper-{uuid.uuid4().hex}',
+        'datetime': datetime.utcnow().isoformat(),
+        'timestamp': now_ms(),
+        'symbol': symbol,
+        'type': order_type,
+        'side': 'buy',
+        'price': fill_price,
+        'amount': amount,
+        'cost': order_cost,
+        'fee': {'currency': base_ccy, 'cost': fee, 'rate': FEE_RATE},
+        'strategy': strategy.value,
+        'is_dummy': int(True),
+        'user_id': user_id,
+    }
+
+
+def get_balances_msg(user_id: int, quote_currencies: Iterable[str]) -> str:
+    """
+    Returns the paper balances of a user, including the initial balance of the quote
+    currencies not used yet
+    """
+    balances = dict.fromkeys(quote_currencies, INITIAL_BALANCE)
+    balances.update(database.get_paper_balances(user_id))
+    msg = '\nPaper balance:'
+    for currency, free in sorted(balances.items()):
+        msg += f'\n - {currency}: {free:,.8g}'
+    return msg
@@ -0,0 +1,172 @@
+import os
+import json
+import logging
+from typing import Iterable, Optional
+
+import click
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# In data/prices of the repository, wherever the tools are run from, unless set in BTCLAB_PRICES
+STORE_DIR = os.environ.get('BTCLAB_PRICES') or \
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'prices')
+INDEX_FILE = 'index.json'
+
+
+class PriceStore():
+    """
+    Daily close prices kept as one NumPy file per symbol plus a JSON index with the
+    first date and length of each series. Dates are implicit (one value per day from
+    the first date), so each symbol starts whenever its history starts and no dense
+    NaN padding is stored. Files are memory-mapped, so reading a date range only
+    touches that slice of the file
+    """
+    def __init__(self, path: str = STORE_DIR):
+        self.path = path
+        index_file = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    @property
+    def symbols(self) -> list[str]:
+        return list(self.index)
+
+    @staticmethod
+    def _file_name(symbol: str) -> str:
+        return symbol.replace('/', '-') + '.npy'
+
+    def _save_index(self):
+        tmp_file = os.path.join(self.path, INDEX_FILE + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, os.path.join(self.path, INDEX_FILE))
+
+    def load(self, symbol: str, start: Optional[str] = None, end: Optional[str] = None) -> tuple:
+        """
+        Returns the dates (datetime64[D]) and prices of a symbol between start and end,
+        both inclusive. Prices are a read-only view of the memory-mapped file
+        """
+        entry = self.index[symbol]
+        first = np.datetime64(entry['start'], 'D')
+        i = 0 if start is None else max(int((np.datetime64(start, 'D') - first).astype(int)), 0)
+        j = entry['length'] if end is None else min(int((np.datetime64(end, 'D') - first).astype(int)) + 1,
+                                                    entry['length'])
+        if j <= i:
+            return np.array([], dtype='datetime64[D]'), np.array([], dtype=float)
+
+        prices = np.load(os.path.join(self.path, entry['file']), mmap_mode='r')[i:j]
+        return first + np.arange(i, j), prices
+
+    def load_many(self, symbols: Optional[Iterable[str]] = None, start: Optional[str] = None,
+                    end: Optional[str] = None) -> dict[str, tuple]:
+        return {symbol: self.load(symbol, start, end) for symbol in symbols or self.symbols}
+
+    def write(self, symbol: str, dates: np.ndarray, prices: np.ndarray):
+        """
+        Merges daily prices of a symbol into the store. New values replace stored ones
+        on the same dates, and days without a price inside the series are kept as NaN
+        """
+        dates = np.asarray(dates).astype('datetime64[D]')
+        prices = np.asarray(prices, dtype=float)
+        valid = ~np.isnan(prices)
+        dates, prices = dates[valid], prices[valid]
+        if symbol in self.index:
+            old_dates, old_prices = self.load(symbol)
+            keep = ~np.isin(old_dates, dates) & ~np.isnan(old_prices)
+            dates = np.concatenate([old_dates[keep], dates])
+            prices = np.concatenate([old_prices[keep], prices])
+        if len(dates) == 0:
+            return
+
+        first = dates.min()
+        series = np.full(int((dates.max() - first).astype(int)) + 1, np.nan)
+        series[(dates - first).astype(int)] = prices
+
+        os.makedirs(self.path, exist_ok=True)
+        file_name = self._file_name(symbol)
+        tmp_file = os.path.join(self.path, file_name + '.tmp')
+        with open(tmp_file, 'wb') as f:
+            np.save(f, series)
+        os.replace(tmp_file, os.path.join(self.path, file_name))
+
+        self.index[symbol] = {'start': str(first), 'length': len(series), 'file': file_name}
+        self._save_index()
+
+
+def import_csv(csv_file: str, path: str = STORE_DIR) -> PriceStore:
+    """
+    Imports a CSV with a date index and a column of daily prices per symbol, like data/crypto.csv
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_file, index_col=0, parse_dates=True)
+    store = PriceStore(path)
+    for symbol in df.columns:
+        series = df[symbol].dropna()
+        store.write(symbol, series.index.values, series.to_numpy(dtype=float))
+        logger.info(f'Imported {len(series)} prices of {symbol}')
+    return store
+
+
+def import_candles(exchange_id: str, symbols: Iterable[str], path: str = STORE_DIR) -> PriceStore:
+    """
+    Imports the daily close prices kept in the candle store of the bot database
+    """
+    # Relative when installed as the btclab package, flat when run as a script
+    try:
+        from . import database
+    except ImportError:
+        import database
+
+    store = PriceStore(path)
+    for symbol in symbols:
+        rows = database.get_symbol_closes(exchange_id, symbol, '1d', 0, np.iinfo(np.int64).max)
+        timestamps = np.array([row[0] for row in rows], dtype='datetime64[ms]')
+        store.write(symbol, timestamps, np.array([row[1] for row in rows], dtype=float))
+        logger.info(f'Imported {len(rows)} prices of {symbol}')
+    return store
+
+
+@click.group()
+@click.option('--store', 'path', default=STORE_DIR, show_default=True, help="Directory of the price store")
+@click.pass_context
+def main(ctx, path):
+    """Manages the local store of daily prices used by backtests"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)-8s - %(message)s')
+    ctx.obj = path
+
+
+@main.command('import-csv')
+@click.argument('csv_file', type=click.Path(exists=True))
+@click.pass_obj
+def import_csv_command(path, csv_file):
+    """Imports a CSV with a column of daily prices per symbol"""
+    import_csv(csv_file, path)
+
+
+@main.command('import-candles')
+@click.option('-e', '--exchange', 'exchange_id', default='binance', show_default=True)
+@click.argument('symbols', nargs=-1, required=True)
+@click.pass_obj
+def import_candles_command(path, exchange_id, symbols):
+    """Imports daily closes from the candle store of the bot database"""
+    import_candles(exchange_id, symbols, path)
+
+
+@main.command('list')
+@click.pass_obj
+def list_command(path):
+    """Lists the symbols in the store with their date range"""
+    store = PriceStore(path)
+    for symbol, entry in sorted(store.index.items()):
+        end = np.datetime64(entry['start'], 'D') + entry['length'] - 1
+        click.echo(f'{symbol}: {entry["start"]} to {end} ({entry["length"]} days)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import time
+import random
+import inspect
+import logging
+import functools
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5             # Consecutive failures of an endpoint before giving up
+BASE_DELAY = 15             # Seconds, doubled after each consecutive failure
+MAX_DELAY = 900             # Seconds
+JITTER = 0.2                # Fraction of the delay added at random
+BREAKER_THRESHOLD = 10      # Consecutive failures of an exchange that open its circuit
+BREAKER_COOLDOWN = 300      # Seconds a circuit stays open before letting a call through
+
+
+class RetryLater(Exception):
+    """
+    Raised instead of waiting when a call to an exchange failed or is backing off.
+    retry_at is the POSIX timestamp after which the operation can be tried again
+    """
+    def __init__(self, endpoint: str, retry_at: float, reason: str):
+        super().__init__(f'{endpoint}: {reason}. Retrying in {max(retry_at - time.time(), 0):.0f} seconds')
+        self.endpoint = endpoint
+        self.retry_at = retry_at
+
+
+@dataclass
+class Backoff():
+    attempts: int = 0
+    next_attempt: float = 0
+
+
+@dataclass
+class CircuitBreaker():
+    """
+    Stops the calls to an exchange after too many consecutive failures. Once the
+    cooldown is over, a single call is let through: the circuit closes if it succeeds
+    and stays open for another cooldown otherwise
+    """
+    failures: int = 0
+    open_until: float = 0
+
+    def is_open(self, now: float) -> bool:
+        if self.open_until > now:
+            return True
+        if self.failures >= BREAKER_THRESHOLD:
+            # Half-open: let this call through, but not any other until it finishes
+            self.open_until = now + BREAKER_COOLDOWN
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0
+
+    def record_failure(self, now: float) -> bool:
+        """
+        Returns True if this failure opened the circuit
+        """
+        self.failures += 1
+        if self.failures == BREAKER_THRESHOLD:
+            self.open_until = now + BREAKER_COOLDOWN
+            return True
+        return False
+
+
+_lock = threading.Lock()
+_backoffs: dict[tuple, Backoff] = {}
+_breakers: dict[str, CircuitBreaker] = {}
+counters = Counter()
+
+
+def _get_delay(attempts: int) -> float:
+    delay = min(BASE_DELAY * 2 ** (attempts - 1), MAX_DELAY)
+    return delay * (1 + random.uniform(0, JITTER))
+
+
+def call(exchange, endpoint: str, function: Callable, /, *args, **kwargs):
+    """
+    Calls function, which makes requests to endpoint of exchange, without blocking
+    on network errors. Failures are counted per (exchange, credentials, endpoint),
+    and RetryLater is raised with the time of the next attempt, growing exponentially.
+    After MAX_RETRIES consecutive failures, the network error itself is raised and
+    the backoff starts over
+    """
+    from ccxt.base.errors import NetworkError
+
+    exchange_id = getattr(exchange, 'id', None)
+    key = (exchange_id, getattr(exchange, 'apiKey', None), endpoint)
+    now = time.time()
+    with _lock:
+        breaker = _breakers.setdefault(exchange_id, CircuitBreaker())
+        if breaker.is_open(now):
+            counters['short_circuited'] += 1
+            metrics.inc('retry_short_circuited_total', exchange=exchange_id, endpoint=endpoint)
+            raise RetryLater(endpoint, breaker.open_until, f'Circuit open for {exchange_id}')
+        backoff = _backoffs.get(key)
+        if backoff is not None and backoff.next_attempt > now:
+            counters['backing_off'] += 1
+            metrics.inc('retry_backing_off_total', exchange=exchange_id, endpoint=endpoint)
+            raise RetryLater(endpoint, backoff.next_attempt, 'Backing off after a network error')
+
+    try:
+        with metrics.timer('exchange_call_seconds', exchange=exchange_id, endpoint=endpoint):
+            result = function(*args, **kwargs)
+    except NetworkError as error:
+        now = time.time()
+        with _lock:
+            if breaker.record_failure(now):
+                counters['circuits_opened'] += 1
+                metrics.inc('retry_circuits_opened_total', exchange=exchange_id)
+                logger.warning(f'Too many network errors. Calls to {exchange_id} are stopped for '
+                                f'{BREAKER_COOLDOWN} seconds')
+            backoff = _backoffs.setdefault(key, Backoff())
+            backoff.attempts += 1
+            if backoff.attempts > MAX_RETRIES:
+                del _backoffs[key]
+                counters['exhausted'] += 1
+                metrics.inc('retry_exhausted_total', exchange=exchange_id, endpoint=endpoint)
+                raise
+            backoff.next_attempt = now + _get_delay(backoff.attempts)
+            counters['retries'] += 1
+            counters[f'retries.{endpoint}'] += 1
+            metrics.inc('retries_total', exchange=exchange_id, endpoint=endpoint)
+        logger.warning(f'Network error calling {endpoint} of {exchange_id} '
+                        f'(attempt {backoff.attempts} of {MAX_RETRIES}): {error}')
+        raise RetryLater(endpoint, backoff.next_attempt, type(error).__name__) from error
+
+    with _lock:
+        breaker.record_success()
+        _backoffs.pop(key, None)
+    return result
+
+
+def with_backoff(endpoint: str, exchange_argument: str = 'exchange'):
+    """
+    Decorates a function that makes requests to endpoint, so that it is called through
+    call. The exchange is the argument with the given name or, for methods, the
+    exchange attribute of self
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            if exchange_argument in arguments:
+                exchange = arguments[exchange_argument]
+            else:
+                exchange = arguments['self'].exchange
+            return call(exchange, endpoint, function, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_stats() -> dict:
+    """
+    Returns the retry counters and the number of endpoints backing off and of open circuits
+    """
+    now = time.time()
+    with _lock:
+        stats = dict(counters)
+        stats['backoffs'] = sum(1 for backoff in _backoffs.values() if backoff.next_attempt > now)
+        stats['open_circuits'] = sum(1 for breaker in _breakers.values() if breaker.open_until > now)
+    return stats
+
+
+def reset():
+    with _lock:
+        _backoffs.clear()
+        _breakers.clear()
+        counters.clear()
@@ -0,0 +1,163 @@
+import heapq
+import logging
+import threading
+from itertools import count
+from typing import Iterable, Optional
+
+import database
+from common import Strategy
+from users import Account
+
+
+logger = logging.getLogger(__name__)
+
+SECONDS_IN_A_DAY = 86400
+
+# Minutes to wait before checking a symbol again after insufficient funds
+DCA_INSUFFICIENT_FUNDS_WAIT = 90
+DIPS_INSUFFICIENT_FUNDS_WAIT = 60
+
+
+def to_timestamp(value: Optional[int]) -> Optional[float]:
+    """
+    Returns the POSIX timestamp of a date stored in the database in milliseconds
+    """
+    return None if value is None else value / 1000
+
+
+def _latest(*dates: Optional[int]) -> Optional[int]:
+    dates = [date for date in dates if date is not None]
+    return max(dates) if dates else None
+
+
+def _get_last_claims(accounts: list[Account]) -> dict[tuple, int]:
+    """
+    Returns the latest DCA order claims of the sharded accounts. An order claimed by
+    a worker that died before saving it may have been placed, so the next one is
+    not due until frequency days after the claim. Only real orders are claimed
+    """
+    user_ids = [account.user_id for account in accounts if account.shard is not None]
+    return database.get_latest_claim_dates(Strategy.DCA, user_ids) if user_ids else {}
+
+
+def _insufficient_funds_until(config: dict, minutes: int) -> Optional[float]:
+    if config.get('last_check_result') != 'Insufficient funds':
+        return None
+    last_check = to_timestamp(config.get('last_check_date'))
+    return None if last_check is None else last_check + minutes * 60
+
+
+def dca_due_time(config: dict, last_order_time: Optional[float], now: float) -> float:
+    """
+    Returns when a DCA symbol has to be checked next: frequency days after its last
+    order, but not before the insufficient-funds wait is over
+    """
+    due = now if last_order_time is None else last_order_time + config['frequency'] * SECONDS_IN_A_DAY
+    wait_until = _insufficient_funds_until(config, DCA_INSUFFICIENT_FUNDS_WAIT)
+    return max(due, wait_until) if wait_until else due
+
+
+def dip_due_time(config: dict, now: float) -> float:
+    """
+    Returns when a dip symbol has to be checked next. Dips depend on the current price,
+    so they are checked every cycle except during the insufficient-funds wait
+    """
+    wait_until = _insufficient_funds_until(config, DIPS_INSUFFICIENT_FUNDS_WAIT)
+    return max(now, wait_until) if wait_until else now
+
+
+class Scheduler():
+    """
+    Min-heap of the next time each (user, symbol, strategy) has to be checked, so a
+    cycle only visits the pairs that are due. Rescheduling a pair leaves its old entry
+    in the heap, which is discarded when it is popped
+    """
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._keys_by_user = {}
+        self._counter = count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, user_id: int, symbol: str, strategy: Strategy, due: float):
+        key = (user_id, symbol, strategy)
+        with self._lock:
+            self._due[key] = due
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            heapq.heappush(self._heap, (due, next(self._counter), key))
+
+    def remove_user(self, user_id: int):
+        with self._lock:
+            for key in self._keys_by_user.pop(user_id, ()):
+                self._due.pop(key, None)
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> dict[int, dict[Strategy, set[str]]]:
+        """
+        Removes and returns the pairs due at now, grouped by user and strategy
+        """
+        due = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_time, _, key = heapq.heappop(self._heap)
+                if self._due.get(key) != due_time:
+                    continue
+                del self._due[key]
+                user_id, symbol, strategy = key
+                self._keys_by_user[user_id].discard(key)
+                due.setdefault(user_id, {}).setdefault(strategy, set()).add(symbol)
+        return due
+
+    def schedule_accounts(self, accounts: Iterable[Account], dry_run: bool, now: float):
+        """
+        Schedules every configured symbol of the accounts, reading the date of their
+        last DCA orders, and of their last order claims when sharded, in bulk
+        """
+        accounts = list(accounts)
+        if not accounts:
+            return
+        last_orders = database.get_latest_order_dates(Strategy.DCA, [account.user_id for account in accounts])
+        last_claims = _get_last_claims(accounts)
+        for account in accounts:
+            for symbol, config in account.dca_config.items():
+                is_dummy = bool(config['is_dummy'] or dry_run)
+                last_claim = None if is_dummy else last_claims.get((account.user_id, symbol))
+                last_order = last_orders.get((account.user_id, symbol, is_dummy))
+                last_order_time = to_timestamp(_latest(last_order, last_claim))
+                self.schedule(account.user_id, symbol, Strategy.DCA, dca_due_time(config, last_order_time, now))
+            for symbol, config in account.dips_config.items():
+                self.schedule(account.user_id, symbol, Strategy.BUY_THE_DIPS, dip_due_time(config, now))
+
+    def reschedule(self, account: Account, visited: dict[Strategy, set[str]], dry_run: bool, now: float):
+        """
+        Schedules again the pairs of an account visited in a cycle, from their state
+        after the visit. Pairs due from now are checked again in the next cycle, and
+        pairs deferred after a failed request once their retry time has come
+        """
+        last_claims = _get_last_claims([account]) if visited.get(Strategy.DCA) else {}
+        for symbol in visited.get(Strategy.DCA, ()):
+            config = account.dca_config.get(symbol)
+            if config is None:
+                continue
+            is_dummy = bool(config['is_dummy'] or dry_run)
+            last_order = database.get_latest_order(account.user_id, symbol, is_dummy, Strategy.DCA)
+            last_claim = None if is_dummy else last_claims.get((account.user_id, symbol))
+            last_order_time = to_timestamp(_latest(last_order.timestamp if last_order else None, last_claim))
+            due = dca_due_time(config, last_order_time, now)
+            self.schedule(account.user_id, symbol, Strategy.DCA, 
+                            max(due, account.deferred.get((Strategy.DCA, symbol), due)))
+
+        for symbol in visited.get(Strategy.BUY_THE_DIPS, ()):
+            config = account.dips_config.get(symbol)
+            if config is not None:
+                due = dip_due_time(config, now)
+                self.schedule(account.user_id, symbol, Strategy.BUY_THE_DIPS, 
+                                max(due, account.deferred.get((Strategy.BUY_THE_DIPS, symbol), due)))
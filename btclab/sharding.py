@@ -0,0 +1,165 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import database
+from common import MS_IN_A_DAY, MS_IN_AN_HOUR, Strategy
+from retries import RetryLater
+
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL = 60                          # Seconds a lease lasts if it is not renewed
+DIP_CLAIM_INTERVAL = MS_IN_AN_HOUR      # Minimum time between two dip orders of a user and symbol
+PRUNE_INTERVAL = 3600                   # Seconds between deletions of the order claims that expired
+
+
+def parse_shard(value: str) -> tuple[Optional[int], int]:
+    """
+    Parses a shard given as i/N (the users with user_id % N == i) or auto/N (the
+    shards whose leases are acquired from the database). Returns (i, N), with None
+    as i for auto
+    """
+    index, _, shards = value.partition('/')
+    try:
+        shards = int(shards)
+        index = None if index == 'auto' else int(index)
+    except ValueError:
+        raise ValueError(f'Invalid shard {value}. Expected i/N or auto/N') from None
+    if shards < 1 or (index is not None and not 0 <= index < shards):
+        raise ValueError(f'Invalid shard {value}. i has to be between 0 and N - 1')
+    return index, shards
+
+
+def get_claim_interval(strategy: Strategy, config: dict) -> int:
+    """
+    Returns the milliseconds that have to pass after an order of a config is claimed
+    before the next one can be claimed. DCA orders are at least frequency days apart
+    """
+    if strategy == Strategy.DCA:
+        return config['frequency'] * MS_IN_A_DAY
+    return DIP_CLAIM_INTERVAL
+
+
+def may_have_placed_order(error: Exception) -> bool:
+    """
+    Returns True if an error raised while placing an order does not prove the order
+    was not placed, as a timeout after the request was sent
+    """
+    from ccxt.base.errors import NetworkError
+
+    if isinstance(error, RetryLater):
+        return error.__cause__ is not None
+    return isinstance(error, NetworkError)
+
+
+class Shard():
+    """
+    The part of the users processed by a worker: a fixed shard i of N, or the shards
+    whose leases the worker holds in the database, renewed in the background. Before
+    an order is placed, it is claimed in the database for its user, symbol and
+    strategy, fenced by the lease of its shard. A claim is refused until the interval
+    between two orders has passed since the previous one, so an order is never placed
+    twice even if the worker that claimed it lost its lease or died before saving it
+    """
+    def __init__(self, shards: int, index: Optional[int] = None, lease_ttl: float = LEASE_TTL):
+        self.shards = shards
+        self.index = index
+        self.lease_ttl = lease_ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.fences: dict[int, Optional[int]] = {} if index is None else {index: None}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+        self._next_prune = 0.0
+
+    def __str__(self) -> str:
+        return f'{"auto" if self.index is None else self.index}/{self.shards}'
+
+    @property
+    def uses_leases(self) -> bool:
+        return self.index is None
+
+    def acquire(self):
+        """
+        Renews the leases held and takes or frees shards to share them evenly with
+        the other workers alive, which is not needed for a fixed shard. Expired order
+        claims are deleted every PRUNE_INTERVAL seconds
+        """
+        if time.monotonic() >= self._next_prune:
+            deleted = database.prune_order_claims(DIP_CLAIM_INTERVAL)
+            logger.debug(f'Expired order claims deleted: {deleted}')
+            self._next_prune = time.monotonic() + PRUNE_INTERVAL
+        if not self.uses_leases:
+            return
+        fences = database.acquire_shard_leases(self.owner, self.shards, round(self.lease_ttl * 1000))
+        with self._lock:
+            if set(fences) != set(self.fences):
+                logger.info(f'Shards of {self.shards} owned: {sorted(fences) or "none"}')
+            self.fences = fences
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew, name='shard-leases', daemon=True)
+            self._heartbeat.start()
+
+    def _renew(self):
+        while not self._stop.wait(self.lease_ttl / 3):
+            try:
+                fences = database.renew_shard_leases(self.owner, self.shards, round(self.lease_ttl * 1000))
+            except Exception:
+                logger.exception('Error while renewing shard leases')
+                continue
+            with self._lock:
+                lost = set(self.fences).difference(fences)
+                if lost:
+                    logger.warning(f'Leases of shards {sorted(lost)} lost')
+                self.fences = {shard: fence for shard, fence in self.fences.items() if shard in fences}
+
+    def release(self):
+        """
+        Stops renewing the leases and frees them, so other workers can take them
+        """
+        if not self.uses_leases:
+            return
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        database.release_shard_leases(self.owner)
+        with self._lock:
+            self.fences = {}
+
+    def owns(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id % self.shards in self.fences
+
+    @contextmanager
+    def claim(self, user_id: int, symbol: str, strategy: Strategy, config: dict):
+        """
+        Yields True if the order of a config can be placed now. The claim is released
+        if placing the order fails in a way that proves it was not placed
+        """
+        shard = user_id % self.shards
+        with self._lock:
+            owned = shard in self.fences
+            fence = self.fences.get(shard)
+        claimed_on = None
+        if owned:
+            claimed_on = database.claim_order(user_id, symbol, strategy, get_claim_interval(strategy, config),
+                                                self.owner, self.shards, shard, fence)
+        if claimed_on is None:
+            logger.warning(f'Order of {symbol} for user {user_id} not placed: an order was claimed too recently '
+                            f'or the lease of shard {shard} was lost')
+            yield False
+            return
+
+        try:
+            yield True
+        except Exception as error:
+            if not may_have_placed_order(error):
+                database.release_order_claim(user_id, symbol, strategy, claimed_on, self.owner)
+            raise
@@ -0,0 +1,135 @@
+import math
+import time
+import logging
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import data
+import crypto
+import database
+from retries import RetryLater
+
+
+logger = logging.getLogger(__name__)
+
+STATS_TTL = 24 # Hours after which the stats of a symbol are calculated again
+
+
+@dataclass
+class RunningMoments():
+    """
+    Count, mean and sum of squared differences from the mean (M2) of a series,
+    updated one value at a time with Welford's algorithm
+    """
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    last_timestamp: Optional[int] = None
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value: float):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.count -= 1
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    @property
+    def std_dev(self) -> float:
+        """
+        Sample standard deviation, the same pandas returns by default
+        """
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+
+def _returns(rows: list[tuple], period: int) -> list[tuple[int, float]]:
+    """
+    Returns (timestamp, return) pairs from (timestamp, close) rows sorted by timestamp.
+    Only consecutive candles produce a return, as pct_change does over a daily index
+    """
+    return [(ts, close / prev_close - 1)
+            for (prev_ts, prev_close), (ts, close) in zip(rows, rows[1:])
+            if ts - prev_ts == period and prev_close]
+
+
+def update_moments(exchange, symbol: str, timeframe: str = data.TIMEFRAME,
+                    window: int = data.HISTORY_LIMIT) -> RunningMoments:
+    """
+    Updates the moments of the returns of a symbol over the last window periods with
+    the candles closed since the last update, and removes the returns that fell out
+    of the window. The moments are recalculated from scratch only the first time or
+    when the stored ones do not overlap the current window
+    """
+    period = exchange.parse_timeframe(timeframe) * 1000
+    closed_until = int(time.time() * 1000) - period
+    row = database.get_symbol_moments(exchange.id, symbol, timeframe, window)
+    moments = RunningMoments(*row) if row else RunningMoments()
+
+    last = moments.last_timestamp
+    if last is not None and last > closed_until - window * period:
+        new_rows = database.get_symbol_closes(exchange.id, symbol, timeframe, last, closed_until)
+    else:
+        last = None
+        moments = RunningMoments()
+        new_rows = database.get_symbol_closes(exchange.id, symbol, timeframe,
+                                                closed_until - (window + 1) * period, closed_until)
+
+    if not new_rows or new_rows[-1][0] == last:
+        return moments
+
+    new_last = new_rows[-1][0]
+    window_start = new_last - (window - 1) * period
+    for ts, ret in _returns(new_rows, period):
+        if ts >= window_start:
+            moments.add(ret)
+
+    if last is not None and moments.count > 0:
+        old_window_start = last - (window - 1) * period
+        if old_window_start < window_start:
+            old_rows = database.get_symbol_closes(exchange.id, symbol, timeframe,
+                                                    old_window_start - period, window_start - period)
+            for ts, ret in _returns(old_rows, period):
+                if old_window_start <= ts < window_start:
+                    moments.remove(ret)
+
+    moments.last_timestamp = new_last
+    database.save_symbol_moments(exchange.id, symbol, timeframe, window, moments.count, moments.mean,
+                                    moments.m2, moments.last_timestamp)
+    return moments
+
+
+def refresh_symbols_stats(exchange, symbols: Iterable[str], ttl: float = STATS_TTL) -> dict:
+    """
+    Updates the stats of the symbols that have none or whose stats are older than
+    ttl hours and returns the stats of all symbols. Symbols not listed in the exchange
+    are skipped, as requesting their candles would fail
+    """
+    stale_symbols = database.get_stale_symbols(symbols, ttl)
+    if stale_symbols:
+        try:
+            unlisted = crypto.get_non_supported_symbols(exchange, stale_symbols)
+            if unlisted:
+                logger.warning(f'Symbols not listed in {exchange.id}: {", ".join(sorted(unlisted))}')
+                stale_symbols = set(stale_symbols).difference(unlisted)
+            logger.info(f'Updating stats for symbols {", ".join(sorted(stale_symbols))}')
+            data.update_candles(exchange, sorted(stale_symbols))
+        except RetryLater as error:
+            logger.warning(f'Unable to update candles, using the stats stored. {error}')
+            return database.get_symbols_stats()
+        std_devs = {}
+        for symbol in stale_symbols:
+            moments = update_moments(exchange, symbol)
+            if math.isnan(moments.std_dev):
+                logger.warning(f'Not enough price history to calculate the stats of {symbol}')
+                continue
+            std_devs[symbol] = moments.std_dev
+        database.load_symbol_stats(std_devs)
+
+    return database.get_symbols_stats()
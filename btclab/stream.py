@@ -0,0 +1,192 @@
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import AsyncIterator, Iterable, Optional
+
+import database
+import dips
+from retries import RetryLater
+from users import Account
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which balances and volatility stats are read again while streaming
+STATE_TTL = 3600
+
+
+async def watch_tickers(exchange_id: str, symbols: Iterable[str]) -> AsyncIterator[dict]:
+    """
+    Yields the tickers of the symbols pushed by the websocket API of an exchange,
+    through ccxt.pro
+    """
+    import ccxt.pro
+
+    symbols = sorted(symbols)
+    client = getattr(ccxt.pro, exchange_id)({'enableRateLimit': True})
+    try:
+        if client.has.get('watchTickers'):
+            while True:
+                for ticker in (await client.watch_tickers(symbols)).values():
+                    yield ticker
+        else:
+            queue = asyncio.Queue()
+            async def watch(symbol):
+                while True:
+                    await queue.put(await client.watch_ticker(symbol))
+            tasks = [asyncio.create_task(watch(symbol)) for symbol in symbols]
+            try:
+                while True:
+                    yield await queue.get()
+            finally:
+                for task in tasks:
+                    task.cancel()
+    finally:
+        await client.close()
+
+
+async def replay(path: str, speed: float = 0) -> AsyncIterator[dict]:
+    """
+    Yields the tickers recorded in a file with one JSON ticker per line. With a
+    speed above zero, the time between tickers is kept, divided by speed. Otherwise
+    tickers are yielded as fast as they are consumed
+    """
+    previous = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            ticker = json.loads(line)
+            timestamp = ticker.get('timestamp')
+            if speed > 0 and previous is not None and timestamp is not None:
+                await asyncio.sleep(max(timestamp - previous, 0) / 1000 / speed)
+            previous = timestamp
+            yield ticker
+            await asyncio.sleep(0)
+
+
+async def synthetic(prices: dict[str, float], events: int, volatility: float = 0.01,
+                    interval: float = 1, seed: Optional[int] = None) -> AsyncIterator[dict]:
+    """
+    Yields events tickers following a random walk of the price of each symbol, one
+    every interval seconds of simulated time, starting at the given prices
+    """
+    rng = random.Random(seed)
+    opens = dict(prices)
+    last = dict(prices)
+    timestamp = int(time.time() * 1000)
+    symbols = list(prices)
+    for _ in range(events):
+        symbol = rng.choice(symbols)
+        last[symbol] *= 1 + rng.gauss(0, volatility)
+        timestamp += int(interval * 1000)
+        yield {
+            'symbol': symbol,
+            'timestamp': timestamp,
+            'last': last[symbol],
+            'open': opens[symbol],
+            'percentage': (last[symbol] / opens[symbol] - 1) * 100,
+        }
+        await asyncio.sleep(0)
+
+
+async def record(feed: AsyncIterator[dict], path: str) -> AsyncIterator[dict]:
+    """
+    Yields the tickers of a feed while appending them to a file that can be replayed
+    """
+    with open(path, 'a') as f:
+        async for ticker in feed:
+            f.write(json.dumps({key: ticker.get(key) for key in ('symbol', 'timestamp', 'last', 'open', 'percentage')}) + '\n')
+            yield ticker
+
+
+class DipStream():
+    """
+    Checks the dip buying rules of every account subscribed to a symbol as soon as
+    a ticker of that symbol arrives, so a drop is bought even if it recovers before
+    the next polling cycle. Tickers that do not reach the minimum drop of any account
+    are discarded without touching the database or the exchange
+    """
+    def __init__(self, accounts: Iterable[Account], symbols_stats: dict, dry_run: bool):
+        self.symbols_stats = symbols_stats
+        self.dry_run = dry_run
+        self.subscriptions: dict[str, list[Account]] = {}
+        for account in accounts:
+            for symbol in account.dips_config:
+                self.subscriptions.setdefault(symbol, []).append(account)
+        self.deferred: dict[tuple[int, str], float] = {}
+        self.events = 0
+        self.orders = 0
+
+    @property
+    def symbols(self) -> set[str]:
+        return set(self.subscriptions)
+
+    def start_period(self, symbols_stats: Optional[dict] = None):
+        if symbols_stats is not None:
+            self.symbols_stats = symbols_stats
+        for accounts in self.subscriptions.values():
+            for account in accounts:
+                account.start_cycle()
+
+    def _is_candidate(self, account: Account, symbol: str, ticker: dict) -> bool:
+        if self.deferred.get((account.user_id, symbol), 0) > time.time():
+            return False
+        try:
+            min_drop = dips.get_min_drop(symbol, account.dips_config[symbol], self.symbols_stats)
+        except KeyError:
+            return False
+        return ticker.get('percentage') is not None and ticker['percentage'] < min_drop
+
+    def on_ticker(self, ticker: dict) -> list[dict]:
+        """
+        Evaluates a ticker for every account subscribed to its symbol and places the
+        orders of the dips found. Returns the orders placed
+        """
+        self.events += 1
+        symbol = ticker.get('symbol')
+        orders = []
+        with database.unit_of_work():
+            for account in self.subscriptions.get(symbol, ()):
+                if not self._is_candidate(account, symbol, ticker):
+                    continue
+                try:
+                    order = dips.buy_drop(account, symbol, account.dips_config[symbol], self.symbols_stats,
+                                            self.dry_run, ticker=ticker)
+                except RetryLater as error:
+                    logger.warning(f'Unable to buy the dip of {symbol} for user {account.user_id}. {error}')
+                    self.deferred[(account.user_id, symbol)] = error.retry_at
+                    continue
+                except Exception:
+                    logger.exception(f'Error while buying the dip of {symbol} for user {account.user_id}')
+                    continue
+                if order is not None:
+                    orders.append(order)
+        self.orders += len(orders)
+        return orders
+
+    async def run(self, feed: AsyncIterator[dict], refresh_stats=None):
+        """
+        Consumes a ticker feed until it ends. Orders are placed in a worker thread, so
+        the event loop keeps receiving tickers. refresh_stats, if given, returns the
+        volatility stats every STATE_TTL seconds, when balances are also fetched again
+        """
+        start = time.perf_counter()
+        period_start = time.monotonic()
+        self.start_period()
+        async for ticker in feed:
+            if time.monotonic() - period_start > STATE_TTL:
+                symbols_stats = await asyncio.to_thread(refresh_stats) if refresh_stats else None
+                self.start_period(symbols_stats)
+                period_start = time.monotonic()
+            if any(self._is_candidate(account, ticker.get('symbol'), ticker)
+                    for account in self.subscriptions.get(ticker.get('symbol'), ())):
+                await asyncio.to_thread(self.on_ticker, ticker)
+            else:
+                self.events += 1
+
+        elapsed = time.perf_counter() - start
+        logger.info(f'Ticker feed ended after {self.events} event(s) in {elapsed:.2f} seconds. '
+                    f'Orders placed: {self.orders}')
@@ -0,0 +1,199 @@
+import os
+import time
+import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from multiprocessing import shared_memory
+from typing import Iterable, Optional
+
+import click
+import numpy as np
+import pandas as pd
+
+# Relative when installed as the btclab package, flat when run as a script
+try:
+    from . import backtest
+    from .pricestore import PriceStore, STORE_DIR
+except ImportError:
+    import backtest
+    from pricestore import PriceStore, STORE_DIR
+
+
+logger = logging.getLogger(__name__)
+
+# Price arrays of each symbol, set in every worker process by _attach_prices
+_prices = {}
+_thresholds = {}
+_shm = None
+
+PARAM_COLUMNS = ['symbol', 'weekday', 'day', 'usdt', 'strategy', 'variation', 'lower', 'upper']
+
+
+def weekly(weekdays: Iterable[int] = range(7)) -> list[dict]:
+    return [{'weekday': weekday} for weekday in weekdays]
+
+
+def monthly(days: Iterable[int] = range(1, 32)) -> list[dict]:
+    return [{'day': day} for day in days]
+
+
+def sizing(strategies: Iterable[str], variations: Iterable[float]) -> list[dict]:
+    """
+    Returns the sizing rules to backtest. Only outlier_scaled depends on the variation
+    factor, so the other strategies get a single run each
+    """
+    variations = list(variations)
+    return [{'strategy': strategy, 'variation': variation}
+            for strategy in strategies
+            for variation in (variations if strategy == 'outlier_scaled' else [None])]
+
+
+def expand_grid(grid: dict) -> list[dict]:
+    """
+    Returns every combination of the values in grid. The values of the schedule and
+    sizing keys are dictionaries (see weekly, monthly and sizing) that are merged into
+    each combination
+    """
+    keys = list(grid)
+    runs = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        params = dict(zip(keys, values))
+        for key in ('schedule', 'sizing'):
+            params.update(params.pop(key, None) or {})
+        runs.append(params)
+    return runs
+
+
+def _share_prices(prices: dict[str, tuple]) -> tuple[shared_memory.SharedMemory, dict]:
+    """
+    Copies the dates and prices of every symbol into a single shared memory block and
+    returns it with the offset and length of each symbol
+    """
+    layout, offset = {}, 0
+    for symbol, (dates, values) in prices.items():
+        layout[symbol] = (offset, len(values))
+        offset += len(values)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1) * 16)
+    dates_block = np.ndarray((offset, ), dtype='datetime64[D]', buffer=shm.buf)
+    values_block = np.ndarray((offset, ), dtype=float, buffer=shm.buf, offset=offset * 8)
+    for symbol, (dates, values) in prices.items():
+        start, length = layout[symbol]
+        dates_block[start:start + length] = dates.astype('datetime64[D]')
+        values_block[start:start + length] = values
+    return shm, layout
+
+
+def _attach_prices(name: str, layout: dict, thresholds: dict):
+    """
+    Initializer of the worker processes. Maps the shared price block into read-only
+    arrays, so prices are not pickled for every task
+    """
+    global _shm
+    _shm = shared_memory.SharedMemory(name=name)
+    size = sum(length for _, length in layout.values())
+    dates_block = np.ndarray((size, ), dtype='datetime64[D]', buffer=_shm.buf)
+    values_block = np.ndarray((size, ), dtype=float, buffer=_shm.buf, offset=size * 8)
+    dates_block.flags.writeable = False
+    values_block.flags.writeable = False
+    for symbol, (start, length) in layout.items():
+        _prices[symbol] = (dates_block[start:start + length], values_block[start:start + length])
+    _thresholds.update(thresholds)
+
+
+def _run(params: dict) -> dict:
+    params = dict(params)
+    symbol = params['symbol']
+    dates, prices = _prices[symbol]
+    thresholds = _thresholds[symbol]
+    overrides = {key: params[key] for key in ('lower', 'upper') if params.get(key) is not None}
+    if overrides:
+        thresholds = replace(thresholds, **overrides)
+    extra = {'variation': params['variation']} if params.get('variation') is not None else {}
+
+    result = backtest.run(dates, prices, params.get('usdt', 50), params.get('strategy', 'fixed'),
+                            weekday=params.get('weekday'), day=params.get('day'), thresholds=thresholds,
+                            **extra)
+    summary = result.summary()
+    summary.pop('strategy')
+    return {**params, **summary}
+
+
+def _run_chunk(chunk: list[dict]) -> list[dict]:
+    return [_run(params) for params in chunk]
+
+
+def run_sweep(prices: dict[str, tuple], grid: dict, processes: Optional[int] = None,
+                chunksize: int = 256) -> pd.DataFrame:
+    """
+    Backtests every combination of grid (see expand_grid) over the (dates, prices) of
+    each symbol and returns one row per run. Runs are spread across a pool of processes
+    that read the prices from shared memory
+    """
+    if 'symbol' not in grid:
+        grid = {**grid, 'symbol': list(prices)}
+    runs = expand_grid(grid)
+    prices = {symbol: tuple(np.asarray(a) for a in prices[symbol]) for symbol in set(grid['symbol'])}
+    thresholds = {symbol: backtest.Thresholds.from_returns(backtest.pct_change(values[~np.isnan(values)]))
+                    for symbol, (_, values) in prices.items()}
+    chunks = [runs[i:i + chunksize] for i in range(0, len(runs), chunksize)]
+    processes = processes or os.cpu_count()
+    logger.info(f'Running {len(runs)} backtests in {len(chunks)} chunk(s) with {processes} process(es)')
+
+    start = time.perf_counter()
+    shm, layout = _share_prices(prices)
+    try:
+        if processes == 1:
+            _attach_prices(shm.name, layout, thresholds)
+            results = [_run_chunk(chunk) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_attach_prices,
+                                        initargs=(shm.name, layout, thresholds)) as executor:
+                results = list(executor.map(_run_chunk, chunks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    logger.info(f'{len(runs)} backtests completed in {time.perf_counter() - start:.2f} seconds')
+    df = pd.DataFrame([row for chunk in results for row in chunk])
+    for column in ('weekday', 'day'):
+        if column in df.columns:
+            df[column] = df[column].astype('Int64')
+    params = [column for column in PARAM_COLUMNS if column in df.columns]
+    return df[params + [column for column in df.columns if column not in params]]
+
+
+@click.command()
+@click.option('--prices', 'path', default=STORE_DIR, show_default=True, type=click.Path(exists=True),
+                help="Price store directory, or CSV with daily prices and one column per symbol")
+@click.option('-s', '--symbol', 'symbols', multiple=True, help="Symbol to backtest. Can be repeated (all by default)")
+@click.option('--usdt', multiple=True, type=float, help="Base amount invested in each purchase. Can be repeated")
+@click.option('--strategy', 'strategies', multiple=True, type=click.Choice(list(backtest.STRATEGIES)),
+                help="Sizing rule to backtest. Can be repeated (all by default)")
+@click.option('--variations', default=10, show_default=True,
+                help="Number of variation factors between 0 and 1 to backtest outlier_scaled with")
+@click.option('-p', '--processes', type=int, help="Number of worker processes (one per CPU by default)")
+@click.option('-o', '--output', type=click.Path(), help="CSV file to save the results to")
+def main(path, symbols, usdt, strategies, variations, processes, output):
+    """Backtests DCA sizing rules for every weekday and day of month"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)-8s - %(message)s')
+    if not symbols:
+        symbols = PriceStore(path).symbols if os.path.isdir(path) else pd.read_csv(path, index_col=0, nrows=0).columns
+    prices = {symbol: backtest.load_prices(path, symbol) for symbol in symbols}
+
+    grid = {
+        'symbol': list(prices),
+        'schedule': weekly() + monthly(),
+        'usdt': list(usdt) or [50.0],
+        'sizing': sizing(strategies or backtest.STRATEGIES, np.linspace(0, 1, variations)),
+    }
+    results = run_sweep(prices, grid, processes)
+    if output:
+        results.to_csv(output, index=False)
+    else:
+        click.echo(results.sort_values('cagr', ascending=False).head(20).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,17 @@
-import ccxt
 import logging
 import random
+from contextlib import nullcontext
 from dataclasses import dataclass, InitVar
 from datetime import datetime, timedelta
 from typing import Optional
-from retry import retry
-from ccxt import NetworkError, AuthenticationError
 import database
 
 from telegram import TelegramBot
-import dca
-from common import Strategy
+from common import MS_IN_AN_HOUR, Strategy, now_ms
+from market import MarketSnapshot
+from balances import BalanceSnapshot
+import exchanges
+import retries
 
 logger = logging.getLogger(__name__)
 
@@ -20,8 +21,8 @@ class Account():
     first_name: str
     last_name: str
     email: str
-    created_on: datetime
-    last_contact: datetime
+    created_on: int                 # Milliseconds since the epoch
+    last_contact: Optional[int]
     exchange_id: str
     api_key: InitVar[str]
     api_secret: InitVar[str]
@@ -32,13 +33,41 @@ class Account():
     notify_to_email: bool
 
     def __post_init__(self, api_key, api_secret):
-        self.exchange = ccxt.binance( # TODO Change to dynamically create instance of exchange from its id
-            {
-                'apiKey': api_key, 
-                'secret': api_secret, 
-                'enableRateLimit': True 
-            }
-        )
+        self._credentials = (api_key, api_secret)
+        self._exchange = None
+        self.shard = None
+        self.start_cycle()
+
+    @property
+    def exchange(self):
+        """
+        Client of the exchange of the account, created the first time it is used, so
+        the exchange library is not loaded for accounts with nothing to check
+        """
+        if self._exchange is None:
+            self._exchange = exchanges.get_client(self.exchange_id, *self._credentials)
+        return self._exchange
+
+    @property
+    def balances(self) -> BalanceSnapshot:
+        if self._balances is None:
+            self._balances = BalanceSnapshot(self.exchange)
+        return self._balances
+
+    def start_cycle(self):
+        """
+        Starts a new balance snapshot, fetched the first time it is used in a cycle,
+        and forgets the symbols deferred in the previous cycle
+        """
+        self._balances = None
+        self.deferred = {}
+
+    def defer(self, symbol: str, strategy: Strategy, retry_at: float):
+        """
+        Postpones checking a symbol for a strategy until retry_at, after a request
+        to the exchange failed
+        """
+        self.deferred[(strategy, symbol)] = retry_at
 
     def time_since_last_order(self, symbol: str, strategy: Strategy, is_dummy: bool) -> Optional[timedelta]:
         """
@@ -50,11 +79,40 @@ class Account():
         if last_order is None:
             return None
         
-        diff = datetime.utcnow() - last_order.datetime_.replace(tzinfo=None)
-        assert diff.total_seconds() >= 0, \
-                f'Last order for {symbol} (id {last_order.id}) has a date in the future {last_order.datetime_}'
+        diff = now_ms() - last_order.timestamp
+        assert diff >= 0, \
+                f'Last order for {symbol} (id {last_order.id}) has a date in the future {last_order.timestamp}'
         
-        return diff
+        return timedelta(milliseconds=diff)
+
+    def _get_config(self, strategy: Strategy) -> dict:
+        return self.dca_config if strategy == Strategy.DCA else self.dips_config
+
+    def claim_order(self, symbol: str, strategy: Strategy, is_dummy: bool):
+        """
+        Returns a context that yields True if an order of symbol can be placed for a
+        strategy. When users are sharded, real orders are claimed first, so no other
+        worker places them in the same window. Dummy orders are not claimed, so they
+        never hold back a real one
+        """
+        if self.shard is None or is_dummy:
+            return nullcontext(True)
+        return self.shard.claim(self.user_id, symbol, strategy, self._get_config(strategy)[symbol])
+
+    def record_check(self, symbol: str, strategy: Strategy, result: str):
+        """
+        Saves the result of checking a symbol for a strategy, both in the database
+        and in the config kept in memory, which outlives a cycle in daemon mode
+        """
+        database.update_last_check(self.user_id, symbol, strategy, result)
+        config = self._get_config(strategy).get(symbol)
+        if config is not None:
+            config['last_check_date'] = now_ms()
+            config['last_check_result'] = result
+
+    def record_contact(self):
+        database.update_last_contact(self.user_id)
+        self.last_contact = now_ms()
 
     def _greet(self) -> str:
         hour = datetime.now().hour
@@ -74,18 +132,26 @@ class Account():
         if self.last_contact is None:
             return False
         
-        duration = datetime.utcnow() - self.last_contact
-        duration_in_hours = divmod(duration.total_seconds(), 3600)[0]
-        return duration_in_hours < hours
+        return now_ms() - self.last_contact < hours * MS_IN_AN_HOUR
+
+    def is_paper_only(self) -> bool:
+        """
+        Returns True if every config of the account is dummy, so its orders are only
+        simulated and its balance in the exchange is never used
+        """
+        configs = list(self.dca_config.values()) + list(self.dips_config.values())
+        return all(config['is_dummy'] for config in configs)
 
     def get_symbols(self) -> set[str]:
         d1 = set(self.dca_config.keys())
         d2 = set(self.dips_config.keys())
         return d1.union(d2)
 
-    @retry(NetworkError, delay=15, jitter=5, logger=logger)
-    def get_base_currency_balances(self) -> Optional[str]:
-        if not self.exchange.has['fetchTickers']:
+    @retries.with_backoff('fetch_tickers')
+    def get_base_currency_balances(self, market: Optional[MarketSnapshot] = None) -> Optional[str]:
+        from ccxt.base.errors import AuthenticationError
+
+        if market is None and not self.exchange.has['fetchTickers']:
             logger.warning(f'{self.exchange.name} exchange does not support fetchTickers method')
             return None
         
@@ -93,7 +159,7 @@ class Account():
         msg = '\nCurrent prices for your symbols are:\n'
         
         try:
-            tickers = self.exchange.fetch_tickers(symbols)
+            tickers = market.get_tickers(symbols) if market else self.exchange.fetch_tickers(symbols)
         except AuthenticationError:
             logger.error('Authentication error')
             return None
@@ -102,14 +168,15 @@ class Account():
             msg += f' - {item["symbol"]}: {item["last"]:,.8g} ({item["percentage"]:.1f}%)\n'
         return msg
 
-    @retry(NetworkError, delay=15, jitter=5, logger=logger)
     def get_quote_currency_balances(self) -> str:
+        from ccxt.base.errors import AuthenticationError
+
         all_symbols = self.get_symbols()
         quote_currencies = set([symbol.split('/')[1] for symbol in all_symbols])
         msg = f'\nAvailable balance:'
         for quote_ccy in quote_currencies:
             try:
-                balance = self.exchange.fetch_balance()[quote_ccy]['free']
+                balance = self.balances.get_free(quote_ccy)
             except AuthenticationError as ae:
                 user = self.first_name + ' ' + self.last_name
                 logger.error(f'Unable to authenticate user {user}. Check API permissions')
@@ -119,17 +186,22 @@ class Account():
             msg += f'\n - {quote_ccy}: {balance:,.2f}'
         return msg
 
-    def get_summary(self, dry_run: str) -> Optional[str]:
+    def get_summary(self, dry_run: str, market: Optional[MarketSnapshot] = None) -> Optional[str]:
         current_hour = datetime.now().hour
         if current_hour in (7, 8, 22, 23) and not self.contacted_in_the_last(hours=6) and self.notify_to_telegram:
+            import dca
             msg = self._greet()
-            balances_msg = self.get_base_currency_balances()
+            balances_msg = self.get_base_currency_balances(market)
             if balances_msg is None:
                 return None
             
             msg += '\n' + balances_msg
             msg += '\n' + dca.get_dca_summary(self, dry_run)
-            msg += '\n' + self.get_quote_currency_balances()
+            if dry_run or self.is_paper_only():
+                import paper
+                msg += '\n' + paper.get_balances_msg(self.user_id, {symbol.split('/')[1] for symbol in self.get_symbols()})
+            else:
+                msg += '\n' + self.get_quote_currency_balances()
             return msg
         return None
             
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The modules of btclab import each other by their flat names, as when it is run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'btclab'))
+
+import database
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    """
+    Points the database module to an empty database file in a temporary directory
+    """
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setenv('BTCLAB_DB', path)
+    database.close_connections()
+    yield path
+    database.close_connections()
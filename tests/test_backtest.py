@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+import backtest
+from conftest import ROOT
+
+
+@pytest.mark.parametrize('strategy', list(backtest.STRATEGIES))
+def test_no_purchase_dates_invest_nothing(strategy):
+    # 2021-03-01 is a Monday, so no Sunday in the range
+    dates = np.arange('2021-03-01', '2021-03-06', dtype='datetime64[D]')
+    prices = np.linspace(50000, 52000, len(dates))
+
+    result = backtest.run(dates, prices, 50, strategy, weekday=6)
+
+    assert result.summary()['purchases'] == 0
+    assert result.total_invested == 0
+    assert np.isnan(result.total_return) and np.isnan(result.cagr)
+
+
+def test_cli_reports_missing_purchase_dates():
+    args = ['--prices', f'{ROOT}/data/crypto.csv', '--start', '2021-03-01', '--end', '2021-03-05', '--weekday', '6']
+    result = CliRunner().invoke(backtest.main, args)
+
+    assert result.exit_code == 1
+    assert 'No purchase dates' in result.output
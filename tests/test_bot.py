@@ -0,0 +1,46 @@
+import pytest
+
+import exchanges
+import stats
+import database
+import common
+from bot import Bot
+from fakeexchange import FakeExchange
+from users import Account
+
+
+class OtherExchange(FakeExchange):
+    id = 'other'
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(exchanges, 'MARKETS_CACHE_DIR', str(tmp_path))
+    for name in ('_clients', '_public_clients', '_sessions', '_limiters', '_markets_locks', '_markets_expire_on'):
+        monkeypatch.setattr(exchanges, name, {})
+    exchanges.register_exchange(FakeExchange.id, FakeExchange)
+    exchanges.register_exchange(OtherExchange.id, OtherExchange)
+
+
+def create_account(user_id: int, exchange_id: str, symbols: list[str]) -> Account:
+    dip_config = {'order_cost': 10, 'min_drop': 5, 'min_drop_units': '%', 'min_additional_drop_pct': 2,
+                    'is_dummy': 1, 'last_check_result': None, 'last_check_date': None}
+    return Account(user_id, 'Test', 'User', 'test@example.com', common.now_ms(), None, exchange_id, 'key', 'secret',
+                    None, {}, {symbol: dict(dip_config) for symbol in symbols}, False, False)
+
+
+def test_stats_of_each_exchange_are_computed_with_its_own_client(db_file, registry, monkeypatch):
+    database.create_db()
+    refreshed = []
+
+    def refresh_symbols_stats(exchange, symbols, ttl):
+        refreshed.append((exchange.id, sorted(symbols)))
+        return {symbol: {'std_dev': 0.05} for symbol in symbols}
+
+    monkeypatch.setattr(stats, 'refresh_symbols_stats', refresh_symbols_stats)
+    bot = Bot([create_account(1, 'fake', ['COIN1/USDT']), create_account(2, 'other', ['COIN2/USDT']),
+                create_account(3, 'fake', ['COIN3/USDT'])])
+
+    bot.run(dry_run=True)
+
+    assert refreshed == [('fake', ['COIN1/USDT', 'COIN3/USDT']), ('other', ['COIN2/USDT'])]
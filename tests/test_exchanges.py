@@ -0,0 +1,68 @@
+import os
+import time
+
+import pytest
+from ccxt.base.errors import RequestTimeout
+
+import exchanges
+from fakeexchange import FakeExchange
+
+
+class ListingExchange(FakeExchange):
+    """
+    Lists a new symbol every time its markets are downloaded
+    """
+    id = 'listing'
+    downloads = 0
+
+    @classmethod
+    def get_symbols(cls):
+        return [f'COIN{i}/USDT' for i in range(cls.downloads)]
+
+    def load_markets(self, reload=False, params={}):
+        if self.markets and not reload:
+            return self.markets
+        type(self).downloads += 1
+        return super().load_markets(reload, params)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(exchanges, 'MARKETS_CACHE_DIR', str(tmp_path))
+    for name in ('_clients', '_public_clients', '_sessions', '_limiters', '_markets_locks', '_markets_expire_on'):
+        monkeypatch.setattr(exchanges, name, {})
+    monkeypatch.setattr(ListingExchange, 'downloads', 0)
+    exchanges.register_exchange(ListingExchange.id, ListingExchange)
+
+
+def expire_markets():
+    # As if the markets and their cache had been loaded a day and an hour ago
+    past = time.time() - (exchanges.MARKETS_TTL + 1) * 3600
+    os.utime(exchanges._get_markets_file(ListingExchange.id), (past, past))
+    exchanges._markets_expire_on[ListingExchange.id] = past
+
+
+def test_expired_markets_are_reloaded_and_cached(registry):
+    client = exchanges.get_client('listing', 'key', 'secret')
+    assert list(client.load_markets()) == ['COIN0/USDT']
+    assert list(client.load_markets()) == ['COIN0/USDT']
+    assert ListingExchange.downloads == 1
+
+    expire_markets()
+    assert list(client.load_markets()) == ['COIN0/USDT', 'COIN1/USDT']
+    assert ListingExchange.downloads == 2
+    markets, _ = exchanges.read_markets_cache('listing')
+    assert [market['symbol'] for market in markets] == ['COIN0/USDT', 'COIN1/USDT']
+
+
+def test_expired_markets_are_kept_if_they_cannot_be_reloaded(registry, monkeypatch):
+    client = exchanges.get_client('listing', 'key', 'secret')
+    client.load_markets()
+    expire_markets()
+
+    def timeout(*args, **kwargs):
+        raise RequestTimeout('listing GET exchangeInfo timed out')
+
+    monkeypatch.setattr(ListingExchange, 'load_markets', timeout)
+    assert list(client.load_markets()) == ['COIN0/USDT']
+    assert time.time() < exchanges._markets_expire_on['listing'] <= time.time() + exchanges.MARKETS_RETRY
@@ -0,0 +1,17 @@
+import sys
+import subprocess
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.mark.parametrize('module', ['btclab.backtest', 'btclab.sweep'])
+def test_imports_as_installed_package(module):
+    # A new interpreter, so the flat imports of the other tests are not on sys.path
+    subprocess.run([sys.executable, '-c', f'import {module}'], cwd=ROOT, check=True)
+
+
+@pytest.mark.parametrize('script', ['backtest.py', 'sweep.py'])
+def test_runs_as_script(script):
+    subprocess.run([sys.executable, f'btclab/{script}', '--help'], cwd=ROOT, check=True, capture_output=True)
@@ -0,0 +1,45 @@
+import pytest
+from ccxt.base.errors import BadSymbol
+
+import retries
+from fakeexchange import FakeExchange
+from market import MarketSnapshot
+from retries import RetryLater
+
+
+class StrictExchange(FakeExchange):
+    """
+    Rejects the whole request when a symbol is not listed, as ccxt does
+    """
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.requests = 0
+
+    def fetch_tickers(self, symbols=None, params={}):
+        self.requests += 1
+        for symbol in symbols or []:
+            if symbol not in self.markets:
+                raise BadSymbol(f'{self.id} does not have market symbol {symbol}')
+        return super().fetch_tickers(symbols, params)
+
+
+@pytest.fixture
+def market():
+    retries.reset()
+    return MarketSnapshot(StrictExchange())
+
+
+def test_unlisted_symbol_does_not_affect_other_symbols(market):
+    market.refresh(['COIN1/USDT', 'LUNA/USDT'])
+
+    assert market.get_price('COIN1/USDT') > 0
+    assert market.missing == {'LUNA/USDT'}
+
+
+def test_missing_symbol_raises_retry_later_without_refetching(market):
+    market.refresh(['COIN1/USDT', 'LUNA/USDT'])
+
+    for _ in range(3):
+        with pytest.raises(RetryLater):
+            market.get_ticker('LUNA/USDT')
+    assert market.exchange.requests == 1
@@ -0,0 +1,26 @@
+import metrics
+
+
+# Sample suffixes allowed for each metric type by the text exposition format
+SUFFIXES = {'counter': ('', ), 'gauge': ('', ), 'summary': ('', '_count', '_sum')}
+
+
+def test_prometheus_samples_match_the_type_of_their_family():
+    counters = {metrics._key('exchange_requests_total', {'exchange': 'binance'}): 3}
+    timers = {metrics._key('cycle_seconds', {}): [2, 3.0, 2.5],
+                metrics._key('exchange_request_seconds', {'exchange': 'binance'}): [3, 0.6, 0.3]}
+    text = metrics.to_prometheus(counters, timers, {'retry_backoffs': 1})
+
+    types = {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split()
+            assert name not in types
+            types[name] = kind
+            continue
+        sample = line.split('{')[0].split()[0]
+        assert any(sample == name + suffix for name, kind in types.items() for suffix in SUFFIXES[kind]), line
+
+    assert types['btclab_cycle_seconds'] == 'summary'
+    assert types['btclab_cycle_seconds_max'] == 'gauge'
+    assert 'btclab_exchange_request_seconds_max{exchange="binance"} 0.300000' in text
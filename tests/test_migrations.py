@@ -0,0 +1,169 @@
+import time
+import sqlite3
+
+import pytest
+
+import common
+import database
+
+
+# Tables created by the first version of the database, before any migration
+BASELINE_SCHEMA = """
+    CREATE TABLE user (
+        user_id integer PRIMARY KEY,
+        first_name text NOT NULL,
+        last_name text NOT NULL,
+        email text NOT NULL UNIQUE,
+        is_active integer DEFAULT 1,
+        created_on text NOT NULL,
+        last_contact text,
+        exchange_id text NOT NULL,
+        api_key text NOT NULL UNIQUE,
+        api_secret text NOT NULL UNIQUE,
+        telegram_bot_token text NOT NULL,
+        telegram_chat_id text UNIQUE,
+        notify_to_telegram integer DEFAULT 1,
+        notify_to_email integer DEFAULT 0
+    );
+    CREATE TABLE dca_config (
+        user_id integer NOT NULL,
+        symbol text NOT NULL,
+        order_cost real NOT NULL,
+        frequency integer NOT NULL,
+        is_active integer DEFAULT 1,
+        is_dummy integer DEFAULT 0,
+        last_check_date text,
+        last_check_result text,
+        UNIQUE (user_id, symbol),
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    );
+    CREATE TABLE dip_config (
+        user_id integer NOT NULL,
+        symbol text NOT NULL,
+        order_cost real NOT NULL,
+        min_drop_value real NOT NULL,
+        min_drop_units text NOT NULL,
+        min_additional_drop_pct real NOT NULL,
+        additional_drop_cost_increase real DEFAULT 0,
+        is_active integer DEFAULT 1,
+        is_dummy integer DEFAULT 0,
+        last_check_date text,
+        last_check_result text,
+        UNIQUE (user_id, symbol),
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    );
+    CREATE TABLE exchange_order (
+        order_id text NOT NULL,
+        datetime text NOT NULL,
+        symbol text NOT NULL,
+        type text NOT NULL,
+        side text NOT NULL,
+        price real,
+        amount real,
+        cost real,
+        strategy text NOT NULL,
+        is_dummy integer NOT NULL,
+        user_id integer NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    );
+    CREATE TABLE symbol (
+        symbol text NOT NULL,
+        std_dev real NOT NULL,
+        updated_on integer NOT NULL,
+        comments text
+    );
+"""
+
+
+def create_baseline_db(path: str):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("""INSERT INTO user (user_id, first_name, last_name, email, created_on, exchange_id, api_key,
+                                        api_secret, telegram_bot_token)
+                    VALUES (1, 'Ana', 'Doe', 'ana@example.com', '2021-03-04 05:06:07', 'binance', 'key', 'secret', 
+                            'token')""")
+    conn.execute("""INSERT INTO user (user_id, first_name, last_name, email, created_on, exchange_id, api_key,
+                                        api_secret, telegram_bot_token)
+                    VALUES (2, 'Bo', 'Doe', 'bo@example.com', '', 'binance', 'key2', 'secret2', 'token')""")
+    orders = [('1', '2021-03-05T10:00:00.000Z'), ('2', ''), ('3', 'not a date')]
+    conn.executemany("""INSERT INTO exchange_order (order_id, datetime, symbol, type, side, price, amount, cost,
+                                                    strategy, is_dummy, user_id)
+                        VALUES (?, ?, 'BTC/USDT', 'market', 'buy', 100, 0.1, 10, 'DCA', 0, 1)""", orders)
+    conn.commit()
+    conn.close()
+
+
+def test_migrates_baseline_db_with_blank_dates(db_file):
+    create_baseline_db(db_file)
+
+    database.create_db()
+
+    conn = sqlite3.connect(db_file)
+    try:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(database.MIGRATIONS)
+        orders = conn.execute('SELECT order_id, timestamp FROM exchange_order ORDER BY order_id').fetchall()
+        assert orders == [('1', 1614938400000), ('2', 0), ('3', 0)]
+        users = conn.execute('SELECT user_id, created_on FROM user ORDER BY user_id').fetchall()
+        assert users == [(1, 1614834367000), (2, 0)]
+        latest = conn.execute('SELECT order_id, timestamp FROM latest_order').fetchall()
+        assert latest == [('3', 0)]
+    finally:
+        conn.close()
+
+
+def test_migrated_db_can_be_opened_again(db_file):
+    create_baseline_db(db_file)
+    database.create_db()
+    database.close_connections()
+
+    database.create_db()
+
+    order = database.get_latest_order(1, 'BTC/USDT', False, None)
+    assert order.id == '3' and order.timestamp == 0
+
+
+def get_schema(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    try:
+        tables = [name for (name, ) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        schema = {table: conn.execute(f'PRAGMA table_info({table})').fetchall() for table in tables}
+        schema['indexes'] = conn.execute("""SELECT name, tbl_name FROM sqlite_master 
+                                            WHERE type = 'index' AND name NOT LIKE 'sqlite_autoindex%'
+                                            ORDER BY name""").fetchall()
+        schema['user_version'] = conn.execute('PRAGMA user_version').fetchone()[0]
+        return schema
+    finally:
+        conn.close()
+
+
+def test_new_db_has_the_schema_of_a_migrated_db(db_file, tmp_path, monkeypatch):
+    database.create_db()
+    new_schema = get_schema(db_file)
+
+    migrated_file = str(tmp_path / 'migrated.db')
+    monkeypatch.setenv('BTCLAB_DB', migrated_file)
+    database.close_connections()
+    create_baseline_db(migrated_file)
+    database.create_db()
+
+    assert new_schema == get_schema(migrated_file)
+
+
+def test_migrates_notification_dates(db_file, monkeypatch):
+    create_baseline_db(db_file)
+    version = database.MIGRATIONS.index(database._use_epoch_notification_dates)
+    monkeypatch.setattr(database, 'MIGRATIONS', database.MIGRATIONS[:version])
+    database.create_db()
+    conn = sqlite3.connect(db_file)
+    conn.execute("""INSERT INTO notification (bot_token, chat_id, text, created_on) 
+                    VALUES ('token', 'chat', 'Hi', '2021-03-04 05:06:07')""")
+    conn.commit()
+    conn.close()
+    monkeypatch.undo()
+    monkeypatch.setenv('BTCLAB_DB', db_file)
+
+    database.create_db()
+
+    rows = database.claim_pending_notifications('test', time.time(), time.time() + 60)
+    assert [row[:5] for row in rows] == [(1, 'token', 'chat', 'Hi', 0)]
+    assert rows[0][5] == pytest.approx((common.now_ms() - 1614834367000) / 1000, abs=5)
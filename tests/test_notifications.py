@@ -0,0 +1,56 @@
+import time
+
+import database
+import notifications
+
+
+def enqueue_messages(count: int):
+    for i in range(count):
+        database.enqueue_notification(f'token{i}', f'chat{i}', f'Message {i}')
+
+
+def test_claimed_notifications_are_not_claimed_by_others(db_file):
+    database.create_db()
+    enqueue_messages(3)
+    now = time.time()
+
+    first = database.claim_pending_notifications('worker1', now, now + 60)
+    second = database.claim_pending_notifications('worker2', now, now + 60)
+
+    assert [row[0] for row in first] == [1, 2, 3]
+    assert second == []
+    assert len(database.claim_pending_notifications('worker1', now, now + 60)) == 3
+    assert len(database.claim_pending_notifications('worker2', now + 61, now + 120)) == 3
+
+
+def test_deferred_and_released_notifications_can_be_claimed_by_others(db_file):
+    database.create_db()
+    enqueue_messages(2)
+    now = time.time()
+    database.claim_pending_notifications('worker1', now, now + 60)
+
+    database.defer_notifications([1], now, notifications.MAX_ATTEMPTS)
+    assert [row[0] for row in database.claim_pending_notifications('worker2', now, now + 60)] == [1]
+
+    database.release_notifications('worker1')
+    assert [row[0] for row in database.claim_pending_notifications('worker3', now, now + 60)] == [2]
+
+
+def test_workers_sharing_the_outbox_send_each_message_once(db_file, monkeypatch):
+    database.create_db()
+    enqueue_messages(20)
+    workers = [notifications.NotificationWorker(), notifications.NotificationWorker()]
+    sent = []
+
+    def post(worker, bot_token, chat_id, text):
+        sent.append(text)
+        # The second worker reads the outbox while the first one is still sending
+        if worker is workers[0] and len(sent) == 1:
+            workers[1].send_pending()
+    monkeypatch.setattr(notifications.NotificationWorker, '_post', post)
+
+    for worker in workers:
+        worker.send_pending()
+
+    assert sorted(sent) == sorted(f'Message {i}' for i in range(20))
+    assert database.count_pending_notifications() == 0
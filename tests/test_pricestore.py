@@ -0,0 +1,31 @@
+import os
+import sys
+import subprocess
+
+from conftest import ROOT
+
+
+def run(args: list[str], cwd: str, **env) -> str:
+    process = subprocess.run([sys.executable, *args], cwd=cwd, env={**os.environ, **env}, capture_output=True,
+                                text=True, check=True)
+    return process.stdout
+
+
+def test_store_is_in_the_repository_wherever_it_is_used_from(tmp_path, monkeypatch):
+    monkeypatch.delenv('BTCLAB_PRICES', raising=False)
+    stdout = run(['-c', 'import btclab.pricestore as pricestore; print(pricestore.STORE_DIR)'], str(tmp_path),
+                    PYTHONPATH=ROOT)
+
+    assert stdout.strip() == os.path.join(ROOT, 'data', 'prices')
+
+
+def test_backtest_reads_the_default_store_from_another_directory(tmp_path):
+    store = str(tmp_path / 'prices')
+    run([f'{ROOT}/btclab/pricestore.py', 'import-csv', f'{ROOT}/data/crypto.csv'], str(tmp_path), BTCLAB_PRICES=store)
+    cwd = tmp_path / 'elsewhere'
+    cwd.mkdir()
+
+    stdout = run([f'{ROOT}/btclab/backtest.py', '--start', '2021-01-01', '--strategy', 'fixed'], str(cwd),
+                    BTCLAB_PRICES=store)
+
+    assert 'fixed' in stdout
@@ -0,0 +1,118 @@
+import pytest
+from ccxt.base.errors import RequestTimeout
+
+import retries
+from retries import RetryLater
+
+
+class Exchange():
+    id = 'test'
+    apiKey = 'key'
+
+    def __init__(self):
+        self.calls = 0
+        self.failing = True
+
+@retries.with_backoff('fetch_ticker')
+def fetch_ticker(exchange: Exchange) -> str:
+    exchange.calls += 1
+    if exchange.failing:
+        raise RequestTimeout('timed out')
+    return 'ticker'
+
+
+class Clock():
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    retries.reset()
+    clock = Clock(1700000000.0)
+    monkeypatch.setattr(retries.time, 'time', clock.time)
+    monkeypatch.setattr(retries, 'JITTER', 0)
+    yield clock
+    retries.reset()
+
+
+def test_backoff_doubles_until_the_retries_are_exhausted(clock):
+    exchange = Exchange()
+    delays = []
+    for _ in range(retries.MAX_RETRIES):
+        with pytest.raises(RetryLater) as error:
+            fetch_ticker(exchange)
+        delays.append(error.value.retry_at - clock.now)
+
+        # Calls before the retry time do not reach the exchange
+        calls = exchange.calls
+        with pytest.raises(RetryLater):
+            fetch_ticker(exchange)
+        assert exchange.calls == calls
+        clock.now = error.value.retry_at
+
+    assert delays == [15, 30, 60, 120, 240]
+    with pytest.raises(RequestTimeout):
+        fetch_ticker(exchange)
+    # The backoff starts over after giving up
+    with pytest.raises(RetryLater) as error:
+        fetch_ticker(exchange)
+    assert error.value.retry_at - clock.now == retries.BASE_DELAY
+
+
+def test_delay_is_capped():
+    assert retries._get_delay(20) <= retries.MAX_DELAY * (1 + retries.JITTER)
+
+
+def test_success_resets_the_backoff(clock):
+    exchange = Exchange()
+    with pytest.raises(RetryLater) as error:
+        fetch_ticker(exchange)
+    clock.now = error.value.retry_at
+    exchange.failing = False
+
+    assert fetch_ticker(exchange) == 'ticker'
+    assert retries.get_stats()['backoffs'] == 0
+
+
+def test_circuit_opens_after_consecutive_failures_and_resets_on_success(clock):
+    # Each client backs off on its own, but they all count for the circuit of the exchange
+    clients = [Exchange() for _ in range(retries.BREAKER_THRESHOLD)]
+    for i, client in enumerate(clients):
+        client.apiKey = f'key{i}'
+        with pytest.raises(RetryLater):
+            fetch_ticker(client)
+
+    other = Exchange()
+    other.apiKey = 'other'
+    with pytest.raises(RetryLater) as error:
+        fetch_ticker(other)
+    assert other.calls == 0
+    assert error.value.retry_at == clock.now + retries.BREAKER_COOLDOWN
+    assert retries.get_stats()['open_circuits'] == 1
+
+    # After the cooldown a single call is let through, and its failure opens the circuit again
+    clock.now += retries.BREAKER_COOLDOWN
+    with pytest.raises(RetryLater):
+        fetch_ticker(other)
+    assert other.calls == 1
+    with pytest.raises(RetryLater):
+        fetch_ticker(clients[0])
+    assert clients[0].calls == 1
+
+    clock.now += retries.BREAKER_COOLDOWN
+    other.failing = False
+    clients[0].failing = False
+    assert fetch_ticker(other) == 'ticker'
+    assert fetch_ticker(clients[0]) == 'ticker'
+    assert retries.get_stats()['open_circuits'] == 0
+
+    # The failures before the success do not count anymore
+    clients[1].failing = True
+    clock.now += retries.BASE_DELAY * 2
+    with pytest.raises(RetryLater):
+        fetch_ticker(clients[1])
+    assert fetch_ticker(clients[0]) == 'ticker'
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+
+import database
+from common import Strategy
+from scheduler import Scheduler
+
+
+NOW = 1700000000.0
+DAY = 86400
+
+
+def create_account(user_id: int, dca_config: dict, dips_config: Optional[dict] = None) -> SimpleNamespace:
+    return SimpleNamespace(user_id=user_id, dca_config=dca_config, dips_config=dips_config or {}, shard=None,
+                            deferred={})
+
+
+def config(frequency: int, is_dummy: int = 0, **check) -> dict:
+    return {'frequency': frequency, 'is_dummy': is_dummy, 'last_check_result': None, 'last_check_date': None, **check}
+
+
+def test_only_due_pairs_are_popped():
+    scheduler = Scheduler()
+    scheduler.schedule(1, 'BTC/USDT', Strategy.DCA, NOW - 10)
+    scheduler.schedule(1, 'ETH/USDT', Strategy.BUY_THE_DIPS, NOW)
+    scheduler.schedule(2, 'BTC/USDT', Strategy.DCA, NOW + 10)
+
+    assert scheduler.pop_due(NOW) == {1: {Strategy.DCA: {'BTC/USDT'}, Strategy.BUY_THE_DIPS: {'ETH/USDT'}}}
+    assert scheduler.pop_due(NOW) == {}
+    assert len(scheduler) == 1
+    assert scheduler.next_due() == NOW + 10
+
+
+def test_rescheduled_pair_is_only_popped_at_its_new_time():
+    scheduler = Scheduler()
+    scheduler.schedule(1, 'BTC/USDT', Strategy.DCA, NOW)
+    scheduler.schedule(1, 'BTC/USDT', Strategy.DCA, NOW + DAY)
+
+    assert scheduler.pop_due(NOW) == {}
+    assert scheduler.next_due() == NOW + DAY
+    assert scheduler.pop_due(NOW + DAY) == {1: {Strategy.DCA: {'BTC/USDT'}}}
+
+
+def test_removed_user_is_not_popped():
+    scheduler = Scheduler()
+    scheduler.schedule(1, 'BTC/USDT', Strategy.DCA, NOW)
+    scheduler.schedule(2, 'BTC/USDT', Strategy.DCA, NOW)
+    scheduler.remove_user(1)
+
+    assert scheduler.pop_due(NOW) == {2: {Strategy.DCA: {'BTC/USDT'}}}
+
+
+def test_accounts_are_scheduled_from_their_last_orders(db_file):
+    database.create_db()
+    database.save_order({'id': '1', 'timestamp': int((NOW - 2 * DAY) * 1000), 'symbol': 'BTC/USDT', 'type': 'market',
+                            'side': 'buy', 'price': 30000, 'amount': 0.001, 'cost': 30, 'is_dummy': False,
+                            'user_id': 1}, Strategy.DCA)
+    waiting = {'last_check_result': 'Insufficient funds', 'last_check_date': int((NOW - 30 * 60) * 1000)}
+    account = create_account(1, {'BTC/USDT': config(7), 'ETH/USDT': config(7), 'ADA/USDT': config(1)},
+                                {'BTC/USDT': dict(waiting, is_dummy=0)})
+    account.dca_config['ADA/USDT'].update(waiting)
+    scheduler = Scheduler()
+
+    scheduler.schedule_accounts([account], False, NOW)
+
+    # BTC was bought 2 days ago every 7, ETH never and ADA waits 90 minutes after insufficient funds
+    assert scheduler.pop_due(NOW) == {1: {Strategy.DCA: {'ETH/USDT'}}}
+    assert scheduler.pop_due(NOW + 60 * 60) == {1: {Strategy.DCA: {'ADA/USDT'}, Strategy.BUY_THE_DIPS: {'BTC/USDT'}}}
+    assert scheduler.next_due() == pytest.approx(NOW + 5 * DAY)
+
+
+def test_visited_pairs_are_rescheduled_after_their_new_order_or_retry_time(db_file):
+    database.create_db()
+    account = create_account(1, {'BTC/USDT': config(7), 'ETH/USDT': config(7)})
+    scheduler = Scheduler()
+    scheduler.schedule_accounts([account], False, NOW)
+    visited = scheduler.pop_due(NOW)[1]
+
+    database.save_order({'id': '1', 'timestamp': int(NOW * 1000), 'symbol': 'BTC/USDT', 'type': 'market',
+                            'side': 'buy', 'price': 30000, 'amount': 0.001, 'cost': 30, 'is_dummy': False,
+                            'user_id': 1}, Strategy.DCA)
+    account.deferred[(Strategy.DCA, 'ETH/USDT')] = NOW + 600
+    scheduler.reschedule(account, visited, False, NOW)
+
+    assert scheduler.pop_due(NOW) == {}
+    assert scheduler.pop_due(NOW + 600) == {1: {Strategy.DCA: {'ETH/USDT'}}}
+    assert scheduler.next_due() == pytest.approx(NOW + 7 * DAY)
@@ -0,0 +1,95 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import common
+import database
+import sharding
+from common import Strategy
+from scheduler import Scheduler
+from users import Account
+
+
+DCA_CONFIG = {'frequency': 7, 'is_dummy': 0, 'last_check_result': None, 'last_check_date': None}
+
+
+def test_claim_is_refused_within_the_interval_of_the_previous_one(db_file, monkeypatch):
+    database.create_db()
+    # Just before the boundary of a fixed 7 day window
+    now = 7 * common.MS_IN_A_DAY * 2700 - 1000
+    monkeypatch.setattr(database, 'now_ms', lambda: now)
+    dead_worker, new_worker = sharding.Shard(1, 0), sharding.Shard(1, 0)
+
+    with dead_worker.claim(1, 'BTC/USDT', Strategy.DCA, DCA_CONFIG) as claimed:
+        assert claimed
+
+    now += 5000
+    with new_worker.claim(1, 'BTC/USDT', Strategy.DCA, DCA_CONFIG) as claimed:
+        assert not claimed
+
+    now += 7 * common.MS_IN_A_DAY
+    with new_worker.claim(1, 'BTC/USDT', Strategy.DCA, DCA_CONFIG) as claimed:
+        assert claimed
+
+
+def test_claim_is_released_when_the_order_was_not_placed(db_file):
+    database.create_db()
+    shard = sharding.Shard(1, 0)
+
+    with pytest.raises(ValueError):
+        with shard.claim(1, 'BTC/USDT', Strategy.DCA, DCA_CONFIG) as claimed:
+            assert claimed
+            raise ValueError('Order rejected')
+
+    with shard.claim(1, 'BTC/USDT', Strategy.DCA, DCA_CONFIG) as claimed:
+        assert claimed
+
+
+def test_scheduler_waits_frequency_days_after_the_last_claim(db_file):
+    database.create_db()
+    shard = sharding.Shard(1, 0)
+    with shard.claim(1, 'BTC/USDT', Strategy.DCA, DCA_CONFIG) as claimed:
+        assert claimed
+    claimed_on = database.get_latest_claim_dates(Strategy.DCA)[(1, 'BTC/USDT')]
+    account = SimpleNamespace(user_id=1, dca_config={'BTC/USDT': DCA_CONFIG}, dips_config={}, shard=shard)
+    scheduler = Scheduler()
+
+    scheduler.schedule_accounts([account], False, claimed_on / 1000)
+
+    assert scheduler.next_due() == pytest.approx(claimed_on / 1000 + 7 * 86400)
+
+
+def test_expired_claims_are_pruned(db_file):
+    database.create_db()
+    now = common.now_ms()
+    conn = sqlite3.connect(db_file)
+    conn.execute("""INSERT INTO dca_config (user_id, symbol, order_cost, frequency) VALUES (1, 'BTC/USDT', 10, 7)""")
+    conn.executemany("""INSERT INTO order_claim (user_id, symbol, strategy, owner, claimed_on) 
+                        VALUES (1, 'BTC/USDT', 'dca', 'worker', ?)""", 
+                        [(now - 8 * common.MS_IN_A_DAY, ), (now - 6 * common.MS_IN_A_DAY, )])
+    conn.commit()
+    conn.close()
+
+    assert database.prune_order_claims(sharding.DIP_CLAIM_INTERVAL) == 1
+    assert database.get_latest_claim_dates(Strategy.DCA) == {(1, 'BTC/USDT'): now - 6 * common.MS_IN_A_DAY}
+
+
+def test_dry_run_order_does_not_block_a_real_one(db_file):
+    database.create_db()
+    account = Account(1, 'Test', 'User', 'test@example.com', common.now_ms(), None, 'fake', 'key', 'secret', None,
+                        {'BTC/USDT': DCA_CONFIG}, {}, False, False)
+    account.shard = sharding.Shard(1, 0)
+
+    with account.claim_order('BTC/USDT', Strategy.DCA, is_dummy=True) as claimed:
+        assert claimed
+    assert database.get_latest_claim_dates(Strategy.DCA) == {}
+
+    with account.claim_order('BTC/USDT', Strategy.DCA, is_dummy=False) as claimed:
+        assert claimed
+    claimed_on = database.get_latest_claim_dates(Strategy.DCA)[(1, 'BTC/USDT')]
+
+    # The claim of the real order does not delay the dry runs either
+    scheduler = Scheduler()
+    scheduler.schedule_accounts([account], True, claimed_on / 1000)
+    assert scheduler.next_due() == pytest.approx(claimed_on / 1000)
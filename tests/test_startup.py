@@ -0,0 +1,29 @@
+import os
+import sys
+import json
+import subprocess
+
+import bench
+from conftest import ROOT
+
+
+def run_empty_cycle(db_file: str) -> dict:
+    """
+    Runs the bot in a new interpreter against an empty database, a cycle that only
+    finds there is nothing to do, and returns its seconds and loaded modules
+    """
+    process = subprocess.run([sys.executable, '-c', bench.STARTUP_SCRIPT], cwd=os.path.join(ROOT, 'btclab'),
+                                env={**os.environ, 'BTCLAB_DB': db_file}, capture_output=True, text=True, check=True)
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def test_empty_cycle_starts_quickly_without_heavy_modules(tmp_path):
+    db_file = str(tmp_path / 'startup.db')
+    # The fastest of a few runs, so a busy machine does not fail the test
+    runs = [run_empty_cycle(db_file) for _ in range(3)]
+    fastest = min(runs, key=lambda run: run['seconds'])
+
+    assert fastest['seconds'] < bench.STARTUP_TARGET
+    for run in runs:
+        loaded = {module.split('.')[0] for module in run['modules']}
+        assert loaded.isdisjoint({'ccxt', 'pandas', 'numpy', 'requests'})
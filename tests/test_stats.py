@@ -0,0 +1,55 @@
+import random
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import database
+import stats
+from fakeexchange import FakeExchange
+from stats import RunningMoments
+
+
+DAY = 86400 * 1000
+
+
+def test_running_moments_match_pandas():
+    rng = random.Random(0)
+    values = [rng.gauss(0, 0.04) for _ in range(200)]
+    moments = RunningMoments()
+    for value in values:
+        moments.add(value)
+
+    assert moments.mean == pytest.approx(pd.Series(values).mean())
+    assert moments.std_dev == pytest.approx(pd.Series(values).std())
+
+    for value in values[:50]:
+        moments.remove(value)
+    assert moments.count == 150
+    assert moments.mean == pytest.approx(pd.Series(values[50:]).mean())
+    assert moments.std_dev == pytest.approx(pd.Series(values[50:]).std())
+
+
+def test_incremental_update_matches_pandas_over_the_window(db_file, monkeypatch):
+    database.create_db()
+    rng = random.Random(1)
+    start = 1600000000000 // DAY * DAY
+    closes = [100.0]
+    for _ in range(99):
+        closes.append(closes[-1] * (1 + rng.gauss(0, 0.05)))
+    candles = [[start + i * DAY, close, close, close, close, 1.0] for i, close in enumerate(closes)]
+    exchange = FakeExchange()
+    window = 30
+
+    def update(days: int) -> RunningMoments:
+        # Candles until the one of the given day are closed
+        monkeypatch.setattr(stats, 'time', SimpleNamespace(time=lambda: (start + (days + 1) * DAY) / 1000))
+        database.save_candles(exchange.id, 'BTC/USDT', '1d', candles[:days + 1])
+        return stats.update_moments(exchange, 'BTC/USDT', '1d', window)
+
+    for days in (60, 61, 75, 99):
+        moments = update(days)
+        expected = pd.Series(closes[:days + 1]).pct_change().iloc[-window:]
+        assert moments.count == window
+        assert moments.mean == pytest.approx(expected.mean())
+        assert moments.std_dev == pytest.approx(expected.std())
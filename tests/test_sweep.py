@@ -0,0 +1,26 @@
+import numpy as np
+
+import sweep
+
+
+def test_only_outlier_scaled_is_crossed_with_variations():
+    grid = {
+        'symbol': ['BTC/USDT'],
+        'schedule': sweep.weekly(),
+        'sizing': sweep.sizing(['fixed', 'outlier_scaled', 'sd_scaled'], np.linspace(0, 1, 5)),
+    }
+    runs = sweep.expand_grid(grid)
+
+    assert len(runs) == 7 * (1 + 5 + 1)
+    assert len({tuple(sorted(run.items())) for run in runs}) == len(runs)
+    assert {run['variation'] for run in runs if run['strategy'] != 'outlier_scaled'} == {None}
+
+
+def test_sweep_results_have_one_row_per_run():
+    dates = np.arange('2021-01-01', '2022-01-01', dtype='datetime64[D]')
+    prices = {'BTC/USDT': (dates, np.linspace(30000, 40000, len(dates)))}
+    grid = {'schedule': sweep.monthly([1, 15]), 'sizing': sweep.sizing(['fixed', 'outlier_scaled'], [0, 1])}
+    df = sweep.run_sweep(prices, grid, processes=1)
+
+    assert len(df) == 2 * (1 + 2)
+    assert df[df['strategy'] == 'fixed']['variation'].isna().all()
@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+import common
+import database
+from common import Strategy
+
+
+def create_user(db_file: str):
+    database.create_db()
+    conn = sqlite3.connect(db_file)
+    conn.execute("""INSERT INTO user (user_id, first_name, last_name, email, created_on, exchange_id, api_key, 
+                        api_secret, telegram_bot_token) 
+                    VALUES (1, 'Test', 'User', 'test@example.com', ?, 'binance', 'key', 'secret', 'token')""",
+                    (common.now_ms(), ))
+    conn.execute("""INSERT INTO dca_config (user_id, symbol, order_cost, frequency) VALUES (1, 'BTC/USDT', 10, 7)""")
+    conn.commit()
+    conn.close()
+
+
+def create_order(order_id: str, is_dummy: bool) -> dict:
+    return {'id': order_id, 'timestamp': common.now_ms(), 'symbol': 'BTC/USDT', 'type': 'market', 'side': 'buy',
+            'price': 30000, 'amount': 0.001, 'cost': 30, 'is_dummy': is_dummy, 'user_id': 1}
+
+
+def read_state(db_file: str) -> tuple:
+    # A connection of its own, so only what was committed is seen
+    conn = sqlite3.connect(db_file)
+    try:
+        orders = [row[0] for row in conn.execute('SELECT order_id FROM exchange_order ORDER BY order_id')]
+        check = conn.execute('SELECT last_check_result FROM dca_config WHERE user_id = 1').fetchone()[0]
+        contact = conn.execute('SELECT last_contact FROM user WHERE user_id = 1').fetchone()[0]
+    finally:
+        conn.close()
+    return orders, check, contact
+
+
+def test_writes_are_pending_until_the_unit_is_flushed(db_file):
+    create_user(db_file)
+
+    with database.unit_of_work() as unit:
+        database.save_order(create_order('dummy-1', True), Strategy.DCA)
+        database.update_last_check(1, 'BTC/USDT', Strategy.DCA, 'No action')
+        database.update_last_contact(1)
+
+        assert len(unit) == 3
+        assert read_state(db_file) == ([], None, None)
+        # Pending orders are visible to the bot before they are written
+        assert database.get_latest_order(1, 'BTC/USDT', True, Strategy.DCA).id == 'dummy-1'
+
+        unit.flush()
+        orders, check, contact = read_state(db_file)
+        assert (orders, check) == (['dummy-1'], 'No action')
+        assert contact is not None
+        assert len(unit) == 0
+
+
+def test_unit_is_flushed_when_it_ends_even_on_errors(db_file):
+    create_user(db_file)
+
+    with pytest.raises(ValueError):
+        with database.unit_of_work():
+            database.save_order(create_order('dummy-1', True), Strategy.DCA)
+            database.update_last_check(1, 'BTC/USDT', Strategy.DCA, 'No action')
+            raise ValueError('Cycle failed')
+
+    assert read_state(db_file)[:2] == (['dummy-1'], 'No action')
+    assert database.get_unit_of_work() is None
+
+
+def test_real_order_flushes_the_unit(db_file):
+    create_user(db_file)
+
+    with database.unit_of_work() as unit:
+        database.update_last_check(1, 'BTC/USDT', Strategy.DCA, 'No action')
+        database.save_order(create_order('real-1', False), Strategy.DCA)
+
+        assert len(unit) == 0
+        assert read_state(db_file)[:2] == (['real-1'], 'No action')